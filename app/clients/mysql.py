@@ -1,23 +1,403 @@
+import asyncio
+import itertools
+import logging
 import typing
+import zlib
 from contextlib import asynccontextmanager
+from time import perf_counter
 
-from sqlalchemy.ext.asyncio import AsyncSession, async_sessionmaker, create_async_engine
+from sqlalchemy import Connection, Engine, QueuePool, event, text
+from sqlalchemy.engine.interfaces import DBAPICursor, ExecutionContext
+from sqlalchemy.ext.asyncio import AsyncConnection, AsyncEngine, AsyncSession, async_sessionmaker, create_async_engine
+from sqlalchemy.orm import Session
+from sqlalchemy.pool import AsyncAdaptedQueuePool, ConnectionPoolEntry
+from sqlalchemy.sql import Select
+from sqlalchemy.util import await_only
 
 from app.config import config
+from app.utils.admission import Admission, current_admission
+from app.utils.sql_stats import sql_stats
 
-async_engine = create_async_engine(
-    str(config.MYSQL_DSN),
-    pool_size=config.MYSQL_POOL_SIZE,
-    max_overflow=config.MYSQL_MAX_OVERFLOW,
-    pool_timeout=config.MYSQL_POOL_TIMEOUT,
+
+class TimedQueuePool(AsyncAdaptedQueuePool):
+    """Records how long each checkout waits for a connection, including the time to connect a new one.
+
+    Checkouts beyond the pool size and overflow wait in the admission queue by the priority and deadline of their
+    requests, instead of failing as soon as the pool is exhausted.
+    """
+
+    def __init__(self, *args: typing.Any, **kwargs: typing.Any) -> None:
+        super().__init__(*args, **kwargs)
+        unlimited = self.size() <= 0 or self._max_overflow < 0
+        self.admission = (
+            None if unlimited else Admission(self.size() + self._max_overflow, config.MYSQL_POOL_QUEUE_SIZE)
+        )
+
+    def _do_get(self) -> ConnectionPoolEntry:
+        started_at = perf_counter()
+        try:
+            if self.admission is not None:
+                await_only(self.admission.acquire(*current_admission()))
+            try:
+                return super()._do_get()
+            except BaseException:
+                if self.admission is not None:
+                    self.admission.release()
+                raise
+        finally:
+            sql_stats.record_checkout(perf_counter() - started_at)
+
+    def _do_return_conn(self, record: ConnectionPoolEntry) -> None:
+        super()._do_return_conn(record)
+        if self.admission is not None:
+            self.admission.release()
+
+
+def start_query_timer(
+    connection: Connection,
+    cursor: DBAPICursor,
+    statement: str,
+    parameters: typing.Any,
+    context: ExecutionContext | None,
+    executemany: bool,
+) -> None:
+    connection.info['query_started_at'] = perf_counter()
+
+
+def record_query(
+    connection: Connection,
+    cursor: DBAPICursor,
+    statement: str,
+    parameters: typing.Any,
+    context: ExecutionContext | None,
+    executemany: bool,
+) -> None:
+    elapsed = perf_counter() - connection.info.pop('query_started_at')
+    # the rows of a server-side cursor are not fetched yet
+    streaming = context is not None and context.execution_options.get('stream_results', False)
+    rows = 0 if streaming else max(cursor.rowcount, 0)
+    sql_stats.record_query(statement, parameters, elapsed, rows)
+
+
+def instrument(engine: AsyncEngine) -> None:
+    """Records the latency and rows of each statement executed by the engine."""
+    event.listen(engine.sync_engine, 'before_cursor_execute', start_query_timer)
+    event.listen(engine.sync_engine, 'after_cursor_execute', record_query)
+
+
+class RoutingSession(Session):
+    """Sends the reads to the replica engine if it's given, and everything else to the primary.
+
+    Locking reads (`for_update` / `for_read`), writes and flushes go to the primary, and so does every statement after
+    them, so that the session can read its own writes and the rows it has locked.
+    """
+
+    def __init__(self, *args: typing.Any, replica: Engine | None = None, **kwargs: typing.Any) -> None:
+        super().__init__(*args, **kwargs)
+        self.replica = replica
+
+    def get_bind(self, mapper: typing.Any = None, *, clause: typing.Any = None, **kwargs: typing.Any) -> typing.Any:
+        if self.replica is not None:
+            if isinstance(clause, Select) and clause._for_update_arg is None and not self._flushing:
+                return self.replica
+            self.replica = None  # stick to the primary
+        return super().get_bind(mapper, clause=clause, **kwargs)
+
+
+def reads_from_replica(session: AsyncSession) -> bool:
+    """Whether the next read of the session is served by a replica, which may be behind the primary."""
+    return getattr(session.sync_session, 'replica', None) is not None
+
+
+class Replica:
+    def __init__(self, name: str, engine: AsyncEngine) -> None:
+        self.name = name
+        self.engine = engine
+        self.lag: float | None = None  # seconds behind the primary, None if unknown or the replication is stopped
+        self.sessions = 0
+
+
+class ReplicaSet:
+    """Picks a replica for each readonly session, skipping the replicas which lag more than `max_lag` seconds behind.
+
+    The lag of each replica is checked every `check_interval` seconds. Until a replica is known to be fresh enough,
+    its sessions fall back to the primary.
+    """
+
+    def __init__(
+        self,
+        engines: typing.Sequence[AsyncEngine],
+        balance: typing.Literal['round_robin', 'least_connections'],
+        max_lag: float,
+        check_interval: float,
+    ) -> None:
+        self.replicas = [Replica(f'replica{i}', engine) for i, engine in enumerate(engines)]
+        self.balance = balance
+        self.max_lag = max_lag
+        self.check_interval = check_interval
+        self.counter = itertools.count()
+        self.task: asyncio.Task | None = None
+        self.fallbacks = 0
+
+    def choose(self) -> Replica | None:
+        if not self.replicas:
+            return None
+        self.start()
+        available = [replica for replica in self.replicas if replica.lag is not None and replica.lag <= self.max_lag]
+        if not available:
+            self.fallbacks += 1
+            return None
+        if self.balance == 'least_connections':
+            replica = min(available, key=lambda replica: pool_of(replica.engine).checkedout())
+        else:
+            replica = available[next(self.counter) % len(available)]
+        replica.sessions += 1
+        return replica
+
+    def start(self) -> None:
+        if self.task is None:
+            self.task = asyncio.get_running_loop().create_task(self.run())
+
+    async def close(self) -> None:
+        if self.task is not None:
+            self.task.cancel()
+            try:
+                await self.task
+            except asyncio.CancelledError:
+                pass
+            self.task = None
+
+    async def run(self) -> None:
+        while True:
+            await asyncio.gather(*(self.check(replica) for replica in self.replicas))
+            await asyncio.sleep(self.check_interval)
+
+    async def check(self, replica: Replica) -> None:
+        try:
+            async with replica.engine.connect() as connection:
+                status = (await connection.execute(text('SHOW REPLICA STATUS'))).mappings().first()
+        except Exception:
+            logging.exception('failed to check the lag of %s', replica.name)
+            replica.lag = None
+            return
+        if status is None:  # not replicating from anywhere
+            replica.lag = 0
+        else:
+            replica.lag = status['Seconds_Behind_Source']
+
+
+def pool_of(engine: AsyncEngine) -> QueuePool:
+    return typing.cast(QueuePool, engine.pool)
+
+
+def pool_stats(engine: AsyncEngine) -> dict[str, typing.Any]:
+    pool = pool_of(engine)
+    result: dict[str, typing.Any] = {
+        'size': pool.size(),
+        'checked_in': pool.checkedin(),
+        'checked_out': pool.checkedout(),
+        'overflow': pool.overflow(),
+    }
+    admission = getattr(pool, 'admission', None)
+    if admission is not None:
+        result['admission'] = admission.stats()
+    return result
+
+
+def create_engine(dsn: typing.Any, pool_size: int, max_overflow: int, pool_timeout: float) -> AsyncEngine:
+    engine = create_async_engine(
+        str(dsn),
+        poolclass=TimedQueuePool,
+        pool_size=pool_size,
+        max_overflow=max_overflow,
+        pool_timeout=pool_timeout,
+    )
+    instrument(engine)
+    return engine
+
+
+async_engine = create_engine(
+    config.MYSQL_DSN, config.MYSQL_POOL_SIZE, config.MYSQL_MAX_OVERFLOW, config.MYSQL_POOL_TIMEOUT
+)
+async_session: async_sessionmaker[AsyncSession] = async_sessionmaker(
+    async_engine, sync_session_class=RoutingSession, expire_on_commit=False
 )
-async_session: async_sessionmaker[AsyncSession] = async_sessionmaker(async_engine, expire_on_commit=False)
+replicas = ReplicaSet(
+    [
+        create_engine(
+            dsn, config.MYSQL_REPLICA_POOL_SIZE, config.MYSQL_REPLICA_MAX_OVERFLOW, config.MYSQL_REPLICA_POOL_TIMEOUT
+        )
+        for dsn in config.MYSQL_REPLICA_DSNS
+    ],
+    config.MYSQL_REPLICA_BALANCE,
+    config.MYSQL_REPLICA_MAX_LAG,
+    config.MYSQL_REPLICA_CHECK_INTERVAL,
+)
+
+
+shard_sessionmakers = [
+    async_sessionmaker(
+        create_engine(dsn, config.MYSQL_POOL_SIZE, config.MYSQL_MAX_OVERFLOW, config.MYSQL_POOL_TIMEOUT),
+        expire_on_commit=False,
+    )
+    for dsn in config.MYSQL_SHARD_DSNS
+]
+
+
+def shard_of_id(id: int, shard_count: int) -> int:
+    return id % shard_count
+
+
+def shard_of_key(key: typing.Any, shard_count: int) -> int:
+    return zlib.crc32(str(key).encode()) % shard_count
+
+
+class ShardedSession:
+    """Holds a session for each shard, which is opened when it's first used, and a session of the primary for the
+    unsharded tables, e.g. the indexes across the shards.
+
+    The `BaseModel` methods route the queries by id to the shard's session, or scatter them to all the shards.
+    Committing commits the primary first and then each opened shard in turn, so it's not atomic across shards.
+    """
+
+    def __init__(
+        self,
+        sessionmakers: typing.Sequence[async_sessionmaker[AsyncSession]],
+        primary_sessionmaker: async_sessionmaker[AsyncSession] | None = None,
+    ) -> None:
+        self.sessionmakers = sessionmakers
+        self.primary_sessionmaker = primary_sessionmaker or async_session
+        self.primary_session: AsyncSession | None = None
+        self.sessions: dict[int, AsyncSession] = {}
+
+    @property
+    def shard_count(self) -> int:
+        return len(self.sessionmakers)
+
+    @property
+    def primary(self) -> AsyncSession:
+        if self.primary_session is None:
+            self.primary_session = self.primary_sessionmaker()
+        return self.primary_session
+
+    def shard(self, shard: int) -> AsyncSession:
+        session = self.sessions.get(shard)
+        if session is None:
+            session = self.sessions[shard] = self.sessionmakers[shard]()
+        return session
+
+    def for_id(self, id: int) -> AsyncSession:
+        return self.shard(shard_of_id(id, self.shard_count))
+
+    def for_key(self, key: typing.Any) -> AsyncSession:
+        return self.shard(shard_of_key(key, self.shard_count))
+
+    def all(self) -> list[AsyncSession]:
+        return [self.shard(shard) for shard in range(self.shard_count)]
+
+    def group_ids(self, ids: typing.Iterable[int]) -> list[tuple[AsyncSession, list[int]]]:
+        groups: dict[int, list[int]] = {}
+        for id in ids:
+            groups.setdefault(shard_of_id(id, self.shard_count), []).append(id)
+        return [(self.shard(shard), shard_ids) for shard, shard_ids in groups.items()]
+
+    def opened(self) -> list[AsyncSession]:
+        sessions = list(self.sessions.values())
+        return sessions if self.primary_session is None else [self.primary_session, *sessions]
+
+    async def commit(self) -> None:
+        for session in self.opened():
+            await session.commit()
+
+    async def rollback(self) -> None:
+        for session in self.opened():
+            await session.rollback()
+
+    async def close(self) -> None:
+        for session in self.opened():
+            await session.close()
 
 
 @asynccontextmanager
-async def get_session() -> typing.AsyncGenerator[AsyncSession, typing.Any]:
-    session = async_session()
+async def get_sharded_session() -> typing.AsyncGenerator[ShardedSession, typing.Any]:
+    session = ShardedSession(shard_sessionmakers or [async_session])
     try:
         yield session
     finally:
         await session.close()
+
+
+@asynccontextmanager
+async def get_session(readonly: bool = False) -> typing.AsyncGenerator[AsyncSession, typing.Any]:
+    """Returns a session of the primary. A readonly session reads from a replica, if any of them is fresh enough."""
+    replica = replicas.choose() if readonly else None
+    session = async_session(replica=replica.engine.sync_engine) if replica else async_session()
+    try:
+        yield session
+    finally:
+        await session.close()
+
+
+async def get_request_session() -> typing.AsyncGenerator[AsyncSession, typing.Any]:
+    """A dependency of a session shared by the handler and the dependencies of a request.
+
+    A session doesn't check out a connection until it executes a statement, so requests answered from caches never
+    hold one.
+    """
+    async with get_session() as session:
+        yield session
+
+
+async def get_readonly_request_session() -> typing.AsyncGenerator[AsyncSession, typing.Any]:
+    """Like `get_request_session()`, but reads from a replica."""
+    async with get_session(readonly=True) as session:
+        yield session
+
+
+def all_engines() -> list[AsyncEngine]:
+    engines = [async_engine]
+    engines.extend(replica.engine for replica in replicas.replicas)
+    engines.extend(typing.cast(AsyncEngine, sessionmaker.kw['bind']) for sessionmaker in shard_sessionmakers)
+    return engines
+
+
+async def warm_up_pool(engine: AsyncEngine) -> None:
+    """Opens as many connections as the pool keeps, so that the first requests don't pay for connecting."""
+    results = await asyncio.gather(
+        *(engine.connect().start() for _ in range(pool_of(engine).size())), return_exceptions=True
+    )
+    await asyncio.gather(*(result.close() for result in results if isinstance(result, AsyncConnection)))
+    errors = [result for result in results if isinstance(result, BaseException)]
+    if errors:  # the pool still connects on demand
+        logging.error('failed to open %d connections to %s: %r', len(errors), engine.url, errors[0])
+
+
+async def drain_pool(engine: AsyncEngine, timeout: float) -> None:
+    """Waits up to `timeout` seconds for the checked out connections to return, then closes all the connections."""
+    pool = pool_of(engine)
+    for _ in range(int(timeout / 0.1)):
+        if not pool.checkedout():
+            break
+        await asyncio.sleep(0.1)
+    else:
+        logging.warning('closing %d connections still in use', pool.checkedout())
+    await engine.dispose()
+
+
+async def open_pools() -> None:
+    await asyncio.gather(*(warm_up_pool(engine) for engine in all_engines()))
+
+
+async def close_pools(timeout: float) -> None:
+    await replicas.close()
+    await asyncio.gather(*(drain_pool(engine, timeout) for engine in all_engines()))
+
+
+def stats() -> dict[str, dict[str, typing.Any]]:
+    """Returns the pool usage of each engine, and the lag and session count of each replica."""
+    result: dict[str, dict[str, typing.Any]] = {
+        'primary': {**pool_stats(async_engine), 'fallbacks': replicas.fallbacks}
+    }
+    for replica in replicas.replicas:
+        result[replica.name] = {**pool_stats(replica.engine), 'lag': replica.lag, 'sessions': replica.sessions}
+    return result
@@ -0,0 +1,197 @@
+import asyncio
+import logging
+from typing import Any, Sequence
+
+import redis.asyncio as redis
+from redis.asyncio.connection import AbstractConnection
+from redis.exceptions import ResponseError
+
+from app.clients.redis import redis_client
+from app.config import config
+from app.utils.cache import LRUCache
+
+INVALIDATION_CHANNEL = '__redis__:invalidate'
+ENTRY_OVERHEAD = 100  # estimated bytes used by an entry besides its key and value
+
+_MISSING: Any = object()
+
+
+class NearCache:
+    """An in-process cache of Redis values, kept coherent by Redis itself.
+
+    It uses client-side caching in broadcasting mode: Redis publishes the names of the modified keys which match the
+    prefixes to a subscribed connection, whichever client modified them. Values are only served locally while that
+    channel is alive, and the local cache is flushed whenever it breaks, since invalidations may have been missed.
+    """
+
+    def __init__(
+        self,
+        client: redis.Redis,
+        prefixes: Sequence[str],
+        maxsize: int,
+        maxbytes: int,
+        ttl: float,
+        health_check_interval: float = 1,
+    ) -> None:
+        self.client = client
+        self.prefixes = tuple(prefixes)
+        self.cache: LRUCache[str, bytes | None] = LRUCache(maxsize, ttl, maxbytes=maxbytes)
+        self.health_check_interval = health_check_interval
+        self.tracking = False
+        self.broken = asyncio.Event()
+        self.task: asyncio.Task | None = None
+        self.loading: dict[str, int] = {}  # number of pending reads of each key
+        self.invalidated: set[str] = set()  # keys invalidated while they were being read
+        self.invalidations = 0
+
+    @property
+    def enabled(self) -> bool:
+        return self.cache.maxsize > 0 and bool(self.prefixes)
+
+    def cacheable(self, key: str) -> bool:
+        return key.startswith(self.prefixes)
+
+    def start(self) -> None:
+        if self.task is None and self.enabled:
+            self.task = asyncio.get_running_loop().create_task(self.run())
+
+    async def close(self) -> None:
+        if self.task is not None:
+            self.task.cancel()
+            try:
+                await self.task
+            except asyncio.CancelledError:
+                pass
+            self.task = None
+
+    async def run(self) -> None:
+        while True:
+            try:
+                await self.track()
+            except asyncio.CancelledError:
+                raise
+            except ResponseError:  # the server doesn't support client-side caching, keep reading from it directly
+                logging.exception('failed to enable client tracking')
+                return
+            except Exception:
+                logging.exception('near cache lost its invalidation channel')
+            await asyncio.sleep(self.health_check_interval)
+
+    async def on_reconnect(self, connection: AbstractConnection) -> None:
+        self.broken.set()
+
+    def make_listener(self) -> AbstractConnection:
+        """Returns a dedicated RESP2 connection to receive the invalidations. Redis only publishes them on the channel
+        to RESP2 connections, and sends push frames to RESP3 ones, which redis-py drops unless a handler is registered.
+        """
+        pool = self.client.connection_pool
+        # the maintenance notifications of the pool are only supported with RESP3
+        kwargs = {
+            name: value
+            for name, value in pool.connection_kwargs.items()
+            if not name.startswith(('maint_notifications_', 'orig_'))
+        }
+        return pool.connection_class(**{**kwargs, 'protocol': 2})
+
+    async def track(self) -> None:
+        self.broken.clear()
+        listener = self.make_listener()
+        # a dedicated connection, which never returns to the pool with tracking enabled
+        tracker = self.client.connection_pool.make_connection()
+        try:
+            await listener.connect()
+            await listener.send_command('CLIENT', 'ID')
+            client_id = await listener.read_response()
+            await listener.send_command('SUBSCRIBE', INVALIDATION_CHANNEL)
+            await listener.read_response()
+
+            await tracker.connect()
+            prefix_args = [arg for prefix in self.prefixes for arg in ('PREFIX', prefix)]
+            await tracker.send_command('CLIENT', 'TRACKING', 'ON', 'REDIRECT', client_id, 'BCAST', *prefix_args)
+            await tracker.read_response()
+
+            listener.register_connect_callback(self.on_reconnect)
+            tracker.register_connect_callback(self.on_reconnect)
+            self.tracking = True
+            while not self.broken.is_set():
+                message = await listener.read_response(timeout=self.health_check_interval)
+                if message is None:
+                    # reconnecting would call on_reconnect(), since the tracking state was lost with the connection
+                    await tracker.send_command('PING')
+                    await tracker.read_response()
+                elif message[0] == b'message':  # [b'message', channel, keys]
+                    self.invalidate(message[2])
+        finally:
+            self.flush()
+            await tracker.disconnect()
+            await listener.disconnect()
+
+    def invalidate(self, keys: list[bytes] | None) -> None:
+        if keys is None:  # the database was flushed
+            self.flush()
+            self.tracking = True
+            return
+        cache = self.cache
+        loading = self.loading
+        for key in keys:
+            name = key.decode()
+            cache.pop(name)
+            if name in loading:
+                self.invalidated.add(name)
+        self.invalidations += len(keys)
+
+    def flush(self) -> None:
+        self.tracking = False
+        self.cache.clear()
+        self.invalidated.update(self.loading)
+
+    async def get(self, key: str) -> bytes | None:
+        return (await self.mget((key,)))[0]
+
+    async def mget(self, keys: Sequence[str]) -> list[bytes | None]:
+        if not self.tracking:
+            self.start()
+            return await self.client.mget(keys)
+
+        cache = self.cache
+        values = [cache.get(key, _MISSING) if self.cacheable(key) else _MISSING for key in keys]
+        missed_keys = [key for key, value in zip(keys, values) if value is _MISSING]
+        if not missed_keys:
+            return values
+
+        loading = self.loading
+        for key in missed_keys:
+            loading[key] = loading.get(key, 0) + 1
+        try:
+            loaded = dict(zip(missed_keys, await self.client.mget(missed_keys)))
+        finally:
+            for key in missed_keys:
+                count = loading.pop(key) - 1
+                if count:
+                    loading[key] = count
+
+        invalidated = self.invalidated
+        for key, value in loaded.items():
+            if key in invalidated:  # the value may be stale
+                if key not in loading:
+                    invalidated.discard(key)
+            elif self.tracking and self.cacheable(key):  # uncacheable keys are always missed
+                cache.set(key, value, size=len(key) + (len(value) if value else 0) + ENTRY_OVERHEAD)
+        return [loaded[key] if value is _MISSING else value for key, value in zip(keys, values)]
+
+    def stats(self) -> dict[str, Any]:
+        stats: dict[str, Any] = self.cache.stats()
+        lookups = stats['hits'] + stats['misses']
+        stats['hit_ratio'] = stats['hits'] / lookups if lookups else 0.0
+        stats['invalidations'] = self.invalidations
+        stats['tracking'] = self.tracking
+        return stats
+
+
+near_cache = NearCache(
+    redis_client,
+    config.REDIS_NEAR_CACHE_PREFIXES,
+    config.REDIS_NEAR_CACHE_SIZE,
+    config.REDIS_NEAR_CACHE_MAX_BYTES,
+    config.REDIS_NEAR_CACHE_TTL,
+)
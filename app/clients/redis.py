@@ -1,7 +1,101 @@
+import asyncio
+import logging
+from typing import Any
+
 import redis.asyncio as redis
+from redis.commands.core import AsyncCoreCommands
 
 from app.config import config
 
 
+class AutoPipeline(AsyncCoreCommands):
+    """Sends the commands issued by concurrent coroutines together in a pipeline.
+
+    The commands issued until the next iteration of the event loop (or for `flush_delay` seconds) are queued, and sent
+    in one non-transactional pipeline on a single connection, so that they share a round trip. A batch is sent as soon
+    as it has `max_batch_size` commands. Each caller gets the result or error of its own command.
+
+    It has the command methods of `redis.Redis`, but not pipelines, scripts or pub/sub, which should use the client.
+    """
+
+    def __init__(self, client: redis.Redis, max_batch_size: int, flush_delay: float) -> None:
+        self.client = client
+        self.max_batch_size = max_batch_size
+        self.flush_delay = flush_delay
+        self.commands: list[tuple[tuple, dict[str, Any], asyncio.Future]] = []
+        self.handle: asyncio.Handle | None = None
+        self.tasks: set[asyncio.Task] = set()
+        self.batches = 0
+        self.sent = 0
+
+    async def execute_command(self, *args: Any, **options: Any) -> Any:
+        loop = asyncio.get_running_loop()
+        future = loop.create_future()
+        self.commands.append((args, options, future))
+        if len(self.commands) >= self.max_batch_size:
+            self.flush()
+        elif self.handle is None:
+            if self.flush_delay:
+                self.handle = loop.call_later(self.flush_delay, self.flush)
+            else:
+                self.handle = loop.call_soon(self.flush)
+        return await future
+
+    def flush(self) -> None:
+        if self.handle is not None:
+            self.handle.cancel()
+            self.handle = None
+        commands, self.commands = self.commands, []
+        if commands:
+            task = asyncio.get_running_loop().create_task(self.send(commands))
+            self.tasks.add(task)
+            task.add_done_callback(self.tasks.discard)
+
+    async def send(self, commands: list[tuple[tuple, dict[str, Any], asyncio.Future]]) -> None:
+        self.batches += 1
+        self.sent += len(commands)
+        pipeline = self.client.pipeline(transaction=False)
+        for args, options, _ in commands:
+            pipeline.execute_command(*args, **options)
+        try:
+            try:
+                results = await pipeline.execute(raise_on_error=False)
+            except Exception as e:  # e.g. a connection error, which fails all the commands
+                results = [e] * len(commands)
+            for (_, _, future), result in zip(commands, results):
+                if not future.done():  # the caller may have been cancelled
+                    if isinstance(result, Exception):
+                        future.set_exception(result)
+                    else:
+                        future.set_result(result)
+        finally:
+            # if the send itself was cancelled, e.g. on shutdown, cancel the callers rather than leave them waiting
+            for _, _, future in commands:
+                future.cancel()
+
+    def stats(self) -> dict[str, Any]:
+        return {
+            'batches': self.batches,
+            'commands': self.sent,
+            'average_batch_size': self.sent / self.batches if self.batches else 0,
+        }
+
+
 pool = redis.ConnectionPool.from_url(str(config.REDIS_DSN))
 redis_client = redis.Redis(connection_pool=pool)
+# for hot independent commands, e.g. the counter
+pipelined_client = AutoPipeline(redis_client, config.REDIS_PIPELINE_MAX_BATCH_SIZE, config.REDIS_PIPELINE_FLUSH_DELAY)
+
+
+async def open_pool(size: int) -> None:
+    """Opens `size` connections in the pool, so that the first requests don't pay for connecting."""
+    results = await asyncio.gather(*(pool.get_connection() for _ in range(size)), return_exceptions=True)
+    for result in results:
+        if isinstance(result, BaseException):
+            logging.error('failed to open a Redis connection: %r', result)
+        else:
+            await pool.release(result)
+
+
+async def close_pool() -> None:
+    await pool.disconnect()
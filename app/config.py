@@ -1,3 +1,5 @@
+from typing import Literal
+
 from pydantic import AnyUrl, MySQLDsn, RedisDsn
 from pydantic_settings import BaseSettings, SettingsConfigDict
 
@@ -8,12 +10,76 @@ class Settings(BaseSettings):
     MYSQL_DSN: MySQLDsn = AnyUrl('mysql+asyncmy://root@127.0.0.1:3306/test2?charset=utf8mb4')
     MYSQL_POOL_SIZE: int = 10
     MYSQL_MAX_OVERFLOW: int = 10
-    MYSQL_POOL_TIMEOUT: int = 0
+    # seconds an admitted checkout waits for a connection being returned. The admission queue does the waiting, but
+    # not 0, with which the pool fails even if a connection is about to be returned
+    MYSQL_POOL_TIMEOUT: float = 1
+    # checkouts waiting for a connection when the pool and overflow are in use, further ones are rejected with a 503
+    MYSQL_POOL_QUEUE_SIZE: int = 100
+    MYSQL_MAX_PACKET_SIZE: int = 4 * 1024 * 1024  # keep it under the server's max_allowed_packet
+    MYSQL_BATCH_DELAY: float = 0  # seconds to wait for more ids to load together, 0 means the current loop iteration
+    MYSQL_REPLICA_DSNS: list[MySQLDsn] = []  # readonly sessions are routed to them
+    MYSQL_REPLICA_POOL_SIZE: int = 10
+    MYSQL_REPLICA_MAX_OVERFLOW: int = 10
+    MYSQL_REPLICA_POOL_TIMEOUT: float = 1
+    MYSQL_REPLICA_BALANCE: Literal['round_robin', 'least_connections'] = 'round_robin'
+    # replicas lagging more than that are skipped, the rows read from replicas are never written to the row cache, so
+    # that a stale row can't be cached after its tombstone expires
+    MYSQL_REPLICA_MAX_LAG: float = 1
+    MYSQL_REPLICA_CHECK_INTERVAL: float = 1
+    # all the shards, the primary is the only shard if it's empty. Rows are placed by `id % len(MYSQL_SHARD_DSNS)`, so
+    # the number of shards can't be changed without moving the rows
+    MYSQL_SHARD_DSNS: list[MySQLDsn] = []
+    MYSQL_ID_BLOCK_SIZE: int = 100  # ids reserved from Redis at a time by each process
+    MYSQL_SLOW_QUERY_THRESHOLD: float = 0.2  # seconds, statements taking longer are logged, 0 disables it
+    MYSQL_STATS_SIZE: int = 1000  # statement fingerprints kept for each route
 
     REDIS_DSN: RedisDsn = AnyUrl('redis://127.0.0.1:6379/0?protocol=3')
+    REDIS_POOL_SIZE: int = 10  # connections opened at startup
+    REDIS_PIPELINE_MAX_BATCH_SIZE: int = 100  # commands sent in a pipeline by `pipelined_client` at most
+    # seconds to wait for more commands to send together, 0 means the current loop iteration
+    REDIS_PIPELINE_FLUSH_DELAY: float = 0
+    REDIS_NEAR_CACHE_SIZE: int = 0  # 0 disables the near cache
+    REDIS_NEAR_CACHE_MAX_BYTES: int = 64 * 1024 * 1024
+    REDIS_NEAR_CACHE_TTL: int = 300
+    REDIS_NEAR_CACHE_PREFIXES: list[str] = ['row:', 'count', 'version:']
+
+    # the /count counter, see `HotCounter` for the consistency of the modes
+    COUNTER_SHARDS: int = 1  # keys the count is spread over, only worth it if they're on different Redis nodes
+    COUNTER_LOCAL: bool = False  # buffer the increments in each process
+    COUNTER_FLUSH_INTERVAL: float = 1  # seconds between the flushes of the buffered increments
+    COUNTER_FLUSH_SIZE: int = 1000  # buffered increments which are flushed at once
+    COUNTER_LEASE_SIZE: int = 1000  # values leased by each process at a time
+    COUNTER_REFRESH_INTERVAL: float = 1  # seconds between the reads of the other keys, without local mode
+
+    ROW_CACHE_MISS_TTL: int = 60
+    ROW_CACHE_TOMBSTONE_TTL: int = 2
 
     TOKEN_KEY: str = 'test'
     TOKEN_EXPIRATION: int = 60 * 60 * 24 * 7
+    TOKEN_CACHE_SIZE: int = 10000
+
+    ARGON2_WORKERS: int = 0  # 0 means the number of CPUs
+    ARGON2_QUEUE_SIZE: int = 64
+
+    # bytes of a streamed body held back to compute its ETag, larger bodies are sent without it, 0 disables it
+    ETAG_MAX_BUFFER_SIZE: int = 1024 * 1024
+    # hold back the streamed bodies of every request to send their ETags, not only of the requests with If-None-Match or
+    # a validator, which delays the first bytes of the streams until they end or exceed ETAG_MAX_BUFFER_SIZE
+    ETAG_HOLD_STREAMS: bool = False
+    ETAG_HASH: Literal['md5', 'blake2b', 'crc32'] = 'md5'  # crc32 is the fastest, but not a cryptographic hash
+    COMPRESSION_ENCODINGS: list[str] = ['zstd', 'br', 'gzip']  # by preference, empty disables compression
+    COMPRESSION_MINIMUM_SIZE: int = 500  # bytes, smaller bodies are not worth compressing
+    COMPRESSION_WEAK_ETAG: bool = False  # weak ETags of compressed bodies, instead of strong ones suffixed by encodings
+    COMPRESSION_CACHE_SIZE: int = 1000  # compressed bodies cached by path and ETag
+    COMPRESSION_CACHE_MAX_BYTES: int = 64 * 1024 * 1024
+    RESPONSE_CACHE_SIZE: int = 1000  # responses of the endpoints marked by @cache_response() cached in process
+    RESPONSE_CACHE_MAX_BYTES: int = 64 * 1024 * 1024
+    RESPONSE_CACHE_MAX_ENTRY_SIZE: int = 1024 * 1024  # bytes of a body, larger ones are not cached
+    VALIDATOR_CACHE_SIZE: int = 10000  # ETags recorded by this process, which are also stored in Redis
+
+    # seconds a request may wait for connections, clients can ask for less by the X-Request-Timeout header
+    REQUEST_TIMEOUT: float = 5
+    SHUTDOWN_TIMEOUT: float = 10  # seconds to wait for the background tasks and connections in use on shutdown
 
 
 config = Settings()
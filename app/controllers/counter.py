@@ -1,8 +1,7 @@
-from app.clients.redis import redis_client
+from app.models.counter import counter
 from app.router import router
 
 
 @router.get('/count')
 async def get_count():
-    count = await redis_client.incr('count')
-    return {'count': count}
+    return {'count': await counter.incr()}
@@ -1,19 +1,21 @@
 from fastapi import Depends
 from sqlmodel import col
 
-from app.clients.mysql import get_session
 from app.models.user import User, get_current_user_id
 from app.router import router
 from app.schemas.resp import Resp
+from app.utils.response import fast_response
+from app.utils.response_cache import cache_response
 
 
 @router.get('/hello/{user_name}', response_model=Resp, response_model_exclude_none=True)
+@cache_response(ttl=60)
 def hello(user_name: str):
     return Resp(msg=f'Hello, {user_name}!')
 
 
 @router.get('/hello', response_model=Resp, response_model_exclude_none=True)
+@fast_response
 async def hello_to_self(current_user_id: int = Depends(get_current_user_id)):
-    async with get_session() as session:
-        user_name = await User.get_by_id(session, current_user_id, col(User.name))
+    user_name = await User.load_by_id(current_user_id, col(User.name))
     return Resp(msg=f'Hello, {user_name}!')
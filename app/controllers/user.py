@@ -1,93 +1,166 @@
-from typing import Annotated
+from typing import Annotated, AsyncIterator, Literal
 
-from fastapi import Body, Depends
+from fastapi import Body, Depends, Query
+from fastapi.responses import StreamingResponse
 from fastapi.security import OAuth2PasswordRequestForm
 from sqlalchemy import Row
+from sqlalchemy.ext.asyncio import AsyncSession
 from sqlmodel import col
 
-from app.clients.mysql import get_session
-from app.models import all_is_instance
+from app.clients.mysql import (
+    get_readonly_request_session,
+    get_request_session,
+    get_session,
+)
 from app.models.user import User, UserBase, get_current_user_id
+from app.models.validator import last_modified, validator
 from app.router import router
 from app.schemas.resp import Resp
 from app.schemas.user import UserRequest
+from app.utils.admission import Priority, priority
+from app.utils.cursor import decode_cursor, encode_cursor
 from app.utils.exception import HTTPError, forbidden_error, not_found_error
-from app.utils.format import models_dump, row_dump
+from app.utils.format import row_dump, rows_dump, rows_json, rows_ndjson
+from app.utils.response import fast_response
+from app.utils.response_cache import cache_response
+
+login_failed_error = HTTPError(400, msg='login failed')
 
 
 @router.post('/user', response_model=Resp, response_model_exclude_none=True, status_code=201)
-async def create_user(req: UserRequest):
-    async with get_session() as session:
-        user = User(**req.model_dump())
-        session.add(user)
-        await session.commit()
+@fast_response
+async def create_user(req: UserRequest, session: AsyncSession = Depends(get_request_session)):
+    user = User(req.name, await User.async_hash_password(req.password), hashed=True)
+    session.add(user)
+    await session.commit()
     return Resp()
 
 
-@router.post('/login')
-async def login(req: OAuth2PasswordRequestForm = Depends()):
-    async with get_session() as session:
-        user_id = await User.get_verified_user_id(session, req.username, req.password)
-        if user_id:
-            token = User.generate_token(user_id)
-            return {'access_token': token, 'token_type': 'bearer'}
-    raise HTTPError(400, msg='login failed')
+@router.post('/login', dependencies=[Depends(priority(Priority.HIGH))])
+@fast_response
+async def login(req: OAuth2PasswordRequestForm = Depends(), session: AsyncSession = Depends(get_request_session)):
+    user_id = await User.get_verified_user_id(session, req.username, req.password)
+    if user_id:
+        token = User.generate_token(user_id)
+        return {'access_token': token, 'token_type': 'bearer'}
+    raise login_failed_error
 
 
-@router.get('/user/{user_id}', response_model=UserBase)
+@router.get(
+    '/user/{user_id}',
+    response_model=UserBase,
+    dependencies=[Depends(validator(User)), Depends(last_modified(User))],
+)
+@fast_response
 async def get_user(user_id: int, _=Depends(get_current_user_id)):
-    async with get_session() as session:
-        user = await User.get_by_id(session, user_id, (User.id, User.name))
+    user = await User.load_by_id(user_id, (User.id, User.name))
     if user:
         return user
     raise not_found_error
 
 
 @router.put('/user/{user_id}', response_model=Resp, response_model_exclude_none=True)
-async def update_user(user_id: int, req: UserRequest, current_user_id: int = Depends(get_current_user_id)):
+@fast_response
+async def update_user(
+    user_id: int,
+    req: UserRequest,
+    current_user_id: int = Depends(get_current_user_id),
+    session: AsyncSession = Depends(get_request_session),
+):
     if current_user_id == 1:
-        req.password = User.hash_password(req.password)
-        async with get_session() as session:
-            if await User.update_by_id(session, user_id, req.model_dump()):
-                await session.commit()
-                return Resp()
+        req.password = await User.async_hash_password(req.password)
+        if await User.update_by_id(session, user_id, req.model_dump()):
+            await session.commit()
+            return Resp()
         raise not_found_error
     raise forbidden_error
 
 
-@router.get('/user/{user_id}/name', response_model=Resp, response_model_exclude_none=True)
+@router.get(
+    '/user/{user_id}/name',
+    response_model=Resp,
+    response_model_exclude_none=True,
+    dependencies=[Depends(validator(User)), Depends(last_modified(User))],
+)
+@fast_response
 async def get_user_name(user_id: int, _=Depends(get_current_user_id)):
-    async with get_session() as session:
-        user_name = await User.get_by_id(session, user_id, col(User.name))
+    user_name = await User.load_by_id(user_id, col(User.name))
     if user_name:
         return Resp(data={'name': user_name})
     raise not_found_error
 
 
 @router.patch('/user/{user_id}/name', response_model=Resp, response_model_exclude_none=True)
-async def set_user_name(user_id: int, name: Annotated[str, Body(embed=True)], _=Depends(get_current_user_id)):
-    async with get_session() as session:
-        if await User.update_by_id(session, user_id, {'name': name}):
-            await session.commit()
-            return Resp()
+@fast_response
+async def set_user_name(
+    user_id: int,
+    name: Annotated[str, Body(embed=True)],
+    _=Depends(get_current_user_id),
+    session: AsyncSession = Depends(get_request_session),
+):
+    if await User.update_by_id(session, user_id, {'name': name}):
+        await session.commit()
+        return Resp()
     raise not_found_error
 
 
-@router.get('/user/{user_id}/time', response_model=Resp, response_model_exclude_none=True)
+@router.get(
+    '/user/{user_id}/time',
+    response_model=Resp,
+    response_model_exclude_none=True,
+    dependencies=[Depends(validator(User)), Depends(last_modified(User))],
+)
+@fast_response
 async def get_user_time(user_id: int, _=Depends(get_current_user_id)):
-    async with get_session() as session:
-        row = await User.get_by_id(session, user_id, (User.created_at, User.updated_at))
+    row = await User.load_by_id(user_id, (User.created_at, User.updated_at))
     if row:
         assert isinstance(row, Row)
         return Resp(data=row_dump(row))
     raise not_found_error
 
 
-@router.get('/users', response_model=Resp, response_model_exclude_none=True)
-async def get_user_list(current_user_id: int = Depends(get_current_user_id)):
+USER_COLUMNS = (User.id, User.name, User.created_at, User.updated_at)
+
+
+async def export_users(ndjson: bool) -> AsyncIterator[bytes]:
+    async with get_session(readonly=True) as session:
+        if ndjson:
+            async for rows in User.stream_all(session, USER_COLUMNS):
+                yield rows_ndjson(rows)
+        else:  # the same as Resp(data={'users': users}), but encoded incrementally
+            yield b'{"code":0,"data":{"users":['
+            separator = b''
+            async for rows in User.stream_all(session, USER_COLUMNS):
+                yield separator + rows_json(rows)[1:-1]
+                separator = b','
+            yield b']}}'
+
+
+@router.get(
+    '/users',
+    response_model=Resp,
+    response_model_exclude_none=True,
+    dependencies=[Depends(priority(Priority.LOW))],  # let the requests of users go first when the pool is busy
+)
+@cache_response(ttl=0, vary_user=True)  # concurrent listings of the same page share one query, but aren't kept
+@fast_response
+async def get_user_list(
+    cursor: str | None = None,
+    limit: Annotated[int, Query(ge=1, le=1000)] = 100,
+    export: Literal['json', 'ndjson'] | None = None,
+    current_user_id: int = Depends(get_current_user_id),
+    session: AsyncSession = Depends(get_readonly_request_session),
+):
     if current_user_id == 1:
-        async with get_session() as session:
-            users = await User.get_all(session)
-        assert all_is_instance(users, User)
-        return Resp(data={'users': models_dump(users, exclude=set(['password']))})
+        if export:  # stream all the users with constant memory
+            media_type = 'application/x-ndjson' if export == 'ndjson' else 'application/json'
+            return StreamingResponse(export_users(export == 'ndjson'), media_type=media_type)
+
+        after_id = decode_cursor(cursor) if cursor else 0
+        rows = await User.get_page(session, after_id, limit + 1, USER_COLUMNS)
+        total = await User.count_all(session, mode='maintained')
+        data: dict = {'users': rows_dump(rows[:limit]), 'total': total}
+        if len(rows) > limit:
+            data['next_cursor'] = encode_cursor(rows[limit - 1].id)
+        return Resp(data=data)
     raise forbidden_error
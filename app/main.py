@@ -1,10 +1,21 @@
+import asyncio
 import logging
+from contextlib import asynccontextmanager
+from typing import AsyncIterator
 
 from fastapi import FastAPI
 from fastapi.exceptions import RequestValidationError
 from fastapi.middleware import Middleware
 
+from app.clients import mysql, redis
+from app.clients.near_cache import near_cache
+from app.config import config
+from app.models.cache import drain_background_tasks
+from app.models.counter import counter
+from app.models.user import get_current_user_id
 from app.router import router
+from app.utils.admission import DeadlineMiddleware
+from app.utils.compression import CompressionMiddleware
 from app.utils.etag import ETagMiddleware
 from app.utils.exception import (
     HTTPError,
@@ -12,7 +23,10 @@ from app.utils.exception import (
     http_error_handler,
     validation_error_handler,
 )
+from app.utils.hasher import hash_executor
 from app.utils.importer import auto_import
+from app.utils.response_cache import ResponseCacheMiddleware
+from app.utils.server_timing import ServerTimingMiddleware
 
 logging.basicConfig(
     level=logging.INFO,
@@ -22,7 +36,33 @@ logging.basicConfig(
 
 auto_import('app/controllers')
 
-app = FastAPI(middleware=[Middleware(ETagMiddleware)])
+
+@asynccontextmanager
+async def lifespan(app: FastAPI) -> AsyncIterator[None]:
+    hash_executor.start()
+    await asyncio.gather(mysql.open_pools(), redis.open_pool(config.REDIS_POOL_SIZE))
+    near_cache.start()
+    yield
+    # the server has finished the requests, wait for the work they left before closing the connections
+    await drain_background_tasks(config.SHUTDOWN_TIMEOUT)
+    await near_cache.close()
+    await counter.close()
+    await asyncio.to_thread(hash_executor.shutdown)
+    await mysql.close_pools(config.SHUTDOWN_TIMEOUT)
+    await redis.close_pool()
+
+
+app = FastAPI(
+    lifespan=lifespan,
+    middleware=[
+        Middleware(DeadlineMiddleware),
+        Middleware(ServerTimingMiddleware),
+        Middleware(CompressionMiddleware),  # in front of ETagMiddleware, which hashes the uncompressed bodies
+        # caches the responses with their ETags
+        Middleware(ResponseCacheMiddleware, routes=router.routes, authenticate=get_current_user_id),
+        Middleware(ETagMiddleware),
+    ],
+)
 app.include_router(router)
 app.exception_handler(Exception)(exception_handler)
 app.exception_handler(HTTPError)(http_error_handler)
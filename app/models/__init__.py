@@ -1,13 +1,27 @@
-from typing import Any, Sequence, Type, TypeGuard, TypeVar
+import asyncio
+from typing import Any, AsyncIterator, ClassVar, Literal, Mapping, Sequence, Type, TypeGuard, TypeVar
 
-from sqlalchemy import Column
+from sqlalchemy import Column, bindparam, case
+from sqlalchemy.dialects.mysql import insert as mysql_insert
 from sqlalchemy.ext.asyncio import AsyncSession
 from sqlalchemy.orm import Mapped
-from sqlalchemy.orm.attributes import InstrumentedAttribute
-from sqlalchemy.sql import func, text
-from sqlalchemy.sql.elements import TextClause
+from sqlalchemy.orm.attributes import InstrumentedAttribute, set_committed_value
+from sqlalchemy.orm.util import identity_key
+from sqlalchemy.sql import Select, func, text
+from sqlalchemy.sql.elements import ClauseElement, TextClause
 from sqlmodel import Field, SQLModel, col, delete, insert, select, update
 
+from app.clients.mysql import ShardedSession, get_session, reads_from_replica
+from app.config import config
+
+from .bulk import BulkInsertResult, chunk_rows, has_explicit_ids, match_unique_keys, unique_keys
+from .cache import RowCache, get_row_cache, make_rows
+from .count import UNKNOWN, get_row_counter
+from .loader import get_loader
+from .shard import allocate_id, id_getter, merge_results
+from .statement import columns_key, get_statement, lock_mode
+from .version import get_row_versions
+
 Values = dict[str, Any]
 
 T = TypeVar('T')
@@ -21,39 +35,176 @@ def all_is_instance(vals: Sequence[T], t: Type[Sub]) -> TypeGuard[Sequence[Sub]]
 class BaseModel(SQLModel, table=False):
     id: int = Field(default=None, primary_key=True)
 
+    # Names of the columns to cache in Redis by id, reading any of them by `get_by_id()` or `get_by_ids()` without a
+    # lock will be served from the cache. Whole model instances are never cached.
+    __cache_columns__: ClassVar[tuple[str, ...]] = ()
+    __cache_ttl__: ClassVar[int] = 3600
+    # Name of the column which decides the shard of the row, when the methods are given a `ShardedSession`. The rows
+    # inserted by `insert()` get new ids on the same shard as their shard keys, so the rows can still be found by id.
+    # It must be a column which never changes, since `update_by_id()` can't move a row to another shard.
+    __shard_key__: ClassVar[str] = 'id'
+    # Seconds to keep the number of rows in Redis for `count_all(mode='maintained')`, 0 disables it. The counter is kept
+    # in step by the writes, and reconciled with the exact count when it expires.
+    __count_ttl__: ClassVar[int] = 0
+    # Seconds to keep the version counter of a row after its last write, 0 disables them. The versions are incremented
+    # after the writes commit, and validate what was recorded from the rows, e.g. the ETags of `validator()`.
+    __version_ttl__: ClassVar[int] = 0
+
+    @classmethod
+    def select_columns(cls, columns: Any) -> tuple[Select, bool]:
+        """Returns a query of the columns, and whether its results are scalars."""
+        if columns is None:
+            return select(cls), True
+        if isinstance(columns, (list, tuple)):
+            return select(*columns), False
+        return select(columns), True
+
+    @classmethod
+    def select_by_ids(
+        cls, columns: Any, for_update: bool = False, for_read: bool = False, many: bool = False
+    ) -> tuple[Select, bool]:
+        """Returns a cached query of the columns by the `id` bind parameter, or by the expanding `ids` one if `many`,
+        and whether its results are scalars."""
+
+        def build() -> tuple[Select, bool]:
+            query, scalar = cls.select_columns(columns)
+            if many:
+                query = query.where(col(cls.id).in_(bindparam('ids', expanding=True)))
+            else:
+                query = query.where(col(cls.id) == bindparam('id'))
+            if for_update:
+                query = query.with_for_update()
+            elif for_read:
+                query = query.with_for_update(read=True)
+            return query, scalar
+
+        key = columns_key(columns)
+        kind = 'ids' if many else 'id'
+        return get_statement(None if key is None else (cls, kind, lock_mode(for_update, for_read), *key), build)
+
+    @classmethod
+    def select_exist(cls, for_update: bool = False, for_read: bool = False) -> Select:
+        """Returns a cached query of whether the row of the `id` bind parameter exists."""
+
+        def build() -> Select:
+            query = select(text('1')).select_from(cls).where(col(cls.id) == bindparam('id'))
+            if for_update:
+                query = query.with_for_update()
+            elif for_read:
+                query = query.with_for_update(read=True)
+            return query
+
+        return get_statement((cls, 'exist', lock_mode(for_update, for_read)), build)
+
+    @classmethod
+    def update_by_id_statement(cls, names: tuple[str, ...]) -> Any:
+        """Returns a cached statement which updates the columns of the row of the `where_id` bind parameter, by the bind
+        parameters of the column names."""
+        return get_statement(
+            (cls, 'update', *names),
+            lambda: (
+                update(cls)
+                .where(col(cls.id) == bindparam('where_id'))
+                .values({name: bindparam(name) for name in names})
+            ),
+        )
+
+    @classmethod
+    def cached_column_names(cls, columns: Any) -> tuple[str, ...] | None:
+        """Returns the names of the columns if all of them are cached, otherwise None."""
+        if columns is None:
+            return None
+        cached_columns = cls.__cache_columns__
+        names = []
+        for column in columns if isinstance(columns, (list, tuple)) else (columns,):
+            if isinstance(column, InstrumentedAttribute):
+                if column.class_ is not cls:
+                    return None
+            elif isinstance(column, Column):
+                if column.table is not cls.__table__:  # type: ignore
+                    return None
+            else:
+                return None
+            if column.key not in cached_columns:
+                return None
+            names.append(column.key)
+        return tuple(names)
+
+    @classmethod
+    async def get_cached_by_ids(
+        cls, session: AsyncSession, row_cache: RowCache, ids: Sequence[int], names: tuple[str, ...], scalar: bool
+    ) -> dict[int, Any]:
+        async def load(ids: list[int]) -> dict[int, tuple]:
+            table_columns = cls.__table__.columns  # type: ignore
+            query = select(cls.id, *(table_columns[name] for name in row_cache.columns)).where(col(cls.id).in_(ids))
+            return {row[0]: tuple(row[1:]) for row in await session.execute(query)}
+
+        fill = not reads_from_replica(session) and not row_cache.has_pending(session)
+        rows = await row_cache.get_many(ids, load, fill)
+        indexes = [row_cache.indexes[name] for name in names]
+        if scalar:
+            index = indexes[0]
+            return {id: values[index] for id, values in rows.items() if values is not None}
+        found = [(id, values) for id, values in rows.items() if values is not None]
+        projected = make_rows(names, (tuple(values[i] for i in indexes) for _, values in found))
+        return {id: row for (id, _), row in zip(found, projected)}
+
+    @classmethod
+    async def invalidate_cache(cls, session: AsyncSession, ids: Sequence[int]) -> None:
+        row_cache = get_row_cache(cls)
+        if row_cache is not None:
+            await row_cache.invalidate_on_commit(session, ids)
+        versions = get_row_versions(cls)
+        if versions is not None:
+            versions.add_pending(session, ids)
+
+    @classmethod
+    def count_on_commit(cls, session: AsyncSession, delta: int | None) -> None:
+        """Adds the delta to the maintained count after the session commits, None means the delta is unknown."""
+        row_counter = get_row_counter(cls)
+        if row_counter is not None:
+            row_counter.add_on_commit(session, delta)
+
     @classmethod
     async def get_by_id(
         cls,
-        session: AsyncSession,
+        session: AsyncSession | ShardedSession,
         id: int,
         columns: list | tuple | InstrumentedAttribute | TextClause | Column | Mapped | None = None,
         for_update: bool = False,
         for_read: bool = False,
     ) -> Any:
-        if columns is None:
-            query = select(cls)
-            scalar = True
-        else:
-            if isinstance(columns, (list, tuple)):
-                query = select(*columns)
-                scalar = False
-            else:
-                query = select(columns)
-                scalar = True
-        query = query.where(cls.id == id)
-        if for_update:
-            query = query.with_for_update()
-        elif for_read:
-            query = query.with_for_update(read=True)
+        if isinstance(session, ShardedSession):
+            session = session.for_id(id)
+        if not (for_update or for_read):
+            row_cache = get_row_cache(cls)
+            if row_cache is not None:
+                names = cls.cached_column_names(columns)
+                if names is not None:
+                    scalar = not isinstance(columns, (list, tuple))
+                    return (await cls.get_cached_by_ids(session, row_cache, (id,), names, scalar)).get(id)
+
+        query, scalar = cls.select_by_ids(columns, for_update, for_read)
         if scalar:
-            return await session.scalar(query)
+            return await session.scalar(query, {'id': id})
         else:
-            return (await session.execute(query)).first()
+            return (await session.execute(query, {'id': id})).first()
+
+    @classmethod
+    async def load_by_id(
+        cls,
+        id: int,
+        columns: list | tuple | InstrumentedAttribute | TextClause | Column | Mapped | None = None,
+        readonly: bool = False,
+    ) -> Any:
+        """Like `get_by_id()`, but batched with the concurrent calls of the same columns into one query. It reads from
+        the primary, or from a replica if `readonly`, for the callers which don't mind reading a stale row."""
+        return await get_loader(cls, columns, readonly).load(id)
 
     @classmethod
     async def get_by_ids(
         cls,
-        session: AsyncSession,
+        session: AsyncSession | ShardedSession,
         ids: Sequence[int],
         columns: list | tuple | InstrumentedAttribute | TextClause | Column | Mapped | None = None,
         for_update: bool = False,
@@ -61,53 +212,53 @@ class BaseModel(SQLModel, table=False):
     ) -> Sequence:
         if not ids:
             return []
-        if columns is None:
-            query = select(cls)
-            scalar = True
-        else:
-            if isinstance(columns, (list, tuple)):
-                query = select(*columns)
-                scalar = False
-            else:
-                query = select(columns)
-                scalar = True
-        query = query.where(col(cls.id).in_(ids))
-        if for_update:
-            query = query.with_for_update()
-        elif for_read:
-            query = query.with_for_update(read=True)
+        if isinstance(session, ShardedSession):
+            results = await asyncio.gather(
+                *(
+                    cls.get_by_ids(shard_session, shard_ids, columns, for_update, for_read)
+                    for shard_session, shard_ids in session.group_ids(ids)
+                )
+            )
+            return merge_results(results, id_getter(cls, columns))
+        if not (for_update or for_read):
+            row_cache = get_row_cache(cls)
+            if row_cache is not None:
+                names = cls.cached_column_names(columns)
+                if names is not None:
+                    scalar = not isinstance(columns, (list, tuple))
+                    rows = await cls.get_cached_by_ids(session, row_cache, ids, names, scalar)
+                    return [rows[id] for id in sorted(rows)]  # in the primary key order as MySQL returns
+
+        query, scalar = cls.select_by_ids(columns, for_update, for_read, many=True)
+        params = {'ids': list(ids)}
         if scalar:
-            return (await session.scalars(query)).all()
+            return (await session.scalars(query, params)).all()
         else:
-            return (await session.execute(query)).all()
+            return (await session.execute(query, params)).all()
 
     @classmethod
-    async def exist(cls, session: AsyncSession, id: int, for_update: bool = False, for_read: bool = False) -> bool:
-        query = select(text('1')).select_from(cls).where(cls.id == id)
-        if for_update:
-            query = query.with_for_update()
-        elif for_read:
-            query = query.with_for_update(read=True)
-        return (await session.scalar(query)) is not None
+    async def exist(
+        cls, session: AsyncSession | ShardedSession, id: int, for_update: bool = False, for_read: bool = False
+    ) -> bool:
+        if isinstance(session, ShardedSession):
+            session = session.for_id(id)
+        query = cls.select_exist(for_update, for_read)
+        return (await session.scalar(query, {'id': id})) is not None
 
     @classmethod
     async def get_all(
         cls,
-        session: AsyncSession,
+        session: AsyncSession | ShardedSession,
         columns: list | tuple | InstrumentedAttribute | Mapped | None = None,
         for_update: bool = False,
         for_read: bool = False,
     ) -> Sequence:
-        if columns is None:
-            query = select(cls)
-            scalar = True
-        else:
-            if isinstance(columns, (list, tuple)):
-                query = select(*columns)
-                scalar = False
-            else:
-                query = select(columns)
-                scalar = True
+        if isinstance(session, ShardedSession):
+            results = await asyncio.gather(
+                *(cls.get_all(shard_session, columns, for_update, for_read) for shard_session in session.all())
+            )
+            return merge_results(results, id_getter(cls, columns))
+        query, scalar = cls.select_columns(columns)
         if for_update:
             query = query.with_for_update()
         elif for_read:
@@ -118,34 +269,316 @@ class BaseModel(SQLModel, table=False):
             return (await session.execute(query)).all()
 
     @classmethod
-    async def count_all(cls, session: AsyncSession) -> int:
+    async def stream_all(
+        cls,
+        session: AsyncSession | ShardedSession,
+        columns: list | tuple | InstrumentedAttribute | Mapped | None = None,
+        chunk_size: int = 1000,
+    ) -> AsyncIterator[Sequence]:
+        """Yields all the rows in chunks of at most `chunk_size` rows, in the order of id.
+
+        The rows are fetched through an unbuffered server-side cursor, so the memory usage doesn't grow with the table
+        size. The session's connection is occupied until the iteration finishes. The shards of a `ShardedSession` are
+        streamed one after another, so the rows are only in the order of id within each shard.
+        """
+        if isinstance(session, ShardedSession):
+            for shard_session in session.all():
+                async for rows in cls.stream_all(shard_session, columns, chunk_size):
+                    yield rows
+            return
+        query, scalar = cls.select_columns(columns)
+        query = query.order_by(col(cls.id)).execution_options(yield_per=chunk_size)
+        if scalar:
+            result = await session.stream_scalars(query)
+        else:
+            result = await session.stream(query)
+        try:
+            async for rows in result.partitions():
+                yield rows
+        finally:
+            await result.close()
+
+    @classmethod
+    async def get_page(
+        cls,
+        session: AsyncSession | ShardedSession,
+        after_id: int = 0,
+        limit: int = 100,
+        columns: list | tuple | InstrumentedAttribute | Mapped | None = None,
+    ) -> Sequence:
+        """Returns at most `limit` rows whose ids are greater than `after_id`, in the order of id.
+
+        It seeks by the primary key, so it costs the same for every page, unlike `OFFSET`. With a `ShardedSession`, a
+        page is read from every shard and they're merged by id, so the columns must include the id.
+        """
+        if isinstance(session, ShardedSession):
+            key = id_getter(cls, columns)
+            if key is None:
+                raise ValueError('get_page() needs the id column to merge the pages of the shards')
+            results = await asyncio.gather(
+                *(cls.get_page(shard_session, after_id, limit, columns) for shard_session in session.all())
+            )
+            return merge_results(results, key)[:limit]
+        query, scalar = cls.select_columns(columns)
+        query = query.where(col(cls.id) > after_id).order_by(col(cls.id)).limit(limit)
+        if scalar:
+            return (await session.scalars(query)).all()
+        else:
+            return (await session.execute(query)).all()
+
+    @classmethod
+    async def count_all(
+        cls,
+        session: AsyncSession | ShardedSession,
+        max_count: int = 0,
+        mode: Literal['exact', 'approximate', 'maintained'] = 'exact',
+    ) -> int:
+        """Returns the number of rows, or `max_count` if there are more than that, which stops scanning early.
+
+        The exact count scans an index, so it gets slower as the table grows. The approximate count is the optimizer's
+        estimate of the rows to scan, which is based on the sampled index statistics and may be off by tens of percent.
+        The maintained count is read from Redis if the model sets `__count_ttl__`, otherwise it's exact.
+        """
+        if mode == 'maintained':
+            row_counter = get_row_counter(cls)
+            if row_counter is not None:
+                row_count = await row_counter.get(lambda: cls.count_all(session))
+                return min(row_count, max_count) if max_count else row_count
+            mode = 'exact'
+        if isinstance(session, ShardedSession):
+            counts = await asyncio.gather(
+                *(cls.count_all(shard_session, max_count, mode) for shard_session in session.all())
+            )
+            return min(sum(counts), max_count) if max_count else sum(counts)
+        if mode == 'approximate':
+            # information_schema.TABLES.TABLE_ROWS is cached by the server for information_schema_stats_expiry
+            explained = (await session.execute(text(f'EXPLAIN SELECT 1 FROM `{cls.__tablename__}`'))).mappings().first()
+            row_count = int(explained['rows'] or 0) if explained else 0
+            return min(row_count, max_count) if max_count else row_count
+        if max_count:
+            limited = select(text('1')).select_from(cls).limit(max_count).subquery()
+            return await session.scalar(select(func.count()).select_from(limited))  # type: ignore
         return await session.scalar(select(func.count()).select_from(cls))  # type: ignore
 
     @classmethod
-    async def update_by_id(cls, session: AsyncSession, id: int, values: Values) -> int:
-        return (await session.execute(update(cls).where(col(cls.id) == id).values(**values))).rowcount
+    async def update_by_id(cls, session: AsyncSession | ShardedSession, id: int, values: Values) -> int:
+        if isinstance(session, ShardedSession):
+            shard_session = session.for_id(id)
+            shard_key = cls.__shard_key__
+            if ('id' in values and session.for_id(values['id']) is not shard_session) or (
+                shard_key != 'id' and shard_key in values and session.for_key(values[shard_key]) is not shard_session
+            ):
+                raise ValueError("update_by_id() can't move a row to another shard")
+            session = shard_session
+        # let the ORM move the instance in the identity map, or evaluate the SQL expressions, which can't be bound
+        if 'id' in values or any(isinstance(value, ClauseElement) for value in values.values()):
+            row_count = (await session.execute(update(cls).where(col(cls.id) == id).values(**values))).rowcount
+            if row_count:
+                await cls.invalidate_cache(session, (id, values['id']) if 'id' in values else (id,))
+            return row_count
+
+        query = cls.update_by_id_statement(tuple(values))
+        row_count = (await session.execute(query, {'where_id': id, **values})).rowcount
+        if row_count:
+            # the ORM can't evaluate bind parameters to synchronize the loaded instance like it does for literal values
+            instance = session.sync_session.identity_map.get(identity_key(cls, id))
+            if instance is not None:
+                for name, value in values.items():
+                    set_committed_value(instance, name, value)
+            await cls.invalidate_cache(session, (id,))
+        return row_count
 
     @classmethod
-    async def delete_by_id(cls, session: AsyncSession, id: int) -> int:
-        return (await session.execute(delete(cls).where(col(cls.id) == id))).rowcount
+    async def update_by_ids(
+        cls,
+        session: AsyncSession | ShardedSession,
+        values: Mapping[int, Values],
+        batch_size: int = 1000,
+        max_packet_size: int = 0,
+    ) -> int:
+        """Updates each row by id with its own values, using `UPDATE ... SET column = CASE id WHEN ... END` statements.
+
+        Each statement updates up to `batch_size` rows. The rows may update different columns, and the columns not given
+        for a row keep their values. Ids can't be updated.
+        It returns the number of matched rows.
+        """
+        if any('id' in row_values for row_values in values.values()):
+            raise ValueError("update_by_ids() can't update ids")
+        if isinstance(session, ShardedSession):
+            row_counts = await asyncio.gather(
+                *(
+                    cls.update_by_ids(shard_session, {id: values[id] for id in ids}, batch_size, max_packet_size)
+                    for shard_session, ids in session.group_ids(values)
+                )
+            )
+            return sum(row_counts)
+        # lock the rows in order
+        rows = [{'id': id, **row_values} for id, row_values in sorted(values.items()) if row_values]
+        # each value is sent with its id in the CASE expression, and each id is sent again in the IN list
+        max_packet_size = (max_packet_size or config.MYSQL_MAX_PACKET_SIZE) // 2
+        id_column = col(cls.id)
+        row_count = 0
+        for chunk in chunk_rows(rows, max_packet_size, batch_size):
+            names = dict.fromkeys(name for row in chunk for name in row if name != 'id')
+            assignments = {
+                name: case(
+                    {row['id']: row[name] for row in chunk if name in row}, value=id_column, else_=getattr(cls, name)
+                )
+                for name in names
+            }
+            ids = [row['id'] for row in chunk]
+            row_count += (await session.execute(update(cls).where(id_column.in_(ids)).values(assignments))).rowcount
+        if row_count:
+            await cls.invalidate_cache(session, list(values))
+        return row_count
 
     @classmethod
-    async def delete_by_ids(cls, session: AsyncSession, ids: Sequence[int]) -> int:
-        return (await session.execute(delete(cls).where(col(cls.id).in_(ids)))).rowcount
+    async def delete_by_id(cls, session: AsyncSession | ShardedSession, id: int) -> int:
+        if isinstance(session, ShardedSession):
+            session = session.for_id(id)
+        row_count = (await session.execute(delete(cls).where(col(cls.id) == id))).rowcount
+        if row_count:
+            await cls.invalidate_cache(session, (id,))
+            cls.count_on_commit(session, -row_count)
+        return row_count
 
     @classmethod
-    async def insert(cls, session: AsyncSession, values: Values) -> int:
-        return (await session.execute(insert(cls).values(**values))).lastrowid
+    async def delete_by_ids(cls, session: AsyncSession | ShardedSession, ids: Sequence[int]) -> int:
+        if isinstance(session, ShardedSession):
+            row_counts = await asyncio.gather(
+                *(cls.delete_by_ids(shard_session, shard_ids) for shard_session, shard_ids in session.group_ids(ids))
+            )
+            return sum(row_counts)
+        row_count = (await session.execute(delete(cls).where(col(cls.id).in_(ids)))).rowcount
+        if row_count:
+            await cls.invalidate_cache(session, ids)
+            cls.count_on_commit(session, -row_count)
+        return row_count
+
+    @classmethod
+    async def insert(cls, session: AsyncSession | ShardedSession, values: Values) -> int:
+        if isinstance(session, ShardedSession):
+            if values.get('id') is None:
+                values = {**values, 'id': await allocate_id(cls, values, session)}
+            session = session.for_id(values['id'])
+        row_id = (await session.execute(insert(cls).values(**values))).lastrowid
+        await cls.invalidate_cache(session, (row_id,))  # the id may have been cached as missing
+        cls.count_on_commit(session, 1)
+        return row_id
 
     @classmethod
     async def batch_insert(cls, session: AsyncSession, values: list[Values | tuple], batch_size: int = 1000) -> int:
-        total_count = len(values)
+        return (await cls.bulk_insert(session, values, max_batch_size=batch_size)).row_count
 
-        row_count: int = 0
-        i: int = 0
-        while i < total_count:
-            batch_values = values[i : i + batch_size]
-            row_count += (await session.execute(insert(cls).values(batch_values))).rowcount
-            i += batch_size
+    @classmethod
+    async def bulk_insert(
+        cls,
+        session: AsyncSession | ShardedSession,
+        values: Sequence[Values | tuple],
+        on_duplicate: Literal['error', 'ignore', 'update'] = 'error',
+        update_columns: Sequence[str] = (),
+        max_packet_size: int = 0,
+        max_batch_size: int = 1000,
+        concurrency: int = 1,
+    ) -> BulkInsertResult:
+        """Inserts the rows by multi-row INSERT statements, each of them is kept under `max_packet_size` bytes.
 
-        return row_count
+        `on_duplicate` decides what to do with the rows conflicting with existing unique keys: raise an error,
+        ignore them (`INSERT IGNORE`), or update the `update_columns` of existing rows (`ON DUPLICATE KEY UPDATE`).
+        The generated id ranges are only reported in the default mode, since MySQL doesn't tell which rows were
+        inserted otherwise. When updating a cached model, the ids of the rows are selected by the unique keys declared
+        on the model after each chunk, so that the updated rows are invalidated.
+
+        If `concurrency` is greater than 1, the chunks are written by that many new sessions concurrently, and each of
+        them commits its own chunks, so it's not atomic and `session` is not used.
+
+        With a `ShardedSession`, the rows without ids get ids allocated on the shards of their shard keys, like
+        `insert()`, and the shards are written concurrently by their own sessions, so `concurrency` is not supported.
+        """
+        if not values:
+            return BulkInsertResult(0, [])
+        if isinstance(session, ShardedSession):
+            if concurrency > 1:
+                raise ValueError("bulk_insert() can't write a ShardedSession with more concurrency")
+            names = cls.__table__.columns.keys()  # type: ignore
+            shard_rows: dict[AsyncSession, list[Values | tuple]] = {}
+            for row in values:
+                if isinstance(row, dict):
+                    if row.get('id') is None:
+                        row = {**row, 'id': await allocate_id(cls, row, session)}
+                    id = row['id']
+                else:
+                    if row[0] is None:
+                        row = (await allocate_id(cls, dict(zip(names, row)), session), *row[1:])
+                    id = row[0]
+                shard_rows.setdefault(session.for_id(id), []).append(row)
+            results = await asyncio.gather(
+                *(
+                    cls.bulk_insert(shard_session, rows, on_duplicate, update_columns, max_packet_size, max_batch_size)
+                    for shard_session, rows in shard_rows.items()
+                )
+            )
+            return BulkInsertResult(sum(result.row_count for result in results), [])  # the ids are explicit
+
+        if on_duplicate == 'update':
+            if not update_columns:
+                raise ValueError('update_columns is required to update duplicate rows')
+            statement = mysql_insert(cls)
+            statement = statement.on_duplicate_key_update({name: statement.inserted[name] for name in update_columns})
+        elif on_duplicate == 'ignore':
+            statement = insert(cls).prefix_with('IGNORE')
+        else:
+            statement = insert(cls)
+        chunks = chunk_rows(values, max_packet_size or config.MYSQL_MAX_PACKET_SIZE, max_batch_size)
+        report_ids = on_duplicate == 'error' and not has_explicit_ids(values)
+        row_cache = get_row_cache(cls)
+        versions = get_row_versions(cls)
+        # the rows updated for conflicting on another unique key than the id are found by that key
+        keys: list[tuple[str, ...]] = []
+        if on_duplicate == 'update' and (row_cache is not None or versions is not None):
+            keys = unique_keys(cls.__table__)  # type: ignore
+
+        row_count = 0
+        id_ranges: list[tuple[int, int]] = []
+        upserted_ids: list[int] = []
+
+        async def write(session: AsyncSession, chunk: Sequence) -> None:
+            nonlocal row_count
+            result = await session.execute(statement.values(chunk))
+            row_count += result.rowcount
+            # an upserted row is counted as 2 if it's updated, so the number of inserted rows is unknown
+            cls.count_on_commit(session, UNKNOWN if on_duplicate == 'update' else result.rowcount)
+            if report_ids and result.lastrowid:
+                id_ranges.append((result.lastrowid, result.lastrowid + result.rowcount - 1))
+            if keys:
+                condition = match_unique_keys(cls.__table__, keys, chunk)  # type: ignore
+                if condition is not None:
+                    upserted_ids.extend(await session.scalars(select(cls.id).where(condition)))
+
+        if concurrency > 1:
+
+            async def worker() -> None:
+                async with get_session() as session:
+                    for chunk in chunks:  # shared by the workers
+                        await write(session, chunk)
+                        await session.commit()
+
+            await asyncio.gather(*(worker() for _ in range(concurrency)))
+            id_ranges.sort()
+        else:
+            for chunk in chunks:
+                await write(session, chunk)
+
+        if row_cache is not None or versions is not None:
+            # the inserted ids may have been cached as missing, and the updated rows are stale
+            ids = [id for row in values if (id := row.get('id') if isinstance(row, dict) else row[0]) is not None]
+            ids.extend(BulkInsertResult(row_count, id_ranges).ids)
+            ids.extend(upserted_ids)
+            if concurrency > 1:  # already committed
+                if versions is not None:
+                    await versions.invalidate(ids)  # along with the row cache
+                elif row_cache is not None:
+                    await row_cache.invalidate(ids)
+            else:
+                await cls.invalidate_cache(session, ids)
+        return BulkInsertResult(row_count, id_ranges)
@@ -0,0 +1,92 @@
+from datetime import date, datetime
+from typing import Any, Iterator, NamedTuple, Sequence
+
+from sqlalchemy import Table, UniqueConstraint, or_, tuple_
+from sqlalchemy.sql import ColumnElement
+
+STATEMENT_OVERHEAD = 1024  # bytes reserved for the statement besides the values
+
+
+class BulkInsertResult(NamedTuple):
+    row_count: int
+    # The (first, last) auto-increment ids generated by each statement. InnoDB allocates consecutive ids to the rows of
+    # a multi-row INSERT whose row count is known, so each range covers exactly the rows inserted by that statement.
+    # It's empty if any row specifies its id.
+    id_ranges: list[tuple[int, int]]
+
+    @property
+    def ids(self) -> Iterator[int]:
+        for first, last in self.id_ranges:
+            yield from range(first, last + 1)
+
+
+def estimate_size(value: Any) -> int:
+    """Estimates the bytes of a value in an INSERT statement, erring on the large side."""
+    if value is None:
+        return 4
+    if isinstance(value, str):
+        # quotes and backslashes are escaped by doubling them, a character takes up to 4 bytes in UTF-8
+        return (len(value) * 2 if value.isascii() else len(value) * 4) + 3  # quoted and separated
+    if isinstance(value, bytes):
+        return len(value) * 2 + 3  # may be escaped
+    if isinstance(value, (datetime, date)):
+        return 29
+    return len(str(value)) + 1
+
+
+def estimate_row_size(row: Any) -> int:
+    return sum(estimate_size(value) for value in (row.values() if isinstance(row, dict) else row)) + 3
+
+
+def has_explicit_ids(rows: Sequence) -> bool:
+    # the id is the first column of BaseModel
+    return any((row.get('id') if isinstance(row, dict) else row[0]) is not None for row in rows)
+
+
+def chunk_rows(rows: Sequence, max_packet_size: int, max_batch_size: int) -> Iterator[Sequence]:
+    """Splits the rows into chunks whose INSERT statements fit in `max_packet_size` bytes."""
+    budget = max_packet_size - STATEMENT_OVERHEAD
+    start = 0
+    size = 0
+    for i, row in enumerate(rows):
+        row_size = estimate_row_size(row)
+        if i > start and (size + row_size > budget or i - start >= max_batch_size):
+            yield rows[start:i]
+            start = i
+            size = 0
+        size += row_size
+    if start < len(rows):
+        yield rows[start:]
+
+
+def unique_keys(table: Table) -> list[tuple[str, ...]]:
+    """Returns the column names of the unique keys of the table, besides the primary key."""
+    keys = [
+        tuple(column.name for column in constraint.columns)
+        for constraint in table.constraints
+        if isinstance(constraint, UniqueConstraint)
+    ]
+    keys.extend(tuple(column.name for column in index.columns) for index in table.indexes if index.unique)
+    return keys
+
+
+def match_unique_keys(table: Table, keys: Sequence[tuple[str, ...]], rows: Sequence) -> ColumnElement[bool] | None:
+    """Returns the condition of the existing rows which conflict with the rows to insert on any of the unique keys, or
+    None if the rows don't set any of them."""
+    names = table.columns.keys()
+    conditions = []
+    for key in keys:
+        indexes = [names.index(name) for name in key]  # of the values of tuple rows
+        values = []
+        for row in rows:
+            if isinstance(row, dict):
+                if all(name in row for name in key):
+                    values.append(tuple(row[name] for name in key))
+            elif len(row) > max(indexes):
+                values.append(tuple(row[i] for i in indexes))
+        if values:
+            if len(key) == 1:
+                conditions.append(table.columns[key[0]].in_([value[0] for value in values]))
+            else:
+                conditions.append(tuple_(*(table.columns[name] for name in key)).in_(values))
+    return or_(*conditions) if conditions else None
@@ -0,0 +1,233 @@
+import asyncio
+import logging
+from random import random
+from typing import Any, Awaitable, Callable, Coroutine, Iterable, Sequence
+
+from pydantic import TypeAdapter
+from redis.exceptions import RedisError
+from sqlalchemy import event
+from sqlalchemy.engine.result import IteratorResult, SimpleResultMetaData
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy.orm import Mapper, Session, object_session
+from sqlmodel import SQLModel
+
+from app.clients.near_cache import near_cache
+from app.clients.redis import redis_client
+from app.config import config
+
+Loader = Callable[[list[int]], Awaitable[dict[int, tuple]]]
+
+TOMBSTONE = b''  # written on invalidation, so that a reader which loaded the old row can't cache it again
+PENDING_INVALIDATIONS = 'row_cache_invalidations'
+
+background_tasks: set[asyncio.Task] = set()
+
+
+def spawn(coro: Coroutine) -> None:
+    try:
+        task = asyncio.get_running_loop().create_task(coro)
+    except RuntimeError:  # no running event loop
+        coro.close()
+        return
+    background_tasks.add(task)
+    task.add_done_callback(background_tasks.discard)
+
+
+async def drain_background_tasks(timeout: float) -> None:
+    if background_tasks:
+        _, pending = await asyncio.wait(background_tasks, timeout=timeout)
+        if pending:
+            logging.warning('cancelling %d background tasks', len(pending))
+            for task in pending:
+                task.cancel()
+
+
+def make_rows(keys: Sequence[str], values: Iterable[tuple]) -> Sequence:
+    return IteratorResult(SimpleResultMetaData(keys), iter(values)).all()
+
+
+class RowCache:
+    """Caches the given columns of a model's rows in Redis, keyed by id.
+
+    Each row is stored as a JSON array, and a missing row is stored as `null` for a shorter time. Concurrent misses of
+    the same id in this process share one query, and TTLs are jittered so that hot keys don't expire together.
+    """
+
+    def __init__(self, model: type[SQLModel], columns: Sequence[str], ttl: int) -> None:
+        self.model = model
+        self.columns = tuple(columns)
+        self.indexes = {name: i for i, name in enumerate(self.columns)}
+        self.ttl = ttl
+        self.prefix = f'row:{model.__tablename__}:'
+        self.adapter: TypeAdapter[tuple | None] = TypeAdapter(
+            tuple[tuple(model.model_fields[name].annotation for name in self.columns)] | None  # type: ignore
+        )
+        self.loading: dict[int, asyncio.Future] = {}
+        self.hits = 0
+        self.misses = 0
+
+    def key(self, id: int) -> str:
+        return f'{self.prefix}{id}'
+
+    def jittered_ttl(self, ttl: int) -> int:
+        return ttl + int(ttl * random() * 0.1)
+
+    async def get_many(self, ids: Sequence[int], load: Loader, fill: bool = True) -> dict[int, tuple | None]:
+        """Returns the cached columns of the rows, with None for missing rows. `load` queries the missed rows, which are
+        cached if `fill`. Rows loaded without filling the cache, e.g. from a replica or by a session with uncommitted
+        writes, are not shared with the concurrent misses either, since they may be stale or never be committed."""
+        unique_ids = list(dict.fromkeys(ids))
+        result: dict[int, tuple | None] = {}
+        cacheable_ids: set[int] = set()
+        try:
+            cached = await near_cache.mget([self.key(id) for id in unique_ids])
+        except RedisError:
+            logging.exception('failed to read row cache')
+            cached = [TOMBSTONE] * len(unique_ids)
+
+        missed_ids: list[int] = []
+        for id, data in zip(unique_ids, cached):
+            if data is None:
+                cacheable_ids.add(id)
+                missed_ids.append(id)
+            elif data == TOMBSTONE:
+                missed_ids.append(id)
+            else:
+                result[id] = self.adapter.validate_json(data)
+        self.hits += len(result)
+        self.misses += len(missed_ids)
+        if not missed_ids:
+            return result
+
+        if not fill:
+            loaded = await load(missed_ids)
+            result.update((id, loaded.get(id)) for id in missed_ids)
+            return result
+
+        waiting: dict[int, asyncio.Future] = {}
+        to_load: list[int] = []
+        for id in missed_ids:
+            future = self.loading.get(id)
+            if future is None:
+                to_load.append(id)
+            else:
+                waiting[id] = future
+
+        if to_load:
+            loop = asyncio.get_running_loop()
+            futures = {id: loop.create_future() for id in to_load}
+            self.loading.update(futures)
+            try:
+                loaded = await load(to_load)
+            except Exception as e:
+                for future in futures.values():
+                    future.set_exception(e)
+                    future.exception()  # mark it retrieved even if nobody is waiting
+                raise
+            except BaseException:
+                for future in futures.values():
+                    future.cancel()
+                raise
+            finally:
+                for id in to_load:
+                    del self.loading[id]
+            for id, future in futures.items():
+                values = loaded.get(id)
+                future.set_result(values)
+                result[id] = values
+            await self.set_many({id: result[id] for id in to_load if id in cacheable_ids})
+
+        abandoned: list[int] = []
+        for id, future in waiting.items():
+            try:
+                # shielded, so that cancelling this caller doesn't cancel the load shared with the others
+                result[id] = await asyncio.shield(future)
+            except asyncio.CancelledError:
+                task = asyncio.current_task()
+                if not future.cancelled() or (task is not None and task.cancelling()):
+                    raise
+                abandoned.append(id)  # the caller loading it was cancelled
+        if abandoned:
+            result.update(await self.get_many(abandoned, load))
+        return result
+
+    async def set_many(self, rows: dict[int, tuple | None]) -> None:
+        if not rows:
+            return
+        try:
+            async with redis_client.pipeline(transaction=False) as pipe:
+                for id, values in rows.items():
+                    ttl = self.ttl if values is not None else config.ROW_CACHE_MISS_TTL
+                    # NX: don't overwrite a tombstone written by a concurrent update
+                    pipe.set(self.key(id), self.adapter.dump_json(values), ex=self.jittered_ttl(ttl), nx=True)
+                await pipe.execute()
+        except RedisError:
+            logging.exception('failed to write row cache')
+
+    async def invalidate(self, ids: Iterable[int]) -> None:
+        keys = [self.key(id) for id in ids]
+        if not keys:
+            return
+        try:
+            async with redis_client.pipeline(transaction=False) as pipe:
+                for key in keys:
+                    pipe.set(key, TOMBSTONE, ex=config.ROW_CACHE_TOMBSTONE_TTL)
+                await pipe.execute()
+        except RedisError:
+            logging.exception('failed to invalidate row cache')
+
+    async def invalidate_on_commit(self, session: AsyncSession, ids: Iterable[int]) -> None:
+        """Invalidates the rows now, and again after the session commits, when other sessions can see the change."""
+        ids = [id for id in ids if id is not None]
+        if ids:
+            await self.invalidate(ids)
+            self.add_pending(session.sync_session, ids)
+
+    def has_pending(self, session: AsyncSession) -> bool:
+        """Whether the session has written rows of the model which are not committed yet, and may read them."""
+        return self in session.sync_session.info.get(PENDING_INVALIDATIONS, ())
+
+    def add_pending(self, session: Session, ids: Iterable[int]) -> None:
+        pending: dict[RowCache, set[int]] = session.info.setdefault(PENDING_INVALIDATIONS, {})
+        pending.setdefault(self, set()).update(ids)
+
+    def stats(self) -> dict[str, int]:
+        return {'hits': self.hits, 'misses': self.misses, 'loading': len(self.loading)}
+
+
+row_caches: dict[type, RowCache] = {}
+
+
+def get_row_cache(model: Any) -> RowCache | None:
+    columns = getattr(model, '__cache_columns__', None)
+    if not columns:
+        return None
+    cache = row_caches.get(model)
+    if cache is None:
+        cache = row_caches[model] = RowCache(model, columns, model.__cache_ttl__)
+    return cache
+
+
+@event.listens_for(Session, 'after_commit')
+def invalidate_after_commit(session: Session) -> None:
+    pending: dict[RowCache, set[int]] | None = session.info.pop(PENDING_INVALIDATIONS, None)
+    if pending:
+        for cache, ids in pending.items():
+            spawn(cache.invalidate(ids))
+
+
+@event.listens_for(Session, 'after_rollback')
+def discard_pending_invalidations(session: Session) -> None:
+    session.info.pop(PENDING_INVALIDATIONS, None)
+
+
+# rows written through the unit of work (e.g. session.add()) are invalidated after commit too
+@event.listens_for(Mapper, 'after_insert')
+@event.listens_for(Mapper, 'after_update')
+@event.listens_for(Mapper, 'after_delete')
+def invalidate_flushed_row(mapper: Mapper, connection: Any, target: Any) -> None:
+    cache = get_row_cache(mapper.class_)
+    if cache is not None:
+        session = object_session(target)
+        if session is not None:
+            cache.add_pending(session, (target.id,))
@@ -0,0 +1,123 @@
+import logging
+from typing import Any, Awaitable, Callable
+
+from redis.exceptions import RedisError
+from sqlalchemy import event
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy.orm import Mapper, Session, object_session
+from sqlmodel import SQLModel
+
+from app.clients.redis import redis_client
+
+from .cache import spawn
+
+PENDING_DELTAS = 'row_count_deltas'
+UNKNOWN = None  # a pending delta which can't be known, e.g. of an upsert
+
+# INCRBY only if the counter exists, otherwise it'd start from the delta instead of the count
+INCR_IF_EXISTS = """
+if redis.call('EXISTS', KEYS[1]) == 1 then
+    return redis.call('INCRBY', KEYS[1], ARGV[1])
+end
+"""
+
+
+class RowCounter:
+    """Maintains the number of rows of a model in Redis.
+
+    The counter is loaded by an exact count when it's missing, and kept in step by the changes committed through the
+    `BaseModel` methods and the unit of work. It expires after `ttl` seconds to be reconciled with the exact count
+    again, since it may drift by the changes committed while it's being loaded, or made by other means.
+    """
+
+    def __init__(self, model: type[SQLModel], ttl: int) -> None:
+        self.key = f'row_count:{model.__tablename__}'
+        self.ttl = ttl
+        self.incr_if_exists = redis_client.register_script(INCR_IF_EXISTS)
+        self.hits = 0
+        self.misses = 0
+
+    async def get(self, count: Callable[[], Awaitable[int]]) -> int:
+        """Returns the maintained count, or loads it by `count` if it's missing."""
+        try:
+            value = await redis_client.get(self.key)
+        except RedisError:
+            logging.exception('failed to read row count')
+            return await count()
+        if value is not None:
+            self.hits += 1
+            return int(value)
+        self.misses += 1
+        row_count = await count()
+        try:
+            await redis_client.set(self.key, row_count, ex=self.ttl, nx=True)
+        except RedisError:
+            logging.exception('failed to write row count')
+        return row_count
+
+    async def add(self, delta: int | None) -> None:
+        try:
+            if delta is UNKNOWN:
+                await redis_client.delete(self.key)
+            elif delta:
+                await self.incr_if_exists(keys=[self.key], args=[delta])
+        except RedisError:
+            logging.exception('failed to update row count')
+
+    def add_on_commit(self, session: AsyncSession | Session, delta: int | None) -> None:
+        """Applies the delta after the session commits, when other sessions can count the change."""
+        if isinstance(session, AsyncSession):
+            session = session.sync_session
+        deltas: dict[RowCounter, int | None] = session.info.setdefault(PENDING_DELTAS, {})
+        if delta is UNKNOWN or deltas.get(self, 0) is UNKNOWN:
+            deltas[self] = UNKNOWN
+        else:
+            deltas[self] = deltas.get(self, 0) + delta
+
+    def stats(self) -> dict[str, int]:
+        return {'hits': self.hits, 'misses': self.misses}
+
+
+row_counters: dict[type, RowCounter] = {}
+
+
+def get_row_counter(model: Any) -> RowCounter | None:
+    ttl = getattr(model, '__count_ttl__', 0)
+    if not ttl:
+        return None
+    counter = row_counters.get(model)
+    if counter is None:
+        counter = row_counters[model] = RowCounter(model, ttl)
+    return counter
+
+
+@event.listens_for(Session, 'after_commit')
+def add_after_commit(session: Session) -> None:
+    deltas: dict[RowCounter, int | None] | None = session.info.pop(PENDING_DELTAS, None)
+    if deltas:
+        for counter, delta in deltas.items():
+            spawn(counter.add(delta))
+
+
+@event.listens_for(Session, 'after_rollback')
+def discard_pending_deltas(session: Session) -> None:
+    session.info.pop(PENDING_DELTAS, None)
+
+
+# rows added or deleted through the unit of work (e.g. session.add()) are counted after commit too
+@event.listens_for(Mapper, 'after_insert')
+def count_flushed_insert(mapper: Mapper, connection: Any, target: Any) -> None:
+    counter = get_row_counter(mapper.class_)
+    if counter is not None:
+        session = object_session(target)
+        if session is not None:
+            counter.add_on_commit(session, 1)
+
+
+@event.listens_for(Mapper, 'after_delete')
+def count_flushed_delete(mapper: Mapper, connection: Any, target: Any) -> None:
+    counter = get_row_counter(mapper.class_)
+    if counter is not None:
+        session = object_session(target)
+        if session is not None:
+            counter.add_on_commit(session, -1)
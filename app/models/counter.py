@@ -0,0 +1,154 @@
+import asyncio
+import logging
+import random
+
+import redis.asyncio as redis
+from redis.exceptions import RedisError
+
+from app.clients.redis import AutoPipeline, pipelined_client
+from app.config import config
+
+from .shard import IdAllocator
+
+
+class HotCounter:
+    """A counter which takes more increments than a single Redis key can.
+
+    The count is spread over `shards` keys, `{name}` and `{name}:1` to `{name}:{shards - 1}`, which are summed on read.
+    Each increment goes to a random key, so the writes don't all contend on one key. That only spreads the load if the
+    keys are served by different Redis nodes, which a single Redis server doesn't do, so one shard is the default. With
+    one shard and without local mode, it's a plain counter at `{name}`, and `incr()` returns the result of INCR, which
+    is exact and increases across the processes.
+
+    Consistency of `incr()`:
+
+    - By default, the increment is applied to Redis before `incr()` returns, by one INCRBY of a random key. The returned
+      count is the new value of that key plus the last values of the other keys known to this process, which reads them
+      every `refresh_interval` seconds. So it includes this increment and every one made by this process before it, but
+      may miss the increments of other processes in the last `refresh_interval` seconds. It increases within a process,
+      but different processes may return the same count. Once the increments stop, `get()` is exact.
+    - In local mode, each process buffers its increments. It flushes them by INCRBY every `flush_interval` seconds, or
+      as soon as `flush_size` are buffered, so Redis lags behind by up to that much. The buffered increments are lost if
+      the process crashes. `incr()` returns values leased from `{name}:lease` in ranges of `lease_size`, like the ids of
+      `IdAllocator`. They are unique across the processes and increase within each process, but they are not ordered
+      between processes. They also run ahead of the count by the unused parts of the ranges.
+
+    `get()` returns the sum of the keys plus the increments buffered by this process.
+    """
+
+    def __init__(
+        self,
+        client: redis.Redis | AutoPipeline,
+        name: str,
+        shards: int,
+        local: bool = False,
+        flush_interval: float = 1,
+        flush_size: int = 1000,
+        lease_size: int = 1000,
+        refresh_interval: float = 1,
+    ) -> None:
+        self.client = client
+        self.keys = [name, *(f'{name}:{i}' for i in range(1, shards))]
+        self.local = local
+        self.flush_interval = flush_interval
+        self.flush_size = flush_size
+        self.allocator = IdAllocator(client, f'{name}:lease', lease_size)
+        self.refresh_interval = refresh_interval
+        self.values: list[int] | None = None  # the last known values of the keys, without local mode
+        self.pending = 0
+        self.full = asyncio.Event()
+        self.task: asyncio.Task | None = None
+        self.flushes = 0
+
+    def random_key(self) -> str:
+        return self.keys[random.randrange(len(self.keys))]
+
+    async def incr(self) -> int:
+        if not self.local:
+            if len(self.keys) == 1:
+                return await self.client.incrby(self.keys[0], 1)
+            if self.values is None:  # the other keys are read on the first increment, then in the background
+                await self.refresh()
+            self.start()
+            index = random.randrange(len(self.keys))
+            value = await self.client.incrby(self.keys[index], 1)
+            values = self.values
+            assert values is not None
+            values[index] = max(values[index], value)
+            return sum(values)
+
+        if self.allocator.end_id == 0:  # the first lease of the process starts from the count if no one leased before
+            await self.client.set(self.allocator.key, await self.get(), nx=True)
+        self.start()
+        self.pending += 1
+        if self.pending >= self.flush_size:
+            self.full.set()
+        return await self.allocator.allocate()
+
+    async def get(self) -> int:
+        values = await asyncio.gather(*(self.client.get(key) for key in self.keys))
+        return sum(int(value or 0) for value in values) + self.pending
+
+    async def refresh(self) -> None:
+        values = [int(value or 0) for value in await asyncio.gather(*(self.client.get(key) for key in self.keys))]
+        if self.values is not None:  # the increments applied while reading are not lost
+            values = [max(value, known) for value, known in zip(values, self.values)]
+        self.values = values
+
+    async def flush(self) -> None:
+        delta, self.pending = self.pending, 0
+        if delta:
+            try:
+                await self.client.incrby(self.random_key(), delta)
+                self.flushes += 1
+            except RedisError:
+                logging.exception('failed to flush %d increments', delta)
+                self.pending += delta  # retry with the next flush
+
+    def start(self) -> None:
+        if self.task is None:
+            run = self.run() if self.local else self.refresh_periodically()
+            self.task = asyncio.get_running_loop().create_task(run)
+
+    async def close(self) -> None:
+        if self.task is not None:
+            self.task.cancel()
+            try:
+                await self.task
+            except asyncio.CancelledError:
+                pass
+            self.task = None
+        await self.flush()
+
+    async def run(self) -> None:
+        while True:
+            try:
+                async with asyncio.timeout(self.flush_interval):
+                    await self.full.wait()
+            except TimeoutError:
+                pass
+            self.full.clear()
+            await self.flush()
+
+    async def refresh_periodically(self) -> None:
+        while True:
+            await asyncio.sleep(self.refresh_interval)
+            try:
+                await self.refresh()
+            except RedisError:
+                logging.exception('failed to read the counter')
+
+    def stats(self) -> dict[str, int]:
+        return {'pending': self.pending, 'flushes': self.flushes}
+
+
+counter = HotCounter(
+    pipelined_client,
+    'count',
+    config.COUNTER_SHARDS,
+    config.COUNTER_LOCAL,
+    config.COUNTER_FLUSH_INTERVAL,
+    config.COUNTER_FLUSH_SIZE,
+    config.COUNTER_LEASE_SIZE,
+    config.COUNTER_REFRESH_INTERVAL,
+)
@@ -0,0 +1,118 @@
+import asyncio
+from typing import Any
+
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from app.clients.mysql import get_session
+from app.config import config
+from app.utils.cache import LRUCache
+
+from .cache import make_rows, spawn
+
+
+class BatchLoader:
+    """Coalesces the lookups of rows by id into one `get_by_ids()` query.
+
+    The ids requested in the same event loop iteration, or within `delay` seconds after the first one, are queried
+    together and the results are fanned back out to the callers. It returns what `get_by_id()` would return for the
+    same columns. Without a session, each batch is queried in a new session, so the callers don't check out connections
+    themselves. It reads from the primary, so that the callers read their own writes, unless it's `readonly`, whose
+    reads can be served by a lagging replica. A request-scoped loader can be given the session of the request instead,
+    as long as the session is not used concurrently.
+    """
+
+    def __init__(
+        self,
+        model: Any,
+        columns: Any = None,
+        session: AsyncSession | None = None,
+        delay: float = 0,
+        max_batch_size: int = 1000,
+        readonly: bool = False,
+    ) -> None:
+        self.model = model
+        self.columns = columns
+        self.session = session
+        self.delay = delay
+        self.max_batch_size = max_batch_size
+        self.readonly = readonly
+        self.pending: dict[int, asyncio.Future] = {}
+        self.handle: asyncio.Handle | None = None
+        self.batches = 0
+        self.loads = 0
+
+    def load(self, id: int) -> asyncio.Future:
+        """Returns a future of the row, shared by the callers of the same id. Each caller gets its own shield of it, so
+        that a cancelled caller only detaches itself, and the others still get the row."""
+        self.loads += 1
+        future = self.pending.get(id)
+        if future is None:
+            loop = asyncio.get_running_loop()
+            future = self.pending[id] = loop.create_future()
+            if len(self.pending) >= self.max_batch_size:
+                self.dispatch()
+            elif self.handle is None:
+                if self.delay:
+                    self.handle = loop.call_later(self.delay, self.dispatch)
+                else:
+                    self.handle = loop.call_soon(self.dispatch)
+        return asyncio.shield(future)
+
+    def dispatch(self) -> None:
+        if self.handle is not None:
+            self.handle.cancel()
+            self.handle = None
+        batch = self.pending
+        if batch:
+            self.pending = {}
+            self.batches += 1
+            spawn(self.fetch(batch))
+
+    async def fetch(self, batch: dict[int, asyncio.Future]) -> None:
+        try:
+            if self.session is None:
+                async with get_session(readonly=self.readonly) as session:
+                    results = await self.query(session, list(batch))
+            else:
+                results = await self.query(self.session, list(batch))
+            for id, future in batch.items():
+                future.set_result(results.get(id))
+        except Exception as e:
+            for future in batch.values():
+                if not future.done():
+                    future.set_exception(e)
+        finally:
+            # if the fetch itself was cancelled, e.g. on shutdown, cancel the callers rather than leave them waiting
+            for future in batch.values():
+                future.cancel()
+
+    async def query(self, session: AsyncSession, ids: list[int]) -> dict[int, Any]:
+        model = self.model
+        columns = self.columns
+        if columns is None:
+            return {instance.id: instance for instance in await model.get_by_ids(session, ids)}
+        if isinstance(columns, (list, tuple)):
+            if any(column is model.id for column in columns):
+                rows = await model.get_by_ids(session, ids, columns)
+                index = next(i for i, column in enumerate(columns) if column is model.id)
+                return {row[index]: row for row in rows}
+            rows = await model.get_by_ids(session, ids, (model.id, *columns))
+            if not rows:
+                return {}
+            keys = rows[0]._fields[1:]
+            return dict(zip((row[0] for row in rows), make_rows(keys, (tuple(row)[1:] for row in rows))))
+        if columns is model.id:
+            return {id: id for id in await model.get_by_ids(session, ids, columns)}
+        return {row[0]: row[1] for row in await model.get_by_ids(session, ids, (model.id, columns))}
+
+
+loaders: LRUCache[tuple, BatchLoader] = LRUCache(256)
+
+
+def get_loader(model: Any, columns: Any = None, readonly: bool = False) -> BatchLoader:
+    key = (model, tuple(columns) if isinstance(columns, list) else columns, readonly)
+    loader = loaders.get(key)
+    if loader is None:
+        loader = BatchLoader(model, columns, delay=config.MYSQL_BATCH_DELAY, readonly=readonly)
+        loaders.set(key, loader)
+    return loader
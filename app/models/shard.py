@@ -0,0 +1,106 @@
+import asyncio
+from operator import attrgetter, itemgetter
+from typing import Any, Awaitable, Callable, Sequence
+
+import redis.asyncio as redis
+from sqlalchemy.sql import func
+from sqlmodel import select
+
+from app.clients.mysql import ShardedSession, shard_of_key
+from app.clients.redis import redis_client
+from app.config import config
+
+
+class IdAllocator:
+    """Allocates ids which are unique across the shards from a Redis counter, instead of AUTO_INCREMENT.
+
+    Each process reserves `block_size` ids at a time by INCRBY, so the ids are increasing within a process but not
+    across them, and the unused ids of a block are skipped when the process exits. The counter must be initialized to
+    the maximum existing id before the first allocation, e.g. by `initialize()`.
+    """
+
+    def __init__(self, client: redis.Redis, key: str, block_size: int) -> None:
+        self.client = client
+        self.key = key
+        self.block_size = block_size
+        self.next_id = 0
+        self.end_id = 0  # exclusive
+        self.lock = asyncio.Lock()
+        self.initialized = False
+
+    async def initialize(self, last_id: Callable[[], Awaitable[int]]) -> None:
+        """Sets the counter to `last_id()` unless it's already set, once in each process."""
+        if not self.initialized:
+            async with self.lock:
+                if not self.initialized:
+                    if not await self.client.exists(self.key):  # e.g. the first use, or Redis lost it
+                        await self.client.set(self.key, await last_id(), nx=True)
+                    self.initialized = True
+
+    async def allocate(self) -> int:
+        if self.next_id >= self.end_id:
+            async with self.lock:
+                if self.next_id >= self.end_id:
+                    last_id = await self.client.incrby(self.key, self.block_size)
+                    self.next_id = last_id - self.block_size + 1
+                    self.end_id = last_id + 1
+        id = self.next_id
+        self.next_id += 1
+        return id
+
+
+id_allocators: dict[type, IdAllocator] = {}
+
+
+def get_id_allocator(model: Any) -> IdAllocator:
+    allocator = id_allocators.get(model)
+    if allocator is None:
+        allocator = id_allocators[model] = IdAllocator(
+            redis_client, f'id:{model.__tablename__}', config.MYSQL_ID_BLOCK_SIZE
+        )
+    return allocator
+
+
+async def allocate_id(model: Any, values: dict[str, Any], session: ShardedSession) -> int:
+    """Returns a new id of the row, whose shard by `id % shard_count` is the shard of the row's shard key.
+
+    The allocator starts from the maximum id of the shards, which is queried once in each process.
+    """
+    allocator = get_id_allocator(model)
+    shard_count = session.shard_count
+    shard_key = model.__shard_key__
+    if not allocator.initialized:
+
+        async def last_sequence() -> int:
+            query = select(func.max(model.id))
+            ids = await asyncio.gather(*(shard_session.scalar(query) for shard_session in session.all()))
+            last_id = max(id or 0 for id in ids)
+            return last_id if shard_key == 'id' else last_id // shard_count
+
+        await allocator.initialize(last_sequence)
+    sequence = await allocator.allocate()
+    if shard_key == 'id':
+        return sequence
+    return sequence * shard_count + shard_of_key(values[shard_key], shard_count)
+
+
+def id_getter(model: Any, columns: Any) -> Callable[[Any], int] | None:
+    """Returns how to get the id of a result of the columns, or None if the results don't have ids."""
+    if columns is None:
+        return attrgetter('id')
+    if isinstance(columns, (list, tuple)):
+        for i, column in enumerate(columns):
+            if column is model.id:
+                return itemgetter(i)
+        return None
+    if columns is model.id:
+        return lambda id: id
+    return None
+
+
+def merge_results(results: Sequence[Sequence], key: Callable[[Any], int] | None) -> list:
+    """Merges the results of the shards, in the order of id if they have ids."""
+    merged = [row for rows in results for row in rows]
+    if key is not None and len(results) > 1:
+        merged.sort(key=key)
+    return merged
@@ -0,0 +1,45 @@
+from typing import Any, Callable, TypeVar
+
+from sqlalchemy import Column
+from sqlalchemy.orm.attributes import InstrumentedAttribute
+
+from app.utils.cache import LRUCache
+
+T = TypeVar('T')
+
+# Statements built with bind parameters in place of the ids and values, so that they can be reused by every call.
+# SQLAlchemy memoizes the cache key of a statement object, so a reused statement also skips regenerating it before
+# looking up its compiled form.
+statement_cache: LRUCache[tuple, Any] = LRUCache(1024)
+
+
+def columns_key(columns: Any) -> tuple | None:
+    """Returns a key of the columns for the statement cache, or None if they can't be cached.
+
+    Only the model attributes and table columns are cached, since they live as long as the model, while other
+    expressions such as `text()` are usually built for each call.
+    """
+    if columns is None:
+        return ()
+    if isinstance(columns, (list, tuple)):
+        if all(isinstance(column, (InstrumentedAttribute, Column)) for column in columns):
+            return (tuple(columns),)
+        return None
+    if isinstance(columns, (InstrumentedAttribute, Column)):
+        return (columns,)
+    return None
+
+
+def lock_mode(for_update: bool, for_read: bool) -> str:
+    return 'update' if for_update else 'read' if for_read else ''
+
+
+def get_statement(key: tuple | None, build: Callable[[], T]) -> T:
+    """Returns the cached statement of the key, or builds it. The statement is not cached if the key is None."""
+    if key is None:
+        return build()
+    statement = statement_cache.get(key)
+    if statement is None:
+        statement = build()
+        statement_cache.set(key, statement)
+    return statement
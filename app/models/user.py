@@ -1,43 +1,64 @@
 import logging
 from datetime import datetime
 from time import time
+from typing import Literal, Mapping, Sequence
 
-from argon2 import PasswordHasher
 from fastapi import Depends
 from sqlalchemy.ext.asyncio import AsyncSession
 from sqlalchemy.sql import text
 from sqlmodel import Field, delete, select
 
+from app.clients.mysql import ShardedSession
 from app.config import config
 from app.schemas.token import TokenPayload
+from app.utils.cache import LRUCache
 from app.utils.exception import (
+    HTTPError,
     expired_token_error,
     internal_server_error,
     invalid_token_error,
 )
+from app.utils.hasher import hash_executor, ph
 from app.utils.token import decode_token, encode_token, oauth2_scheme
 
-from . import BaseModel
+from . import BaseModel, Values
+from .bulk import BulkInsertResult
+from .shard import allocate_id
 
 HASHED_PASSWORD_PREFIX = '$argon2id$v=19$m=65536,t=3,p=4$'
 HASHED_PASSWORD_PREFIX_LENGTH = len(HASHED_PASSWORD_PREFIX)
-ph = PasswordHasher()
+token_cache: LRUCache[str | bytes, TokenPayload] = LRUCache(config.TOKEN_CACHE_SIZE, timer=time)
 
 
 class UserBase(BaseModel):
-    name: str
+    name: str = Field(unique=True)
+
+
+class UserName(BaseModel, table=True):
+    """The index of the names of the sharded users, kept in the primary, since the unique key of each shard only covers
+    its own users. The writes of `User` given a `ShardedSession` keep it in step, and the queries by name look it up."""
+
+    __tablename__ = 'user_name'  # type: ignore
+
+    name: str = Field(unique=True)
 
 
 class User(UserBase, table=True):
+    __cache_columns__ = ('id', 'name', 'created_at', 'updated_at')
+    __count_ttl__ = 3600
+    __version_ttl__ = 7200
+    # by id rather than by name, which can change, and the names are kept unique across the shards by `UserName`
+    __shard_key__ = 'id'
+
     password: str
     created_at: datetime = Field(sa_column_kwargs={'server_default': text('CURRENT_TIMESTAMP')})
     updated_at: datetime = Field(
         sa_column_kwargs={'server_default': text('CURRENT_TIMESTAMP'), 'server_onupdate': text('CURRENT_TIMESTAMP')}
     )
 
-    def __init__(self, name: str, password: str):
+    def __init__(self, name: str, password: str, hashed: bool = False):
         self.name = name
-        self.password = self.hash_password(password)
+        self.password = password if hashed else self.hash_password(password)
 
     @classmethod
     def hash_password(cls, password: str) -> str:
@@ -48,12 +69,30 @@ class User(UserBase, table=True):
         return ph.verify(HASHED_PASSWORD_PREFIX + hashed_password, password)
 
     @classmethod
-    async def get_verified_user_id(cls, session: AsyncSession, name: str, password: str) -> int:
-        row = (await session.execute(select(cls.id, cls.password).where(cls.name == name))).first()
+    async def async_hash_password(cls, password: str) -> str:
+        return (await hash_executor.hash_password(password))[HASHED_PASSWORD_PREFIX_LENGTH:]
+
+    @classmethod
+    async def async_verify_password(cls, hashed_password: str, password: str) -> bool:
+        return await hash_executor.verify_password(HASHED_PASSWORD_PREFIX + hashed_password, password)
+
+    @classmethod
+    async def get_id_by_name(cls, session: ShardedSession, name: str) -> int | None:
+        return await session.primary.scalar(select(UserName.id).where(UserName.name == name))
+
+    @classmethod
+    async def get_verified_user_id(cls, session: AsyncSession | ShardedSession, name: str, password: str) -> int:
+        if isinstance(session, ShardedSession):
+            id = await cls.get_id_by_name(session, name)
+            row = None if id is None else await cls.get_by_id(session, id, (cls.id, cls.password))
+        else:
+            row = (await session.execute(select(cls.id, cls.password).where(cls.name == name))).first()
         if row:
             try:
-                if cls.verify_password(row.password, password):
+                if await cls.async_verify_password(row.password, password):
                     return row.id
+            except HTTPError:
+                raise
             except Exception:
                 return 0
         return 0
@@ -65,26 +104,115 @@ class User(UserBase, table=True):
         return encode_token(token.model_dump())
 
     @classmethod
-    async def delete_by_name(cls, session: AsyncSession, name: str) -> int:
-        return (await session.execute(delete(cls).where(cls.name == name))).rowcount  # type: ignore
+    async def insert(cls, session: AsyncSession | ShardedSession, values: Values) -> int:
+        if isinstance(session, ShardedSession):
+            if values.get('id') is None:
+                values = {**values, 'id': await allocate_id(cls, values, session)}
+            # raises IntegrityError if the name is taken on any shard
+            await UserName.insert(session.primary, {'id': values['id'], 'name': values['name']})
+        return await super().insert(session, values)
 
+    @classmethod
+    async def bulk_insert(
+        cls,
+        session: AsyncSession | ShardedSession,
+        values: Sequence[Values | tuple],
+        on_duplicate: Literal['error', 'ignore', 'update'] = 'error',
+        update_columns: Sequence[str] = (),
+        max_packet_size: int = 0,
+        max_batch_size: int = 1000,
+        concurrency: int = 1,
+    ) -> BulkInsertResult:
+        if isinstance(session, ShardedSession) and values:
+            if on_duplicate != 'error':
+                raise ValueError("bulk_insert() can't ignore or update duplicate users of a ShardedSession")
+            names = cls.__table__.columns.keys()  # type: ignore
+            rows = []
+            for row in values:
+                if not isinstance(row, dict):
+                    row = dict(zip(names, row))
+                if row.get('id') is None:
+                    row = {**row, 'id': await allocate_id(cls, row, session)}
+                rows.append(row)
+            index_rows = [{'id': row['id'], 'name': row['name']} for row in rows]
+            await UserName.bulk_insert(
+                session.primary, index_rows, max_packet_size=max_packet_size, max_batch_size=max_batch_size
+            )
+            values = rows
+        return await super().bulk_insert(
+            session, values, on_duplicate, update_columns, max_packet_size, max_batch_size, concurrency
+        )
 
-def get_current_user_id(token: str | bytes = Depends(oauth2_scheme)) -> int:
-    paseto = decode_token(token)
-    if not (paseto and isinstance(paseto.payload, bytes)):
-        raise invalid_token_error
-    try:
-        payload = TokenPayload.model_validate_json(paseto.payload)
-    except ValueError:
-        raise invalid_token_error
-    except Exception:
-        logging.exception('')
-        raise internal_server_error
+    @classmethod
+    async def update_by_id(cls, session: AsyncSession | ShardedSession, id: int, values: Values) -> int:
+        if isinstance(session, ShardedSession):
+            index_values = {name: values[name] for name in ('id', 'name') if name in values}
+            if index_values:
+                await UserName.update_by_id(session.primary, id, index_values)
+        return await super().update_by_id(session, id, values)
+
+    @classmethod
+    async def update_by_ids(
+        cls,
+        session: AsyncSession | ShardedSession,
+        values: Mapping[int, Values],
+        batch_size: int = 1000,
+        max_packet_size: int = 0,
+    ) -> int:
+        if isinstance(session, ShardedSession):
+            index_values = {id: {'name': row['name']} for id, row in values.items() if 'name' in row}
+            if index_values:
+                await UserName.update_by_ids(session.primary, index_values, batch_size, max_packet_size)
+        return await super().update_by_ids(session, values, batch_size, max_packet_size)
+
+    @classmethod
+    async def delete_by_id(cls, session: AsyncSession | ShardedSession, id: int) -> int:
+        if isinstance(session, ShardedSession):
+            await UserName.delete_by_id(session.primary, id)
+        return await super().delete_by_id(session, id)
+
+    @classmethod
+    async def delete_by_ids(cls, session: AsyncSession | ShardedSession, ids: Sequence[int]) -> int:
+        if isinstance(session, ShardedSession):
+            await UserName.delete_by_ids(session.primary, ids)
+        return await super().delete_by_ids(session, ids)
+
+    @classmethod
+    async def delete_by_name(cls, session: AsyncSession | ShardedSession, name: str) -> int:
+        if isinstance(session, ShardedSession):
+            id = await cls.get_id_by_name(session, name)
+            return 0 if id is None else await cls.delete_by_id(session, id)
+        ids = (await session.scalars(select(cls.id).where(cls.name == name))).all()
+        row_count = (await session.execute(delete(cls).where(cls.name == name))).rowcount  # type: ignore
+        if row_count:
+            await cls.invalidate_cache(session, ids)
+            cls.count_on_commit(session, -row_count)
+        return row_count
+
+
+async def get_current_user_id(token: str | bytes = Depends(oauth2_scheme)) -> int:
+    # decrypting and validating a token costs much more than a dict lookup, and clients keep sending the same one
+    payload = token_cache.get(token)
+    if payload is None:
+        paseto = decode_token(token)
+        if not (paseto and isinstance(paseto.payload, bytes)):
+            raise invalid_token_error
+        try:
+            payload = TokenPayload.model_validate_json(paseto.payload)
+        except ValueError:
+            raise invalid_token_error
+        except Exception:
+            logging.exception('')
+            raise internal_server_error
+
+        now = int(time())
+        if now > payload.expire_at:
+            raise expired_token_error
+        token_cache.set(token, payload, payload.expire_at)
+    else:
+        now = int(time())
 
-    now = int(time())
     if now < payload.not_before:
         raise invalid_token_error
-    if now > payload.expire_at:
-        raise expired_token_error
 
     return payload.user_id
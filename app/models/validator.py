@@ -0,0 +1,159 @@
+import logging
+from email.utils import formatdate, parsedate_to_datetime
+from time import monotonic
+from typing import Any, Callable, Coroutine
+
+from fastapi import Depends, Request
+from redis.exceptions import RedisError
+from starlette.datastructures import Headers
+from starlette.types import Scope
+
+from app.clients.near_cache import near_cache
+from app.clients.redis import redis_client
+from app.config import config
+from app.utils.cache import LRUCache
+from app.utils.etag import etag_matches
+from app.utils.exception import NotModified
+
+from .cache import spawn
+from .user import get_current_user_id
+from .version import RowVersions, get_row_versions
+
+Dependency = Callable[..., Coroutine[Any, Any, None]]
+
+
+class Validator:
+    """The ETag of a response to record, along with the version of the row read before the endpoint ran."""
+
+    __slots__ = ('store', 'key', 'version', 'ttl')
+
+    def __init__(self, store: 'ValidatorStore', key: str, version: int, ttl: int) -> None:
+        self.store = store
+        self.key = key
+        self.version = version
+        self.ttl = ttl
+
+    def record(self, etag: str) -> None:
+        self.store.set(self.key, self.version, etag, self.ttl)
+
+
+class ValidatorStore:
+    """Remembers the last ETag of the responses built from a row, to answer If-None-Match before the endpoint runs.
+
+    Entries are keyed by the path and query of the request and the authenticated user, and hold the version of the row
+    along with the ETag. They're kept in process and in Redis, where the other processes find them. An entry only
+    matches while the version of its row is unchanged, so a committed write of the row invalidates the entries of every
+    process at once. Checking the version costs a Redis read per request, unless the near cache serves it.
+
+    The version is read before the endpoint runs, so the endpoint must read the row from the primary, as
+    `load_by_id()` does by default: a lagging replica could return the row as it was before the write that bumped the
+    version, whose ETag would then be recorded with the new version.
+    """
+
+    def __init__(self, maxsize: int) -> None:
+        self.cache: LRUCache[str, tuple[int, str]] = LRUCache(maxsize)
+        self.hits = 0
+        self.misses = 0
+        self.records = 0
+
+    def key(self, scope: Scope, user_id: int) -> str:
+        return f'validator:{scope["path"]}?{scope["query_string"].decode("latin-1")}:{user_id}'
+
+    async def check(self, scope: Scope, versions: RowVersions, id: int, user_id: int) -> None:
+        """Raises `NotModified` if If-None-Match matches the recorded ETag, otherwise puts a `Validator` in the scope to
+        record the ETag of the response."""
+        key = self.key(scope, user_id)
+        version_key = versions.key(id)
+        if_none_match = Headers(scope=scope).get('if-none-match')
+        entry = self.cache.get(key) if if_none_match else None
+        try:
+            if if_none_match and entry is None:
+                version, value = await near_cache.mget((version_key, key))
+                if value:
+                    recorded_version, _, etag = value.decode().partition(':')
+                    entry = (int(recorded_version), etag)
+            else:
+                version = await near_cache.get(version_key)
+        except RedisError:
+            logging.exception('failed to read validator')
+            return  # let the endpoint answer
+
+        current_version = int(version or 0)
+        if entry is not None and entry[0] == current_version and etag_matches(if_none_match, entry[1]):
+            self.hits += 1
+            raise NotModified({'ETag': entry[1]})
+        self.misses += 1
+        scope['validator'] = Validator(self, key, current_version, versions.ttl // 2)
+
+    def set(self, key: str, version: int, etag: str, ttl: int) -> None:
+        # entries expire in half the lifetime of the version counters, see RowVersions
+        self.cache.set(key, (version, etag), monotonic() + ttl)
+        self.records += 1
+        spawn(self.save(key, f'{version}:{etag}', ttl))
+
+    async def save(self, key: str, value: str, ttl: int) -> None:
+        try:
+            await redis_client.set(key, value, ex=ttl)
+        except RedisError:
+            logging.exception('failed to write validator')
+
+    def stats(self) -> dict[str, Any]:
+        return {'size': len(self.cache), 'hits': self.hits, 'misses': self.misses, 'records': self.records}
+
+
+validator_store = ValidatorStore(config.VALIDATOR_CACHE_SIZE)
+
+
+def validator(model: Any, id_param: str = 'user_id') -> Dependency:
+    """Returns a dependency which answers 304 to the GET requests whose If-None-Match is still valid, without running
+    the endpoint. The response is built from the row of `model` whose id is the path parameter `id_param`, read from
+    the primary, and the model must set `__version_ttl__`."""
+    versions = get_row_versions(model)
+    if versions is None:
+        raise ValueError(f'{model.__name__} has no row versions')
+
+    async def validate(request: Request, user_id: int = Depends(get_current_user_id)) -> None:
+        id = request.path_params[id_param]
+        if request.method == 'GET' and id.isdigit():  # else the endpoint rejects it
+            await validator_store.check(request.scope, versions, int(id), user_id)
+
+    return validate
+
+
+def parse_http_date(value: str | None) -> int | None:
+    if value:
+        try:
+            return int(parsedate_to_datetime(value).timestamp())
+        except (TypeError, ValueError):  # an invalid date is ignored
+            pass
+    return None
+
+
+def last_modified(model: Any, id_param: str = 'user_id', column: str = 'updated_at') -> Dependency:
+    """Returns a dependency which answers 304 to the GET requests whose If-Modified-Since is not older than the `column`
+    of the row of `model` whose id is the path parameter `id_param`, without running the endpoint. Only that column is
+    loaded, by `load_by_id()`, which reads it from the row cache if it's cached. Otherwise ETagMiddleware sends it as
+    the Last-Modified of the response.
+
+    The time has a precision of seconds, so a change in the same second as the Last-Modified one is missed. Clients
+    which send If-None-Match too are answered by the ETag instead, as it takes precedence.
+    """
+    attribute = getattr(model, column)
+
+    async def validate(request: Request, _: int = Depends(get_current_user_id)) -> None:
+        id = request.path_params[id_param]
+        if request.method != 'GET' or not id.isdigit():
+            return
+        modified_at = await model.load_by_id(int(id), attribute)
+        if modified_at is None:
+            return  # the endpoint answers 404
+        timestamp = int(modified_at.timestamp())
+        value = formatdate(timestamp, usegmt=True)
+        headers = request.headers
+        if 'if-none-match' not in headers:
+            since = parse_http_date(headers.get('if-modified-since'))
+            if since is not None and timestamp <= since:
+                raise NotModified({'Last-Modified': value})
+        request.scope['last_modified'] = value
+
+    return validate
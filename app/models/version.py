@@ -0,0 +1,102 @@
+import logging
+from typing import Any, Iterable
+
+from redis.exceptions import RedisError
+from sqlalchemy import event
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy.orm import Mapper, Session, object_session
+from sqlmodel import SQLModel
+
+from app.clients.redis import redis_client
+from app.config import config
+
+from .cache import TOMBSTONE, get_row_cache, spawn
+
+PENDING_VERSIONS = 'row_versions'
+
+
+class RowVersions:
+    """Counts the writes of a model's rows in Redis, keyed by id, so that what was derived from a row can be checked.
+
+    A row's version is incremented after each commit which wrote it, through the `BaseModel` methods or the unit of
+    work. A row never written has version 0. Counters expire `ttl` seconds after their last increment, so anything
+    recorded along with a version must expire sooner, or it could match the version again once the counter has
+    restarted from 0.
+    """
+
+    def __init__(self, model: type[SQLModel], ttl: int) -> None:
+        self.model = model
+        self.prefix = f'version:{model.__tablename__}:'
+        self.ttl = ttl
+        self.bumps = 0
+
+    def key(self, id: int) -> str:
+        return f'{self.prefix}{id}'
+
+    async def invalidate(self, ids: Iterable[int]) -> None:
+        ids = list(ids)
+        if not ids:
+            return
+        # the cached rows are invalidated again in the same pipeline, which runs in order, since a new version must not
+        # be seen with a stale row cached before the change, or it'd be recorded with the wrong version
+        row_cache = get_row_cache(self.model)
+        try:
+            async with redis_client.pipeline(transaction=False) as pipe:
+                for id in ids:
+                    if row_cache is not None:
+                        pipe.set(row_cache.key(id), TOMBSTONE, ex=config.ROW_CACHE_TOMBSTONE_TTL)
+                    key = self.key(id)
+                    pipe.incr(key)
+                    pipe.expire(key, self.ttl)
+                await pipe.execute()
+            self.bumps += len(ids)
+        except RedisError:
+            logging.exception('failed to increment row versions')
+
+    def add_pending(self, session: AsyncSession | Session, ids: Iterable[int]) -> None:
+        """Increments the versions after the session commits, when other sessions can see the change."""
+        if isinstance(session, AsyncSession):
+            session = session.sync_session
+        pending: dict[RowVersions, set[int]] = session.info.setdefault(PENDING_VERSIONS, {})
+        pending.setdefault(self, set()).update(id for id in ids if id is not None)
+
+    def stats(self) -> dict[str, int]:
+        return {'bumps': self.bumps}
+
+
+row_versions: dict[type, RowVersions] = {}
+
+
+def get_row_versions(model: Any) -> RowVersions | None:
+    ttl = getattr(model, '__version_ttl__', 0)
+    if not ttl:
+        return None
+    versions = row_versions.get(model)
+    if versions is None:
+        versions = row_versions[model] = RowVersions(model, ttl)
+    return versions
+
+
+@event.listens_for(Session, 'after_commit')
+def increment_after_commit(session: Session) -> None:
+    pending: dict[RowVersions, set[int]] | None = session.info.pop(PENDING_VERSIONS, None)
+    if pending:
+        for versions, ids in pending.items():
+            spawn(versions.invalidate(ids))
+
+
+@event.listens_for(Session, 'after_rollback')
+def discard_pending_versions(session: Session) -> None:
+    session.info.pop(PENDING_VERSIONS, None)
+
+
+# rows written through the unit of work (e.g. session.add()) get new versions after commit too
+@event.listens_for(Mapper, 'after_insert')
+@event.listens_for(Mapper, 'after_update')
+@event.listens_for(Mapper, 'after_delete')
+def increment_flushed_row(mapper: Mapper, connection: Any, target: Any) -> None:
+    versions = get_row_versions(mapper.class_)
+    if versions is not None:
+        session = object_session(target)
+        if session is not None:
+            versions.add_pending(session, (target.id,))
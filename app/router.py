@@ -1,4 +1,11 @@
 from fastapi import APIRouter
 
+from app.utils.response import FastResponseRoute
+from app.utils.server_timing import TimedRoute
 
-router = APIRouter(prefix='/api/v1')
+
+class Route(TimedRoute, FastResponseRoute):
+    pass
+
+
+router = APIRouter(prefix='/api/v1', route_class=Route)
@@ -0,0 +1,151 @@
+import asyncio
+import heapq
+import itertools
+from contextvars import ContextVar
+from typing import Any, Callable, Coroutine
+
+from starlette.datastructures import Headers
+from starlette.types import ASGIApp, Receive, Scope, Send
+
+from app.config import config
+from app.utils.exception import service_unavailable_error
+from app.utils.sql_stats import Histogram
+
+
+class Priority:
+    HIGH, NORMAL, LOW = range(3)  # a lower value is admitted first
+
+
+class RequestAdmission:
+    """The priority and deadline of the current request, which are used to admit its checkouts."""
+
+    __slots__ = ('priority', 'deadline')
+
+    def __init__(self, priority: int, deadline: float) -> None:
+        self.priority = priority
+        self.deadline = deadline  # in the time of the event loop
+
+
+request_admission: ContextVar[RequestAdmission | None] = ContextVar('request_admission', default=None)
+
+
+def current_admission() -> tuple[int, float]:
+    """Returns the priority and deadline of the current request, or the defaults outside of requests."""
+    admission = request_admission.get()
+    if admission is None:
+        return Priority.NORMAL, asyncio.get_running_loop().time() + config.REQUEST_TIMEOUT
+    return admission.priority, admission.deadline
+
+
+def priority(level: int) -> Callable[[], Coroutine[Any, Any, None]]:
+    """Returns a dependency which sets the priority of the route's requests, e.g.
+    `@router.get(..., dependencies=[Depends(priority(Priority.LOW))])`."""
+
+    async def set_priority() -> None:
+        admission = request_admission.get()
+        if admission is not None:
+            admission.priority = level
+
+    return set_priority
+
+
+class DeadlineMiddleware:
+    """Sets the deadline of each request to `REQUEST_TIMEOUT` seconds after it arrives, or sooner if the client sends
+    a shorter `X-Request-Timeout` in seconds, e.g. what's left of its own deadline."""
+
+    def __init__(self, app: ASGIApp) -> None:
+        self.app = app
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send) -> None:
+        if scope['type'] != 'http':
+            await self.app(scope, receive, send)
+            return
+
+        timeout = config.REQUEST_TIMEOUT
+        value = Headers(scope=scope).get('x-request-timeout')
+        if value:
+            try:
+                timeout = min(max(float(value), 0), timeout)
+            except ValueError:
+                pass
+
+        token = request_admission.set(RequestAdmission(Priority.NORMAL, asyncio.get_running_loop().time() + timeout))
+        try:
+            await self.app(scope, receive, send)
+        finally:
+            request_admission.reset(token)
+
+
+class Admission:
+    """Admits at most `capacity` holders at a time, and queues up to `queue_size` others by priority and arrival.
+
+    A waiter is rejected with a 503 when its deadline passes, or when the queue is full, unless it has a higher priority
+    than the last waiter, which is rejected instead. Released slots are handed to the waiters directly, so that a
+    newcomer can't take one ahead of them.
+    """
+
+    def __init__(self, capacity: int, queue_size: int) -> None:
+        self.capacity = capacity
+        self.queue_size = queue_size
+        self.in_use = 0
+        self.waiters: list[tuple[int, int, asyncio.Future]] = []  # a heap, the futures done are left to be skipped
+        self.waiting = 0
+        self.counter = itertools.count()
+        self.wait_time = Histogram()
+        self.rejected = 0
+        self.timeouts = 0
+
+    async def acquire(self, priority: int, deadline: float) -> None:
+        if self.in_use < self.capacity and not self.waiting:
+            self.in_use += 1
+            return
+
+        loop = asyncio.get_running_loop()
+        started_at = loop.time()
+        if deadline <= started_at:
+            self.timeouts += 1
+            raise service_unavailable_error
+        if self.waiting >= self.queue_size:
+            last = max((waiter for waiter in self.waiters if not waiter[2].done()), default=None)
+            if last is None or last[0] <= priority:
+                self.rejected += 1
+                raise service_unavailable_error
+            last[2].set_exception(service_unavailable_error)
+            self.waiting -= 1
+            self.rejected += 1
+
+        future = loop.create_future()
+        heapq.heappush(self.waiters, (priority, next(self.counter), future))
+        self.waiting += 1
+        try:
+            async with asyncio.timeout_at(deadline):
+                await future
+        except BaseException as e:
+            if future.cancelled():  # timed out or cancelled while waiting
+                self.waiting -= 1
+            elif future.exception() is None:  # handed a slot, but timed out or cancelled before resuming
+                self.release()
+            if isinstance(e, TimeoutError):
+                self.timeouts += 1
+                raise service_unavailable_error from None
+            raise
+        finally:
+            self.wait_time.observe(loop.time() - started_at)
+
+    def release(self) -> None:
+        while self.waiters:
+            _, _, future = heapq.heappop(self.waiters)
+            if not future.done():
+                future.set_result(None)
+                self.waiting -= 1
+                return
+        self.in_use -= 1
+
+    def stats(self) -> dict[str, Any]:
+        return {
+            'in_use': self.in_use,
+            'waiting': self.waiting,
+            'rejected': self.rejected,
+            'timeouts': self.timeouts,
+            'wait_time': self.wait_time.stats(),
+        }
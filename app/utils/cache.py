@@ -0,0 +1,91 @@
+from collections import OrderedDict
+from time import monotonic
+from typing import Any, Callable, Generic, Hashable, TypeVar
+
+K = TypeVar('K', bound=Hashable)
+V = TypeVar('V')
+
+_MISSING: Any = object()
+
+
+class LRUCache(Generic[K, V]):
+    """A bounded in-process LRU cache whose entries can also expire.
+
+    `ttl` is the default lifetime of an entry, 0 means entries never expire unless an explicit `expire_at` is given
+    to `set()`. Expiration times are measured by `timer`, so pass `time.time` when they come from wall-clock data.
+    If `maxbytes` is not 0, the sizes given to `set()` are summed up and bounded by it too.
+    """
+
+    def __init__(
+        self, maxsize: int, ttl: float = 0, timer: Callable[[], float] = monotonic, maxbytes: int = 0
+    ) -> None:
+        self.maxsize = maxsize
+        self.maxbytes = maxbytes
+        self.ttl = ttl
+        self.timer = timer
+        self.data: OrderedDict[K, tuple[V, float, int]] = OrderedDict()
+        self.bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.expirations = 0
+
+    def __len__(self) -> int:
+        return len(self.data)
+
+    def __contains__(self, key: K) -> bool:
+        return self.get(key, _MISSING) is not _MISSING
+
+    def get(self, key: K, default: Any = None) -> Any:
+        item = self.data.get(key)
+        if item is None:
+            self.misses += 1
+            return default
+        value, expire_at, size = item
+        if expire_at and expire_at <= self.timer():
+            del self.data[key]
+            self.bytes -= size
+            self.expirations += 1
+            self.misses += 1
+            return default
+        self.data.move_to_end(key)
+        self.hits += 1
+        return value
+
+    def set(self, key: K, value: V, expire_at: float = 0, size: int = 0) -> None:
+        if self.ttl:
+            ttl_expire_at = self.timer() + self.ttl
+            if not expire_at or ttl_expire_at < expire_at:
+                expire_at = ttl_expire_at
+        data = self.data
+        old_item = data.get(key)
+        if old_item is not None:
+            self.bytes -= old_item[2]
+        data[key] = (value, expire_at, size)
+        data.move_to_end(key)
+        self.bytes += size
+        maxbytes = self.maxbytes
+        while len(data) > self.maxsize or (maxbytes and self.bytes > maxbytes):
+            self.bytes -= data.popitem(last=False)[1][2]
+            self.evictions += 1
+
+    def pop(self, key: K, default: Any = None) -> Any:
+        item = self.data.pop(key, None)
+        if item is None:
+            return default
+        self.bytes -= item[2]
+        return item[0]
+
+    def clear(self) -> None:
+        self.data.clear()
+        self.bytes = 0
+
+    def stats(self) -> dict[str, int]:
+        return {
+            'size': len(self.data),
+            'bytes': self.bytes,
+            'hits': self.hits,
+            'misses': self.misses,
+            'evictions': self.evictions,
+            'expirations': self.expirations,
+        }
@@ -0,0 +1,263 @@
+import gzip
+import zlib
+from typing import Callable, NoReturn, Sequence
+
+import brotli
+import zstandard
+from starlette.datastructures import Headers, MutableHeaders
+from starlette.status import HTTP_200_OK, HTTP_304_NOT_MODIFIED
+from starlette.types import ASGIApp, Message, Receive, Scope, Send
+
+from app.config import config
+
+from .cache import LRUCache
+
+GZIP_LEVEL = 6
+BROTLI_QUALITY = 4  # the higher ones are too slow to compress on the fly
+ZSTD_LEVEL = 3
+COMPRESSIBLE_TYPES = ('text/', 'application/json', 'application/x-ndjson', 'application/javascript', 'application/xml')
+
+
+class GzipCompressor:
+    def __init__(self) -> None:
+        self.compressor = zlib.compressobj(GZIP_LEVEL, zlib.DEFLATED, 31)  # 31: with the gzip header
+
+    def compress(self, data: bytes) -> bytes:
+        return self.compressor.compress(data) + self.compressor.flush(zlib.Z_SYNC_FLUSH)
+
+    def finish(self) -> bytes:
+        return self.compressor.flush()
+
+
+class BrotliCompressor:
+    def __init__(self) -> None:
+        self.compressor = brotli.Compressor(quality=BROTLI_QUALITY)
+
+    def compress(self, data: bytes) -> bytes:
+        return self.compressor.process(data) + self.compressor.flush()
+
+    def finish(self) -> bytes:
+        return self.compressor.finish()
+
+
+class ZstdCompressor:
+    def __init__(self) -> None:
+        self.compressor = zstandard.ZstdCompressor(level=ZSTD_LEVEL).compressobj()
+
+    def compress(self, data: bytes) -> bytes:
+        return self.compressor.compress(data) + self.compressor.flush(zstandard.COMPRESSOBJ_FLUSH_BLOCK)
+
+    def finish(self) -> bytes:
+        return self.compressor.flush()
+
+
+# a whole body is compressed at once, and a streamed body chunk by chunk, each chunk being flushed to the client
+COMPRESS: dict[str, Callable[[bytes], bytes]] = {
+    # no mtime, so that the same body compresses the same
+    'gzip': lambda data: gzip.compress(data, GZIP_LEVEL, mtime=0),
+    'br': lambda data: brotli.compress(data, quality=BROTLI_QUALITY),
+    'zstd': lambda data: zstandard.ZstdCompressor(level=ZSTD_LEVEL).compress(data),
+}
+COMPRESSORS: dict[str, Callable[[], GzipCompressor | BrotliCompressor | ZstdCompressor]] = {
+    'gzip': GzipCompressor,
+    'br': BrotliCompressor,
+    'zstd': ZstdCompressor,
+}
+
+
+def negotiate_encoding(accept_encoding: str, encodings: Sequence[str]) -> str | None:
+    """Returns the encoding of `encodings` with the highest q-value in Accept-Encoding, ties are broken by the order of
+    `encodings`, or None if none of them is acceptable."""
+    qualities: dict[str, float] = {}
+    for item in accept_encoding.split(','):
+        name, _, params = item.partition(';')
+        name = name.strip().lower()
+        if not name:
+            continue
+        quality = 1.0
+        params = params.strip()
+        if params[:2] == 'q=':
+            try:
+                quality = float(params[2:])
+            except ValueError:
+                quality = 0
+        qualities[name] = quality
+    default = qualities.get('*', 0)
+    best = None
+    best_quality = 0.0
+    for encoding in encodings:
+        quality = qualities.get(encoding, default)
+        if quality > best_quality:
+            best = encoding
+            best_quality = quality
+    return best
+
+
+def encoded_etag(etag: str, encoding: str, weak: bool) -> str:
+    """Returns the ETag of the encoded body: a weak one for the same content, or a strong one for different bytes."""
+    if etag[:2] == 'W/':
+        return etag
+    return f'W/{etag}' if weak else f'{etag[:-1]}-{encoding}"'
+
+
+class CompressionMiddleware:
+    """Compresses the 200 responses of compressible types by the encoding negotiated from Accept-Encoding.
+
+    Bodies smaller than `minimum_size` are sent as is. The ETags of compressed responses are weak if `weak_etag`,
+    otherwise they're suffixed by the encoding, e.g. `"etag-gzip"`, since the bytes are different. It's placed in front
+    of ETagMiddleware, which sees the ETags of uncompressed bodies in If-None-Match: the ones of the compressed
+    responses are translated back, and those of 304 responses are translated the same way as the client sent them.
+    Compressed bodies which have strong ETags are cached by path, query, ETag and encoding, so that popular responses
+    are compressed once. An ETag set by the app may not tell the bodies apart, so a cached body is only used if the size
+    and the Adler-32 checksum of the uncompressed body match too. Streamed bodies are compressed chunk by chunk, and not
+    cached.
+    """
+
+    def __init__(
+        self,
+        app: ASGIApp,
+        minimum_size: int = config.COMPRESSION_MINIMUM_SIZE,
+        encodings: Sequence[str] = config.COMPRESSION_ENCODINGS,
+        weak_etag: bool = config.COMPRESSION_WEAK_ETAG,
+        cache_size: int = config.COMPRESSION_CACHE_SIZE,
+        cache_max_bytes: int = config.COMPRESSION_CACHE_MAX_BYTES,
+    ) -> None:
+        self.app = app
+        self.minimum_size = minimum_size
+        self.encodings = [encoding for encoding in encodings if encoding in COMPRESSORS]
+        self.weak_etag = weak_etag
+        # (path, ETag, encoding) -> (size, checksum, compressed body)
+        self.cache: LRUCache[tuple[str, str, str], tuple[int, int, bytes]] = LRUCache(
+            cache_size, maxbytes=cache_max_bytes
+        )
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send) -> None:
+        if scope['type'] == 'http' and scope['method'] != 'HEAD' and self.encodings:
+            headers = Headers(scope=scope)
+            encoding = negotiate_encoding(headers.get('accept-encoding', ''), self.encodings)
+            path = f'{scope["path"]}?{scope["query_string"].decode("latin-1")}'
+            responder = CompressionResponder(self.app, self, encoding, path)
+            if_none_match = headers.get('if-none-match')
+            if if_none_match:
+                scope = responder.translate_if_none_match(scope, if_none_match)
+            await responder(scope, receive, send)
+        else:
+            await self.app(scope, receive, send)
+
+    def compress(self, encoding: str, body: bytes, etag: str | None, path: str) -> bytes:
+        if etag is None or etag[:2] == 'W/':  # a weak ETag may be shared by different bodies
+            return COMPRESS[encoding](body)
+        key = (path, etag, encoding)
+        checksum = zlib.adler32(body)  # much faster than compressing it
+        entry = self.cache.get(key)
+        if entry is not None and entry[0] == len(body) and entry[1] == checksum:
+            return entry[2]
+        compressed = COMPRESS[encoding](body)
+        self.cache.set(key, (len(body), checksum, compressed), size=len(compressed))
+        return compressed
+
+    def stats(self) -> dict[str, int]:
+        return self.cache.stats()
+
+
+class CompressionResponder:
+    def __init__(self, app: ASGIApp, middleware: CompressionMiddleware, encoding: str | None, path: str) -> None:
+        self.app = app
+        self.middleware = middleware
+        self.encoding = encoding
+        self.path = path
+        self.send: Send = unattached_send
+        self.initial_message: Message = {}
+        self.headers: MutableHeaders | None = None
+        self.passing = True
+        self.compressor: GzipCompressor | BrotliCompressor | ZstdCompressor | None = None
+        self.if_none_match_encoding: str | None = None  # how the ETag in If-None-Match was translated, 'W/' if weak
+
+    def translate_if_none_match(self, scope: Scope, if_none_match: str) -> Scope:
+        if if_none_match[:2] == 'W/':
+            self.if_none_match_encoding = 'W/'  # ETagMiddleware compares it without the prefix
+            return scope
+        encoding = self.encoding
+        if encoding is None or not if_none_match.endswith(f'-{encoding}"'):
+            return scope  # the ETag of the uncompressed body, or of an encoding not negotiated this time
+        self.if_none_match_encoding = encoding
+        etag = if_none_match[: -len(encoding) - 2] + '"'
+        headers = [(name, value) for name, value in scope['headers'] if name != b'if-none-match']
+        headers.append((b'if-none-match', etag.encode('latin-1')))
+        return {**scope, 'headers': headers}
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send) -> None:
+        self.send = send
+        await self.app(scope, receive, self.send_compressed)
+
+    async def send_compressed(self, message: Message) -> None:
+        message_type = message['type']
+        if message_type == 'http.response.start':
+            await self.start(message)
+        elif message_type == 'http.response.body':
+            if self.passing:
+                await self.send(message)
+            elif self.compressor is None:
+                await self.send_first_body(message)
+            else:
+                body = self.compressor.compress(message.get('body', b''))
+                more_body = message.get('more_body', False)
+                if not more_body:
+                    body += self.compressor.finish()
+                await self.send({'type': 'http.response.body', 'body': body, 'more_body': more_body})
+        else:
+            await self.send(message)
+
+    async def start(self, message: Message) -> None:
+        headers = MutableHeaders(raw=message['headers'])
+        status = message['status']
+        if status == HTTP_304_NOT_MODIFIED:
+            etag = headers.get('etag')
+            if etag and self.if_none_match_encoding is not None:
+                weak = self.if_none_match_encoding == 'W/'
+                headers['etag'] = encoded_etag(etag, self.if_none_match_encoding, weak)
+                headers.add_vary_header('Accept-Encoding')
+        elif (
+            status == HTTP_200_OK
+            and 'content-encoding' not in headers
+            and headers.get('content-type', '').startswith(COMPRESSIBLE_TYPES)
+        ):
+            headers.add_vary_header('Accept-Encoding')
+            content_length = headers.get('content-length')
+            if self.encoding is not None and not (
+                content_length and int(content_length) < self.middleware.minimum_size
+            ):
+                # hold it back until the first body tells how to modify the headers
+                self.initial_message = message
+                self.headers = headers
+                self.passing = False
+                return
+        await self.send(message)
+
+    async def send_first_body(self, message: Message) -> None:
+        assert self.encoding is not None and self.headers is not None
+        body = message.get('body', b'')
+        more_body = message.get('more_body', False)
+        headers = self.headers
+        etag = headers.get('etag')
+        if more_body:
+            self.compressor = COMPRESSORS[self.encoding]()
+            body = self.compressor.compress(body)
+            del headers['content-length']
+        elif len(body) < self.middleware.minimum_size:
+            self.passing = True
+            await self.send(self.initial_message)
+            await self.send(message)
+            return
+        else:
+            body = self.middleware.compress(self.encoding, body, etag, self.path)
+            headers['content-length'] = str(len(body))
+        headers['content-encoding'] = self.encoding
+        if etag:
+            headers['etag'] = encoded_etag(etag, self.encoding, self.middleware.weak_etag)
+        await self.send(self.initial_message)
+        await self.send({'type': 'http.response.body', 'body': body, 'more_body': more_body})
+
+
+async def unattached_send(message: Message) -> NoReturn:
+    raise RuntimeError('send awaitable not set')  # pragma: no cover
@@ -0,0 +1,20 @@
+from base64 import urlsafe_b64decode, urlsafe_b64encode
+from binascii import Error
+
+from .exception import bad_request_error
+
+invalid_cursor_error = bad_request_error('Invalid cursor')
+
+
+def encode_cursor(last_id: int) -> str:
+    return urlsafe_b64encode(str(last_id).encode()).rstrip(b'=').decode()
+
+
+def decode_cursor(cursor: str) -> int:
+    try:
+        last_id = int(urlsafe_b64decode(cursor + '=' * (-len(cursor) % 4)))
+    except (Error, ValueError):
+        raise invalid_cursor_error
+    if last_id < 0:
+        raise invalid_cursor_error
+    return last_id
@@ -7,4 +7,5 @@ class ErrorCode:
         FORBIDDEN,
         NOT_FOUND,
         INTERNAL_SERVER_ERROR,
-    ) = range(7)
+        SERVICE_UNAVAILABLE,
+    ) = range(8)
@@ -1,35 +1,115 @@
+import zlib
 from base64 import b64encode
-from hashlib import md5
-from typing import NoReturn
+from hashlib import blake2b, md5
+from typing import Any, Literal, NoReturn
 
 from starlette.datastructures import Headers, MutableHeaders
 from starlette.status import HTTP_200_OK, HTTP_304_NOT_MODIFIED
 from starlette.types import ASGIApp, Message, Receive, Scope, Send
 
+from app.config import config
+
+HashName = Literal['md5', 'blake2b', 'crc32']
+
+
+class DigestHasher:
+    def __init__(self, hash: Any) -> None:
+        self.hash = hash
+
+    def update(self, data: bytes) -> None:
+        self.hash.update(data)
+
+    def etag(self) -> str:
+        return f'"{b64encode(self.hash.digest()).rstrip(b"=").decode("ascii")}"'
+
+
+class CRC32Hasher:
+    """A non-cryptographic hash, which is much faster than md5. The size is part of the ETag to make collisions less
+    likely."""
+
+    def __init__(self) -> None:
+        self.value = 0
+        self.size = 0
+
+    def update(self, data: bytes) -> None:
+        self.value = zlib.crc32(data, self.value)
+        self.size += len(data)
+
+    def etag(self) -> str:
+        return f'"{self.size:x}-{self.value:08x}"'
+
+
+def new_hasher(name: HashName) -> DigestHasher | CRC32Hasher:
+    if name == 'crc32':
+        return CRC32Hasher()
+    if name == 'blake2b':
+        return DigestHasher(blake2b(digest_size=16))
+    return DigestHasher(md5())
+
 
 class ETagMiddleware:
-    def __init__(self, app: ASGIApp, minimum_size: int = 80) -> None:
+    """Adds an ETag to the 200 responses of GET requests, and turns them into 304 if it matches If-None-Match.
+
+    A streamed body (with `more_body`) is hashed chunk by chunk while it's held back, until it ends or exceeds
+    `max_buffer_size` bytes, in which case it's sent without an ETag. 0 disables ETags of streamed bodies.
+    Holding a stream back delays its first bytes, so it's only done for the requests with If-None-Match, which may be
+    answered by 304, or with a validator, which records the ETag. The other streams are sent as they come, without
+    ETags, unless `hold_streams`, so their clients only get an ETag to send back from a validated route.
+    The ETag is also recorded by the validator put in `scope['validator']`, if any, to answer 304 before the endpoint
+    runs next time, and the 304 responses sent by the app itself are passed through. `scope['last_modified']` is sent as
+    the Last-Modified header.
+    """
+
+    def __init__(
+        self,
+        app: ASGIApp,
+        minimum_size: int = 80,
+        max_buffer_size: int = config.ETAG_MAX_BUFFER_SIZE,
+        hash: HashName = config.ETAG_HASH,
+        hold_streams: bool = config.ETAG_HOLD_STREAMS,
+    ) -> None:
         self.app = app
         self.minimum_size = minimum_size
+        self.max_buffer_size = max_buffer_size
+        self.hash = hash
+        self.hold_streams = hold_streams
 
     async def __call__(self, scope: Scope, receive: Receive, send: Send) -> None:
         if scope['type'] == 'http' and scope['method'] == 'GET':
-            responder = ETagResponder(self.app, scope, self.minimum_size)
+            responder = ETagResponder(
+                self.app, scope, self.minimum_size, self.max_buffer_size, self.hash, self.hold_streams
+            )
             await responder(scope, receive, send)
         else:
             await self.app(scope, receive, send)
 
 
 class ETagResponder:
-    def __init__(self, app: ASGIApp, scope: Scope, minimum_size: int) -> None:
+    def __init__(
+        self,
+        app: ASGIApp,
+        scope: Scope,
+        minimum_size: int,
+        max_buffer_size: int = 0,
+        hash: HashName = 'md5',
+        hold_streams: bool = False,
+    ) -> None:
         self.app = app
         self.scope = scope
         self.minimum_size = minimum_size
+        self.max_buffer_size = max_buffer_size
+        self.hash = hash
+        # a validator may also be put in the scope by the endpoint
+        self.hold_streams = hold_streams or 'if-none-match' in Headers(scope=scope)
         self.send: Send = unattached_send
         self.initial_message: Message = {}
         self.headers: MutableHeaders | None = None
         self.status_code: int | None = None
+        self.passing = False  # the response isn't ours to validate
         self.delay_sending: bool = True
+        self.hasher: DigestHasher | CRC32Hasher | None = None
+        self.chunks: list[bytes] = []  # of the body held back
+        self.buffered = 0
 
     async def __call__(self, scope: Scope, receive: Receive, send: Send) -> None:
         self.send = send
@@ -38,17 +118,22 @@ class ETagResponder:
     async def send_with_etag(self, message: Message) -> None:
         if self.status_code is None:
             self.status_code = message.get('status')
-        if self.status_code != HTTP_200_OK:
-            if self.status_code != HTTP_304_NOT_MODIFIED:
-                await self.send(message)
-            # else drop the body
+            self.passing = self.status_code != HTTP_200_OK  # e.g. an error, or a 304 answered by a validator
+        if self.passing:
+            await self.send(message)
+            return
+        if self.status_code == HTTP_304_NOT_MODIFIED:  # turned into 304 below, drop the body
             return
 
         message_type = message['type']
         if message_type == 'http.response.start':
             self.headers = MutableHeaders(raw=message['headers'])
+            last_modified = self.scope.get('last_modified')
+            if last_modified is not None:
+                self.headers['last-modified'] = last_modified
             etag = self.headers.get('etag')
             if etag:  # Etag has been set, we should compare it with If-None-Match
+                self.record(etag)
                 if self.compare_etag_with_if_none_match(etag):
                     self.status_code = message['status'] = HTTP_304_NOT_MODIFIED
                     del self.headers['content-length']
@@ -56,16 +141,20 @@ class ETagResponder:
                     return
                 # else we don't need mofidy headers or body
             else:
+                if self.scope.get('validator') is not None:  # a 304 would skip the endpoint, however small the body is
+                    self.minimum_size = 0
+                    self.hold_streams = True
                 content_length = self.headers.get('content-length')
                 if content_length:
-                    size = int(content_length)
-                    if size >= self.minimum_size:
-                        # Don't send the initial message until we've determined
-                        # how to modify the outgoing headers correctly.
-                        self.initial_message = message
-                        return
-                    # else we should not send Etag
-                # else it's a streamming response
+                    hold = int(content_length) >= self.minimum_size  # else we should not send Etag
+                else:  # it's a streamming response
+                    hold = self.max_buffer_size > 0 and self.hold_streams
+                if hold:
+                    # Don't send the initial message until we've determined
+                    # how to modify the outgoing headers correctly.
+                    self.initial_message = message
+                    self.hasher = new_hasher(self.hash)
+                    return
             self.delay_sending = False
             await self.send(message)
         elif message_type == 'http.response.body':
@@ -73,29 +162,51 @@ class ETagResponder:
                 await self.send(message)
                 return
 
-            # There shouldn't be more body since we have checked streamming
-            # and file response before.
-            assert not message.get('more_body', False)
-
+            assert self.hasher is not None and self.headers is not None
             body = message.get('body', b'')
-            if len(body) >= self.minimum_size:
-                etag = f'"{b64encode(md5(body).digest())[:-2].decode('ascii')}"'  # remove trailing '=='
-                assert self.headers is not None
+            self.hasher.update(body)
+            self.chunks.append(body)
+            self.buffered += len(body)
+            if message.get('more_body', False):
+                # too large to hold back, or not worth delaying, send it without an ETag
+                if self.buffered > self.max_buffer_size or not self.hold_streams:
+                    await self.send_held_back(more_body=True)
+                    self.delay_sending = False
+                return
+
+            if self.buffered >= self.minimum_size:
+                etag = self.hasher.etag()
                 self.headers['etag'] = etag
+                self.record(etag)
                 if self.compare_etag_with_if_none_match(etag):
                     del self.headers['content-length']
                     self.initial_message['status'] = HTTP_304_NOT_MODIFIED
-                    message['body'] = b''
-            await self.send(self.initial_message)
-            await self.send(message)
+                    self.chunks = [b'']
+            await self.send_held_back(more_body=False)
+
+    async def send_held_back(self, more_body: bool) -> None:
+        await self.send(self.initial_message)
+        chunks, self.chunks = self.chunks, []
+        for i, chunk in enumerate(chunks):
+            await self.send(
+                {'type': 'http.response.body', 'body': chunk, 'more_body': more_body or i < len(chunks) - 1}
+            )
+
+    def record(self, etag: str) -> None:
+        validator = self.scope.get('validator')
+        if validator is not None:
+            validator.record(etag)
 
     def compare_etag_with_if_none_match(self, etag: str) -> bool:
-        if_none_match = Headers(scope=self.scope).get('if-none-match')
-        if if_none_match:
-            if if_none_match[:2] == 'W/':  # nginx will add 'W/' prefix to ETag for gzipped content
-                if_none_match = if_none_match[2:]
-            return if_none_match == etag
-        return False
+        return etag_matches(Headers(scope=self.scope).get('if-none-match'), etag)
+
+
+def etag_matches(if_none_match: str | None, etag: str) -> bool:
+    if if_none_match:
+        if if_none_match[:2] == 'W/':  # a weak ETag of compressed content, by CompressionMiddleware or nginx
+            if_none_match = if_none_match[2:]
+        return if_none_match == etag
+    return False
 
 
 async def unattached_send(message: Message) -> NoReturn:
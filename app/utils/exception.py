@@ -1,4 +1,7 @@
-from fastapi import Request
+from functools import cached_property
+
+import orjson
+from fastapi import Request, Response
 from fastapi.exceptions import RequestValidationError
 from fastapi.responses import JSONResponse
 
@@ -12,9 +15,23 @@ class HTTPError(Exception):
         self.msg = msg
         self.headers = headers
 
+    @cached_property
+    def body(self) -> bytes:
+        """The encoded body, which is encoded once for the constant errors below."""
+        return orjson.dumps({'code': self.code, 'msg': self.msg})
+
+
+class NotModified(HTTPError):
+    """Answers a conditional request with 304 before the endpoint runs."""
+
+    body = b''  # a 304 response has no body
+
+    def __init__(self, headers: dict[str, str]):
+        super().__init__(status_code=304, headers=headers)
+
 
 async def http_error_handler(request: Request, exc: HTTPError):
-    return JSONResponse(status_code=exc.status_code, content={'code': exc.code, 'msg': exc.msg}, headers=exc.headers)
+    return Response(exc.body, status_code=exc.status_code, headers=exc.headers, media_type='application/json')
 
 
 async def validation_error_handler(request: Request, exc: RequestValidationError):
@@ -67,3 +84,10 @@ internal_server_error = HTTPError(
     code=ErrorCode.INTERNAL_SERVER_ERROR,
     msg='Internal Server Error',
 )
+
+service_unavailable_error = HTTPError(
+    status_code=503,
+    code=ErrorCode.SERVICE_UNAVAILABLE,
+    msg='Service Unavailable',
+    headers={'Retry-After': '1'},
+)
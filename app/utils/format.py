@@ -1,11 +1,34 @@
 from datetime import datetime
-from typing import Any, Sequence
+from typing import Any, Iterable, Sequence
 
+import orjson
 from sqlalchemy import Row
 from sqlmodel import SQLModel
 from sqlmodel.main import IncEx
 
 
+def datetime_columns(records: Sequence[Any], columns: Iterable[Any]) -> list[Any]:
+    """Returns the columns (indexes of rows or keys of dicts) holding datetimes.
+
+    The values of a column share a type, so each column is decided by its first value which is not None, and the
+    records are inspected only until every column is decided.
+    """
+    result = []
+    undecided = list(columns)
+    for record in records:
+        if not undecided:
+            break
+        pending = []
+        for column in undecided:
+            value = record.get(column) if isinstance(record, dict) else record[column]
+            if value is None:
+                pending.append(column)
+            elif isinstance(value, datetime):
+                result.append(column)
+        undecided = pending
+    return result
+
+
 def row_dump(row: Row, convert_datetime=True) -> dict[str, Any]:
     if convert_datetime:
         return {k: v.timestamp() if isinstance(v, datetime) else v for k, v in row._asdict().items()}
@@ -13,9 +36,28 @@ def row_dump(row: Row, convert_datetime=True) -> dict[str, Any]:
 
 
 def rows_dump(rows: Sequence[Row], convert_datetime=True) -> list[dict[str, Any]]:
-    if convert_datetime:
-        return [{k: v.timestamp() if isinstance(v, datetime) else v for k, v in row._asdict().items()} for row in rows]
-    return [row._asdict() for row in rows]
+    """Converts the rows column by column, so that only the datetime columns are converted, without checking the type of
+    every value."""
+    if not rows:
+        return []
+    keys = rows[0]._fields
+    indexes = datetime_columns(rows, range(len(keys))) if convert_datetime else []
+    if not indexes:
+        return [dict(zip(keys, row)) for row in rows]
+    columns: list[Sequence[Any]] = list(zip(*rows))
+    for i in indexes:
+        columns[i] = [None if v is None else v.timestamp() for v in columns[i]]
+    return [dict(zip(keys, values)) for values in zip(*columns)]
+
+
+def rows_json(rows: Sequence[Row], convert_datetime=True) -> bytes:
+    """Returns the rows as a JSON array, the same as `json.dumps(rows_dump(rows))` but encoded by orjson."""
+    return orjson.dumps(rows_dump(rows, convert_datetime))
+
+
+def rows_ndjson(rows: Sequence[Row], convert_datetime=True) -> bytes:
+    """Returns the rows as JSON objects, one per line."""
+    return b''.join(orjson.dumps(row, option=orjson.OPT_APPEND_NEWLINE) for row in rows_dump(rows, convert_datetime))
 
 
 def model_dump(
@@ -43,12 +85,13 @@ def models_dump(
     convert_datetime=True
 ) -> list[dict[str, Any]]:
     result = [model.model_dump(include=include, exclude=exclude, exclude_unset=exclude_unset, exclude_defaults=exclude_defaults, exclude_none=exclude_none) for model in models]
-    if convert_datetime:
-        return [
-            {
-                k: v.timestamp() if isinstance(v, datetime) else v
-                for k, v in model.items()
-            }
-            for model in result
-        ]
+    if convert_datetime and result:
+        # the dumps are new dicts, so their datetimes are replaced in place instead of building the dicts again
+        # the keys may differ between the dumps, e.g. of the fields not loaded or excluded
+        keys = datetime_columns(result, {key: None for model in result for key in model})
+        for model in result:
+            for key in keys:
+                value = model.get(key)
+                if value is not None:
+                    model[key] = value.timestamp()
     return result
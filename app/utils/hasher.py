@@ -0,0 +1,101 @@
+import asyncio
+import os
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from multiprocessing import get_context
+from time import perf_counter
+from typing import Any, Callable
+
+from argon2 import PasswordHasher
+
+from app.config import config
+from app.utils.exception import service_unavailable_error
+
+ph = PasswordHasher()
+
+
+# These functions run in the worker processes, so they must stay importable at module level.
+def hash_password(password: str) -> str:
+    return ph.hash(password)
+
+
+def verify_password(hashed_password: str, password: str) -> bool:
+    return ph.verify(hashed_password, password)
+
+
+class HashExecutor:
+    """Runs argon2 in a process pool so that hashing never blocks the event loop.
+
+    At most `workers + queue_size` calls can be pending, further calls are rejected with a 503 immediately instead of
+    queueing up behind a burst of logins.
+    """
+
+    def __init__(self, workers: int, queue_size: int) -> None:
+        self.workers = workers or os.cpu_count() or 1
+        self.queue_size = queue_size
+        self.executor: ProcessPoolExecutor | None = None
+        self.pending = 0
+        self.rejected = 0
+        self.completed = 0
+        self.total_time = 0.0
+        self.max_time = 0.0
+
+    def start(self) -> ProcessPoolExecutor:
+        if self.executor is None:
+            # don't fork a process which may be running the event loop and other threads
+            self.executor = ProcessPoolExecutor(self.workers, mp_context=get_context('spawn'))
+        return self.executor
+
+    def shutdown(self) -> None:
+        if self.executor is not None:
+            self.executor.shutdown(cancel_futures=True)
+            self.executor = None
+
+    async def run(self, func: Callable[..., Any], *args: Any) -> Any:
+        if self.pending >= self.workers + self.queue_size:
+            self.rejected += 1
+            raise service_unavailable_error
+
+        executor = self.start()
+        loop = asyncio.get_running_loop()
+        start_time = perf_counter()
+        try:
+            future = executor.submit(func, *args)
+            self.pending += 1
+            # the slot is released when the job is done, not when the caller stops waiting: the job of a cancelled
+            # caller keeps its worker busy until it ends. It's scheduled before the caller is woken up.
+            future.add_done_callback(lambda _: loop.call_soon_threadsafe(self.release, start_time))
+            return await asyncio.wrap_future(future)
+        except BrokenProcessPool:
+            if self.executor is executor:  # a worker was killed, create a new pool for the next call
+                self.executor = None
+                executor.shutdown(wait=False)
+            raise
+
+    def release(self, start_time: float) -> None:
+        self.pending -= 1
+        elapsed = perf_counter() - start_time
+        self.completed += 1
+        self.total_time += elapsed
+        if elapsed > self.max_time:
+            self.max_time = elapsed
+
+    async def hash_password(self, password: str) -> str:
+        return await self.run(hash_password, password)
+
+    async def verify_password(self, hashed_password: str, password: str) -> bool:
+        return await self.run(verify_password, hashed_password, password)
+
+    def stats(self) -> dict[str, int | float]:
+        return {
+            'workers': self.workers,
+            'pending': self.pending,
+            'queue_depth': max(self.pending - self.workers, 0),
+            'rejected': self.rejected,
+            'completed': self.completed,
+            'avg_time': self.total_time / self.completed if self.completed else 0.0,
+            'max_time': self.max_time,
+        }
+
+
+hash_executor = HashExecutor(config.ARGON2_WORKERS, config.ARGON2_QUEUE_SIZE)
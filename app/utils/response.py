@@ -0,0 +1,82 @@
+from functools import wraps
+from typing import Any, Callable, Coroutine, TypeVar
+
+import orjson
+from fastapi import Response
+from fastapi.datastructures import DefaultPlaceholder
+from fastapi.routing import APIRoute
+from pydantic import BaseModel, TypeAdapter
+
+F = TypeVar('F', bound=Callable[..., Coroutine[Any, Any, Any]])
+
+type_adapters: dict[Any, TypeAdapter] = {}
+
+
+def get_type_adapter(model: Any) -> TypeAdapter:
+    adapter = type_adapters.get(model)
+    if adapter is None:
+        adapter = type_adapters[model] = TypeAdapter(model)
+    return adapter
+
+
+def encode_default(value: Any) -> Any:
+    """Encodes the values which orjson doesn't support like `jsonable_encoder()` does."""
+    if isinstance(value, bytes):
+        return value.decode()
+    if isinstance(value, BaseModel):
+        return value.model_dump(mode='json')
+    raise TypeError
+
+
+def serialize(content: Any, model: Any = None, exclude_none: bool = False) -> bytes:
+    """Serializes the content by the response model to JSON bytes.
+
+    An instance of the model (or its subclass, whose extra fields are left out like FastAPI does) is serialized without
+    being validated again. Other content is validated by the model first, or encoded by orjson if there's no model.
+    """
+    if model is None:
+        return orjson.dumps(content, default=encode_default)
+    adapter = get_type_adapter(model)
+    if not (isinstance(model, type) and isinstance(content, model)):
+        content = adapter.validate_python(content, from_attributes=True)
+    return adapter.dump_json(content, exclude_none=exclude_none)
+
+
+def fast_response(endpoint: F) -> F:
+    """Marks an async endpoint whose return value is serialized straight to a response by `FastResponseRoute`.
+
+    FastAPI validates the return value by the response model before serializing it, even if it's already an instance of
+    the model. The response model is still declared for the OpenAPI docs. Headers set on an injected `Response` are not
+    applied, so endpoints which need them should return a response themselves.
+    """
+    endpoint.__fast_response__ = True  # type: ignore[attr-defined]
+    return endpoint
+
+
+class FastResponseRoute(APIRoute):
+    """Wraps the endpoints marked by `@fast_response` to return responses serialized by the route's response model,
+    status code and `response_model_exclude_none`."""
+
+    def __init__(self, path: str, endpoint: Callable[..., Any], **kwargs: Any) -> None:
+        if getattr(endpoint, '__fast_response__', False):
+            response_model = kwargs.get('response_model')
+            if isinstance(response_model, DefaultPlaceholder):
+                response_model = None
+            status_code = kwargs.get('status_code') or 200
+            exclude_none = kwargs.get('response_model_exclude_none', False)
+            endpoint = self.wrap_endpoint(endpoint, response_model, status_code, exclude_none)
+        super().__init__(path, endpoint, **kwargs)
+
+    @staticmethod
+    def wrap_endpoint(endpoint: Callable[..., Any], response_model: Any, status_code: int, exclude_none: bool) -> Any:
+        @wraps(endpoint)
+        async def fast_endpoint(*args: Any, **kwargs: Any) -> Any:
+            content = await endpoint(*args, **kwargs)
+            if isinstance(content, Response):
+                return content
+            return Response(
+                serialize(content, response_model, exclude_none), status_code, media_type='application/json'
+            )
+
+        fast_endpoint.__fast_response__ = False  # type: ignore[attr-defined]  # wrapped already
+        return fast_endpoint
@@ -0,0 +1,278 @@
+import asyncio
+import logging
+from time import time
+from typing import Any, Awaitable, Callable, Sequence, TypeVar
+
+import orjson
+from redis.exceptions import RedisError
+from starlette.datastructures import Headers, MutableHeaders
+from starlette.routing import BaseRoute, Match
+from starlette.status import HTTP_200_OK, HTTP_304_NOT_MODIFIED
+from starlette.types import ASGIApp, Message, Receive, Scope, Send
+
+from app.clients.redis import redis_client
+from app.config import config
+
+from .cache import LRUCache
+from .etag import etag_matches
+from .exception import HTTPError
+
+F = TypeVar('F', bound=Callable[..., Any])
+RawHeaders = list[tuple[bytes, bytes]]
+
+
+class CachePolicy:
+    __slots__ = ('ttl', 'vary_user', 'vary_headers')
+
+    def __init__(self, ttl: int, vary_user: bool, vary_headers: tuple[str, ...]) -> None:
+        self.ttl = ttl
+        self.vary_user = vary_user
+        self.vary_headers = vary_headers
+
+
+def cache_response(ttl: int, vary_user: bool = False, vary_headers: Sequence[str] = ()) -> Callable[[F], F]:
+    """Marks an endpoint whose 200 responses to GET requests are cached by `ResponseCacheMiddleware` for `ttl` seconds.
+
+    They're cached by path and query, and also by the authenticated user if `vary_user`, and by the values of the
+    request headers of `vary_headers`. A write doesn't invalidate them, so they may be stale for up to `ttl` seconds.
+    With a `ttl` of 0, they're not kept, but the concurrent requests still share the response being built.
+    """
+    policy = CachePolicy(ttl, vary_user, tuple(name.lower() for name in vary_headers))
+
+    def decorator(endpoint: F) -> F:
+        endpoint.__cache_policy__ = policy  # type: ignore[attr-defined]
+        return endpoint
+
+    return decorator
+
+
+class CachedResponse:
+    __slots__ = ('headers', 'body', 'expire_at')
+
+    def __init__(self, headers: RawHeaders, body: bytes, expire_at: float) -> None:
+        self.headers = headers
+        self.body = body
+        self.expire_at = expire_at
+
+    def dump(self) -> bytes:
+        # JSON doesn't contain raw newlines, so the body starts after the first one
+        headers = [(name.decode('latin-1'), value.decode('latin-1')) for name, value in self.headers]
+        return orjson.dumps([self.expire_at, headers]) + b'\n' + self.body
+
+    @classmethod
+    def load(cls, data: bytes) -> 'CachedResponse':
+        head, _, body = data.partition(b'\n')
+        expire_at, headers = orjson.loads(head)
+        return cls([(name.encode('latin-1'), value.encode('latin-1')) for name, value in headers], body, expire_at)
+
+
+class ResponseCacheMiddleware:
+    """Caches the responses of the endpoints marked by `@cache_response()` in process and in Redis.
+
+    The routes are looked up in `routes`, or in the routes of the app by default. Concurrent misses of the same response
+    in this process run the endpoint once, whose response is shared by the others, unless it turns out not to be
+    cacheable. Requests which vary by user are authenticated by `authenticate`, which is given the bearer token and
+    returns the user id, and go to the endpoint if it fails.
+    It's placed in front of ETagMiddleware, so the cached responses keep their ETags, and a matching If-None-Match is
+    answered with 304 from the cache. If-None-Match is not passed to the endpoint, which always returns the full
+    response to cache. Requests with If-Modified-Since only are passed through, for the endpoint to answer them cheaply.
+    """
+
+    def __init__(
+        self,
+        app: ASGIApp,
+        routes: Sequence[BaseRoute] | None = None,
+        authenticate: Callable[[str], Awaitable[int]] | None = None,
+        maxsize: int = config.RESPONSE_CACHE_SIZE,
+        maxbytes: int = config.RESPONSE_CACHE_MAX_BYTES,
+        max_entry_size: int = config.RESPONSE_CACHE_MAX_ENTRY_SIZE,
+    ) -> None:
+        self.app = app
+        self.all_routes = routes
+        self.authenticate = authenticate
+        self.cache: LRUCache[str, CachedResponse] = LRUCache(maxsize, timer=time, maxbytes=maxbytes)
+        self.max_entry_size = max_entry_size
+        self.routes: list[tuple[Any, CachePolicy]] | None = None
+        self.loading: dict[str, asyncio.Future[CachedResponse | None]] = {}
+        self.hits = 0
+        self.misses = 0
+        self.coalesced = 0
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send) -> None:
+        if scope['type'] == 'http' and scope['method'] == 'GET':
+            policy = self.match_policy(scope)
+            if policy is not None:
+                key = await self.key(scope, policy)
+                if key is not None:
+                    await self.respond(key, policy, scope, receive, send)
+                    return
+        await self.app(scope, receive, send)
+
+    def match_policy(self, scope: Scope) -> CachePolicy | None:
+        routes = self.routes
+        if routes is None:
+            routes = self.routes = [
+                (route, policy)
+                for route in (self.all_routes if self.all_routes is not None else scope['app'].routes)
+                if (policy := getattr(getattr(route, 'endpoint', None), '__cache_policy__', None)) is not None
+            ]
+        for route, policy in routes:
+            if route.matches(scope)[0] == Match.FULL:
+                return policy
+        return None
+
+    async def key(self, scope: Scope, policy: CachePolicy) -> str | None:
+        """Returns the cache key of the request, or None if it shouldn't use the cache."""
+        headers = Headers(scope=scope)
+        if 'if-modified-since' in headers and 'if-none-match' not in headers:
+            return None
+        key = f'response:{scope["path"]}?{scope["query_string"].decode("latin-1")}'
+        if policy.vary_user:
+            scheme, _, token = headers.get('authorization', '').partition(' ')
+            if self.authenticate is None or scheme.lower() != 'bearer' or not token:
+                return None
+            try:
+                user_id = await self.authenticate(token)
+            except HTTPError:  # let the endpoint answer it
+                return None
+            key = f'{key}:{user_id}'
+        for name in policy.vary_headers:
+            key = f'{key}:{headers.get(name, "")}'
+        return key
+
+    async def respond(self, key: str, policy: CachePolicy, scope: Scope, receive: Receive, send: Send) -> None:
+        if_none_match = Headers(scope=scope).get('if-none-match')
+        response = self.cache.get(key)
+        if response is None:
+            future = self.loading.get(key)
+            if future is not None:
+                self.coalesced += 1
+                response = await asyncio.shield(future)
+                if response is None:  # not cacheable
+                    await self.app(scope, receive, send)
+                    return
+            else:
+                response = await self.load(key, policy, scope, receive, send, if_none_match)
+                if response is None:  # already sent
+                    return
+        else:
+            self.hits += 1
+        await send_cached(response, send, if_none_match)
+
+    async def load(
+        self, key: str, policy: CachePolicy, scope: Scope, receive: Receive, send: Send, if_none_match: str | None
+    ) -> CachedResponse | None:
+        """Returns the response from Redis, or runs the endpoint to send and cache it, and returns None."""
+        future: asyncio.Future[CachedResponse | None] = asyncio.get_running_loop().create_future()
+        self.loading[key] = future
+        try:
+            data = None
+            if policy.ttl:
+                try:
+                    data = await redis_client.get(key)
+                except RedisError:
+                    logging.exception('failed to read response cache')
+            if data is not None:
+                response = CachedResponse.load(data)
+                self.hits += 1
+                self.cache.set(key, response, response.expire_at, len(response.body))
+                future.set_result(response)
+                return response
+
+            self.misses += 1
+            if if_none_match is not None:  # the endpoint should return the full response to cache
+                scope = {
+                    **scope,
+                    'headers': [(name, value) for name, value in scope['headers'] if name != b'if-none-match'],
+                }
+            recorder = ResponseRecorder(send, if_none_match, self.max_entry_size, future)
+            await self.app(scope, receive, recorder.send_and_record)
+            response = recorder.response(time() + policy.ttl)
+            if not future.done():
+                future.set_result(response)
+            if response is not None and policy.ttl:
+                self.cache.set(key, response, response.expire_at, len(response.body))
+                try:
+                    await redis_client.set(key, response.dump(), ex=policy.ttl)
+                except RedisError:
+                    logging.exception('failed to write response cache')
+            return None
+        finally:
+            if not future.done():
+                future.set_result(None)  # the followers run the endpoint themselves
+            del self.loading[key]
+
+    def stats(self) -> dict[str, int]:
+        return {**self.cache.stats(), 'hits': self.hits, 'misses': self.misses, 'coalesced': self.coalesced}
+
+
+class ResponseRecorder:
+    """Sends the response of the endpoint as it goes, and records it if it can be cached. The followers waiting for it
+    are released as soon as it turns out not to be cacheable."""
+
+    def __init__(
+        self, send: Send, if_none_match: str | None, max_size: int, future: asyncio.Future[CachedResponse | None]
+    ) -> None:
+        self.send = send
+        self.if_none_match = if_none_match
+        self.max_size = max_size
+        self.future = future
+        self.headers: RawHeaders = []
+        self.chunks: list[bytes] | None = []  # None if it's not cacheable
+        self.size = 0
+        self.not_modified = False
+        self.complete = False
+
+    def give_up(self) -> None:
+        self.chunks = None
+        if not self.future.done():
+            self.future.set_result(None)
+
+    async def send_and_record(self, message: Message) -> None:
+        message_type = message['type']
+        if message_type == 'http.response.start':
+            self.headers = list(message['headers'])
+            headers = Headers(raw=self.headers)
+            if message['status'] != HTTP_200_OK or 'content-length' not in headers:  # e.g. streamed
+                self.give_up()
+            etag = headers.get('etag')
+            if message['status'] == HTTP_200_OK and etag and etag_matches(self.if_none_match, etag):
+                self.not_modified = True
+                message = not_modified_message(self.headers)
+        elif message_type == 'http.response.body':
+            more_body = message.get('more_body', False)
+            if self.chunks is not None:
+                body = message.get('body', b'')
+                self.size += len(body)
+                if self.size > self.max_size:
+                    self.give_up()
+                else:
+                    self.chunks.append(body)
+                    self.complete = not more_body
+            if self.not_modified:
+                if more_body:
+                    return
+                message = {'type': 'http.response.body', 'body': b''}
+        await self.send(message)
+
+    def response(self, expire_at: float) -> CachedResponse | None:
+        if self.chunks is None or not self.complete:
+            return None
+        return CachedResponse(self.headers, b''.join(self.chunks), expire_at)
+
+
+def not_modified_message(headers: RawHeaders) -> Message:
+    not_modified = MutableHeaders(raw=list(headers))
+    del not_modified['content-length']
+    return {'type': 'http.response.start', 'status': HTTP_304_NOT_MODIFIED, 'headers': not_modified.raw}
+
+
+async def send_cached(response: CachedResponse, send: Send, if_none_match: str | None) -> None:
+    etag = Headers(raw=response.headers).get('etag')
+    if etag and etag_matches(if_none_match, etag):
+        await send(not_modified_message(response.headers))
+        await send({'type': 'http.response.body', 'body': b''})
+        return
+    # a copy, since the middlewares in front may modify the headers in place
+    await send({'type': 'http.response.start', 'status': HTTP_200_OK, 'headers': list(response.headers)})
+    await send({'type': 'http.response.body', 'body': response.body})
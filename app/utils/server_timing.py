@@ -0,0 +1,58 @@
+from typing import Any, Callable, Coroutine
+
+from fastapi import Request, Response
+from fastapi.routing import APIRoute
+from starlette.datastructures import MutableHeaders
+from starlette.types import ASGIApp, Message, Receive, Scope, Send
+
+from app.utils.sql_stats import RequestTiming, request_timing, sql_stats
+
+
+def server_timing(timing: RequestTiming) -> str:
+    return (
+        f'db;dur={timing.db_time * 1000:.1f};desc="{timing.queries} queries", '
+        f'db-wait;dur={timing.checkout_wait * 1000:.1f}'
+    )
+
+
+class ServerTimingMiddleware:
+    """Measures the database time of each request, which is reported by the Server-Timing header and recorded by
+    route. A streaming response can't report the time spent after its headers are sent."""
+
+    def __init__(self, app: ASGIApp) -> None:
+        self.app = app
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send) -> None:
+        if scope['type'] != 'http':
+            await self.app(scope, receive, send)
+            return
+
+        timing = RequestTiming()
+
+        async def send_with_timing(message: Message) -> None:
+            if message['type'] == 'http.response.start':
+                MutableHeaders(raw=message['headers']).append('server-timing', server_timing(timing))
+            await send(message)
+
+        token = request_timing.set(timing)
+        try:
+            await self.app(scope, receive, send_with_timing)
+        finally:
+            request_timing.reset(token)
+            sql_stats.record_request(timing)
+
+
+class TimedRoute(APIRoute):
+    """Attributes the statements executed by the requests to the route."""
+
+    def get_route_handler(self) -> Callable[[Request], Coroutine[Any, Any, Response]]:
+        handler = super().get_route_handler()
+        route = f'{",".join(sorted(self.methods))} {self.path}'
+
+        async def timed_handler(request: Request) -> Response:
+            timing = request_timing.get()
+            if timing is not None:
+                timing.route = route
+            return await handler(request)
+
+        return timed_handler
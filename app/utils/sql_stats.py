@@ -0,0 +1,145 @@
+import logging
+import re
+from bisect import bisect_left
+from contextvars import ContextVar
+from typing import Any, Sequence
+
+from app.config import config
+from app.utils.cache import LRUCache
+
+# upper bounds of the buckets in seconds, the last bucket counts the rest
+BUCKETS = (0.001, 0.002, 0.005, 0.01, 0.02, 0.05, 0.1, 0.2, 0.5, 1, 2, 5)
+
+EXPANDED_PARAMS = re.compile(r'\((?:%s|\?)(?:, (?:%s|\?))+\)')  # the parameters of an expanded IN
+
+
+class Histogram:
+    def __init__(self, buckets: Sequence[float] = BUCKETS) -> None:
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)
+        self.count = 0
+        self.sum = 0.0
+        self.max = 0.0
+
+    def observe(self, value: float) -> None:
+        self.counts[bisect_left(self.buckets, value)] += 1
+        self.count += 1
+        self.sum += value
+        if value > self.max:
+            self.max = value
+
+    def stats(self) -> dict[str, Any]:
+        return {
+            'count': self.count,
+            'sum': self.sum,
+            'max': self.max,
+            'buckets': dict(zip((*self.buckets, float('inf')), self.counts)),
+        }
+
+
+class QueryStats:
+    def __init__(self) -> None:
+        self.latency = Histogram()
+        self.rows = 0
+
+
+class RouteStats:
+    def __init__(self, maxsize: int) -> None:
+        self.db_time = Histogram()  # of each request
+        self.checkout_wait = Histogram()  # of each checkout
+        self.queries: LRUCache[str, QueryStats] = LRUCache(maxsize)
+
+
+class RequestTiming:
+    """The database time of the current request, which is reported by the Server-Timing header."""
+
+    __slots__ = ('route', 'db_time', 'queries', 'checkout_wait')
+
+    def __init__(self) -> None:
+        self.route = ''  # set when the request is routed
+        self.db_time = 0.0
+        self.queries = 0
+        self.checkout_wait = 0.0
+
+
+request_timing: ContextVar[RequestTiming | None] = ContextVar('request_timing', default=None)
+
+
+def fingerprint(statement: str) -> str:
+    """Returns the statement with the parameters of expanded IN collapsed, so that the lengths of lists don't matter."""
+    return EXPANDED_PARAMS.sub('(...)', statement)
+
+
+def params_shape(parameters: Any) -> str:
+    """Describes the types of the bound parameters without their values, which may be sensitive or large."""
+    if isinstance(parameters, dict):
+        return '{' + ', '.join(f'{name}: {type(value).__name__}' for name, value in parameters.items()) + '}'
+    if isinstance(parameters, (list, tuple)):
+        if parameters and isinstance(parameters[0], (list, tuple, dict)):  # executemany
+            return f'{len(parameters)} x {params_shape(parameters[0])}'
+        return '(' + ', '.join(type(value).__name__ for value in parameters) + ')'
+    return type(parameters).__name__
+
+
+class SQLStats:
+    """Aggregates the latency and rows of the statements by route and fingerprint, and logs the slow ones."""
+
+    def __init__(self, slow_query_threshold: float, maxsize: int) -> None:
+        self.slow_query_threshold = slow_query_threshold
+        self.maxsize = maxsize
+        self.routes: dict[str, RouteStats] = {}
+
+    def route_stats(self, route: str) -> RouteStats:
+        stats = self.routes.get(route)
+        if stats is None:
+            stats = self.routes[route] = RouteStats(self.maxsize)
+        return stats
+
+    def record_query(self, statement: str, parameters: Any, elapsed: float, rows: int) -> None:
+        timing = request_timing.get()
+        route = ''
+        if timing is not None:
+            timing.db_time += elapsed
+            timing.queries += 1
+            route = timing.route
+
+        key = fingerprint(statement)
+        queries = self.route_stats(route).queries
+        stats = queries.get(key)
+        if stats is None:
+            stats = QueryStats()
+            queries.set(key, stats)
+        stats.latency.observe(elapsed)
+        stats.rows += rows
+
+        if self.slow_query_threshold and elapsed >= self.slow_query_threshold:
+            logging.warning(
+                'slow query in %.3fs on %s: %s; parameters: %s', elapsed, route or '-', key, params_shape(parameters)
+            )
+
+    def record_checkout(self, wait: float) -> None:
+        timing = request_timing.get()
+        route = ''
+        if timing is not None:
+            timing.checkout_wait += wait
+            route = timing.route
+        self.route_stats(route).checkout_wait.observe(wait)
+
+    def record_request(self, timing: RequestTiming) -> None:
+        self.route_stats(timing.route).db_time.observe(timing.db_time)
+
+    def stats(self) -> dict[str, Any]:
+        return {
+            route or '-': {
+                'db_time': stats.db_time.stats(),
+                'checkout_wait': stats.checkout_wait.stats(),
+                'queries': {
+                    key: {**query_stats.latency.stats(), 'rows': query_stats.rows}
+                    for key, (query_stats, _, _) in stats.queries.data.items()
+                },
+            }
+            for route, stats in self.routes.items()
+        }
+
+
+sql_stats = SQLStats(config.MYSQL_SLOW_QUERY_THRESHOLD, config.MYSQL_STATS_SIZE)
@@ -0,0 +1,58 @@
+"""Measures the ops/sec of INCR issued by concurrent coroutines, with the pooled client and with `AutoPipeline`.
+
+The pooled client sends each command on its own connection and waits for its reply, while `AutoPipeline` sends the
+commands of a loop iteration together. It needs the Redis server of REDIS_DSN, and uses the key `benchmark:count`.
+
+Usage: python -m benchmarks.redis_pipeline [concurrency ...]
+"""
+
+import asyncio
+import sys
+from time import perf_counter
+from typing import Any
+
+import redis.asyncio as redis
+
+from app.clients.redis import AutoPipeline
+from app.config import config
+
+CONCURRENCY = (1, 10, 100, 1000)
+DURATION = 2  # seconds of each measurement
+KEY = 'benchmark:count'
+
+
+async def measure(client: Any, concurrency: int) -> float:
+    """Returns the ops/sec of `concurrency` coroutines sending INCR in a loop."""
+    count = 0
+    stop_at = perf_counter() + DURATION
+
+    async def worker() -> None:
+        nonlocal count
+        while perf_counter() < stop_at:
+            await client.incr(KEY)
+            count += 1
+
+    started_at = perf_counter()
+    await asyncio.gather(*(worker() for _ in range(concurrency)))
+    return count / (perf_counter() - started_at)
+
+
+async def main() -> None:
+    concurrencies = [int(arg) for arg in sys.argv[1:]] or CONCURRENCY
+    client = redis.Redis.from_url(str(config.REDIS_DSN))
+    pipeline = AutoPipeline(client, config.REDIS_PIPELINE_MAX_BATCH_SIZE, config.REDIS_PIPELINE_FLUSH_DELAY)
+    print(f'{"concurrency":<14}{"pooled (ops/s)":>18}{"pipelined (ops/s)":>20}{"speedup":>10}{"batch size":>12}')
+    try:
+        for concurrency in concurrencies:
+            before = await measure(client, concurrency)
+            pipeline.batches = pipeline.sent = 0
+            after = await measure(pipeline, concurrency)
+            batch_size = pipeline.stats()['average_batch_size']
+            print(f'{concurrency:<14}{before:>18.0f}{after:>20.0f}{after / before:>9.1f}x{batch_size:>12.1f}')
+    finally:
+        await client.delete(KEY)
+        await client.aclose()
+
+
+if __name__ == '__main__':
+    asyncio.run(main())
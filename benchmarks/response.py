@@ -0,0 +1,117 @@
+"""Measures the throughput of routes like the user routes, with FastAPI's response model serialization and with
+`@fast_response`, and of an error response encoded for each request and pre-encoded.
+
+The requests are sent to the ASGI app directly, so the numbers are of the routing, validation and serialization
+without the server and network. No database is needed.
+
+Usage: python -m benchmarks.response
+"""
+
+import asyncio
+from time import perf_counter
+from typing import Any
+
+from fastapi import APIRouter, FastAPI
+from fastapi.responses import JSONResponse
+
+from app.models.user import User, UserBase
+from app.router import Route
+from app.schemas.resp import Resp
+from app.utils.exception import HTTPError, http_error_handler, not_found_error
+from app.utils.response import fast_response
+
+REQUESTS = 20000
+USERS = [{'id': i, 'name': f'user{i}', 'created_at': 1.7e9 + i, 'updated_at': 1.7e9 + i} for i in range(100)]
+
+
+def make_user() -> User:
+    user = User('test', 'x', hashed=True)
+    user.id = 1
+    return user
+
+
+def add_routes(router: APIRouter, fast: bool) -> None:
+    def mark(endpoint: Any) -> Any:
+        return fast_response(endpoint) if fast else endpoint
+
+    @router.get('/name', response_model=Resp, response_model_exclude_none=True)
+    @mark
+    async def get_name():
+        return Resp(data={'name': 'test'})
+
+    @router.get('/user', response_model=UserBase)
+    @mark
+    async def get_user():
+        return make_user()
+
+    @router.get('/users', response_model=Resp, response_model_exclude_none=True)
+    @mark
+    async def get_users():
+        return Resp(data={'users': USERS, 'total': len(USERS)})
+
+    @router.get('/error')
+    async def get_error():
+        raise not_found_error
+
+
+async def encode_error(request: Any, exc: HTTPError) -> JSONResponse:
+    """The previous handler, which encodes the body for each error."""
+    return JSONResponse(status_code=exc.status_code, content={'code': exc.code, 'msg': exc.msg}, headers=exc.headers)
+
+
+def make_app(fast: bool) -> FastAPI:
+    app = FastAPI()
+    router = APIRouter(route_class=Route)
+    add_routes(router, fast)
+    app.include_router(router)
+    app.exception_handler(HTTPError)(http_error_handler if fast else encode_error)
+    return app
+
+
+async def request(app: FastAPI, path: str) -> None:
+    scope = {
+        'type': 'http',
+        'asgi': {'version': '3.0'},
+        'http_version': '1.1',
+        'method': 'GET',
+        'scheme': 'http',
+        'path': path,
+        'raw_path': path.encode(),
+        'root_path': '',
+        'query_string': b'',
+        'headers': [(b'host', b'test')],
+        'client': ('127.0.0.1', 1234),
+        'server': ('test', 80),
+    }
+
+    async def receive() -> dict:
+        return {'type': 'http.request', 'body': b'', 'more_body': False}
+
+    async def send(message: dict) -> None:
+        pass
+
+    await app(scope, receive, send)
+
+
+async def measure(app: FastAPI, path: str) -> float:
+    """Returns the requests per second."""
+    for _ in range(100):  # warm up
+        await request(app, path)
+    started_at = perf_counter()
+    for _ in range(REQUESTS):
+        await request(app, path)
+    return REQUESTS / (perf_counter() - started_at)
+
+
+async def main() -> None:
+    default_app = make_app(False)
+    fast_app = make_app(True)
+    print(f'{"route":<12}{"default (req/s)":>18}{"fast (req/s)":>18}{"speedup":>10}')
+    for path in ('/name', '/user', '/users', '/error'):
+        before = await measure(default_app, path)
+        after = await measure(fast_app, path)
+        print(f'{path:<12}{before:>18.0f}{after:>18.0f}{after / before:>9.2f}x')
+
+
+if __name__ == '__main__':
+    asyncio.run(main())
@@ -0,0 +1,71 @@
+"""Measures the per-call cost of preparing the `BaseModel` queries, with and without the statement cache.
+
+Before executing a statement, SQLAlchemy generates its cache key to look up the compiled form, so each "uncached" call
+builds the statement and generates its key like the query helpers used to, while each "cached" call looks up the
+prebuilt statement, whose key is memoized. No database is needed.
+
+Usage: python -m benchmarks.statement_cache
+"""
+
+from timeit import repeat
+from typing import Callable
+
+from sqlmodel import col, select, text, update
+
+from app.models.user import User
+
+NUMBER = 10000
+
+
+def uncached_get_by_id() -> None:
+    select(User.name).where(User.id == 1)._generate_cache_key()
+
+
+def cached_get_by_id() -> None:
+    User.select_by_ids(col(User.name))[0]._generate_cache_key()
+
+
+def uncached_get_by_ids() -> None:
+    select(User.id, User.name).where(col(User.id).in_([1, 2, 3])).with_for_update()._generate_cache_key()
+
+
+def cached_get_by_ids() -> None:
+    User.select_by_ids((User.id, User.name), for_update=True, many=True)[0]._generate_cache_key()
+
+
+def uncached_exist() -> None:
+    select(text('1')).select_from(User).where(User.id == 1)._generate_cache_key()
+
+
+def cached_exist() -> None:
+    User.select_exist()._generate_cache_key()
+
+
+def uncached_update_by_id() -> None:
+    update(User).where(col(User.id) == 1).values(name='test')._generate_cache_key()
+
+
+def cached_update_by_id() -> None:
+    User.update_by_id_statement(('name',))._generate_cache_key()
+
+
+def measure(func: Callable[[], None]) -> float:
+    """Returns the best time of a call in microseconds."""
+    return min(repeat(func, number=NUMBER, repeat=5)) / NUMBER * 1e6
+
+
+def main() -> None:
+    print(f'{"query":<16}{"uncached (us)":>16}{"cached (us)":>16}{"speedup":>10}')
+    for name, uncached, cached in (
+        ('get_by_id', uncached_get_by_id, cached_get_by_id),
+        ('get_by_ids', uncached_get_by_ids, cached_get_by_ids),
+        ('exist', uncached_exist, cached_exist),
+        ('update_by_id', uncached_update_by_id, cached_update_by_id),
+    ):
+        before = measure(uncached)
+        after = measure(cached)
+        print(f'{name:<16}{before:>16.2f}{after:>16.2f}{before / after:>9.1f}x')
+
+
+if __name__ == '__main__':
+    main()
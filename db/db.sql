@@ -6,3 +6,8 @@ CREATE TABLE `user` (
     `created_at` TIMESTAMP NOT NULL DEFAULT CURRENT_TIMESTAMP,
     `updated_at` TIMESTAMP NOT NULL DEFAULT CURRENT_TIMESTAMP ON UPDATE CURRENT_TIMESTAMP
 ) ENGINE = InnoDB DEFAULT CHARSET = ascii;
+DROP TABLE IF EXISTS `user_name`;
+CREATE TABLE `user_name` (
+    `id` INT UNSIGNED NOT NULL PRIMARY KEY,
+    `name` VARCHAR(32) NOT NULL UNIQUE
+) ENGINE = InnoDB DEFAULT CHARSET = ascii;
@@ -3,3 +3,8 @@ CREATE TABLE `model` (
     `id` INT UNSIGNED NOT NULL PRIMARY KEY AUTO_INCREMENT,
     `name` VARCHAR(32) NOT NULL
 ) ENGINE = InnoDB DEFAULT CHARSET = ascii;
+DROP TABLE IF EXISTS `cached_model`;
+CREATE TABLE `cached_model` (
+    `id` INT UNSIGNED NOT NULL PRIMARY KEY AUTO_INCREMENT,
+    `name` VARCHAR(32) NOT NULL UNIQUE
+) ENGINE = InnoDB DEFAULT CHARSET = ascii;
@@ -0,0 +1,125 @@
+import asyncio
+
+import pytest
+from sqlalchemy.ext.asyncio import create_async_engine
+from sqlmodel import select, update
+
+from app.clients.mysql import (
+    ReplicaSet,
+    async_engine,
+    async_session,
+    create_engine,
+    drain_pool,
+    get_request_session,
+    get_session,
+    pool_of,
+    pool_stats,
+    stats,
+    warm_up_pool,
+)
+from app.config import config
+from app.models.user import User
+from app.utils.admission import Priority, RequestAdmission, request_admission
+from app.utils.exception import HTTPError
+
+
+def test_routing_session():
+    replica_engine = create_async_engine(str(config.MYSQL_DSN))
+    replica = replica_engine.sync_engine
+    primary = async_engine.sync_engine
+
+    session = async_session(replica=replica).sync_session
+    assert session.get_bind(clause=select(User)) is replica
+    assert session.get_bind(clause=select(User).with_for_update(read=True)) is primary
+    assert session.get_bind(clause=select(User)) is primary  # sticks to the primary after a locking read
+
+    session = async_session(replica=replica).sync_session
+    assert session.get_bind(clause=update(User).values(name='test')) is primary
+    assert session.get_bind(clause=select(User)) is primary
+
+    assert async_session().sync_session.get_bind(clause=select(User)) is primary
+
+
+@pytest.mark.asyncio(scope='session')
+async def test_replica_set():
+    replica_set = ReplicaSet([async_engine, async_engine], 'round_robin', 1, 1)
+    try:
+        assert replica_set.choose() is None  # the lags are unknown yet
+        assert replica_set.fallbacks == 1
+
+        for replica in replica_set.replicas:
+            await replica_set.check(replica)
+            assert replica.lag == 0  # the primary doesn't replicate from anywhere
+        replica0, replica1 = replica_set.replicas
+        assert replica_set.choose() is replica0
+        assert replica_set.choose() is replica1
+        assert replica_set.choose() is replica0
+
+        replica0.lag = 2
+        assert replica_set.choose() is replica1
+        assert replica_set.choose() is replica1
+        replica1.lag = None
+        assert replica_set.choose() is None
+        assert replica_set.fallbacks == 2
+        assert (replica0.sessions, replica1.sessions) == (2, 3)
+
+        replica_set.balance = 'least_connections'
+        replica0.lag = replica1.lag = 0
+        assert replica_set.choose() is replica0
+    finally:
+        await replica_set.close()
+
+
+@pytest.mark.asyncio(scope='session')
+async def test_readonly_session():
+    async with get_session(readonly=True) as session:  # no replica is configured
+        assert await session.scalar(select(User.name).where(User.id == 1)) == 'admin'
+    primary_stats = stats()['primary']
+    assert primary_stats['checked_out'] == 0
+    assert primary_stats['fallbacks'] == 0
+
+
+@pytest.mark.asyncio(scope='session')
+async def test_request_session():
+    sessions = get_request_session()
+    session = await anext(sessions)
+    assert stats()['primary']['checked_out'] == 0  # no connection until a statement is executed
+    assert await session.scalar(select(User.name).where(User.id == 1)) == 'admin'
+    assert stats()['primary']['checked_out'] == 1
+    await sessions.aclose()
+    assert stats()['primary']['checked_out'] == 0
+
+
+@pytest.mark.asyncio(scope='session')
+async def test_warm_up_pool():
+    pool = pool_of(async_engine)
+    await warm_up_pool(async_engine)
+    assert pool.checkedin() >= pool.size()
+    assert pool.checkedout() == 0
+
+    await drain_pool(async_engine, 1)
+    assert pool_of(async_engine).checkedin() == 0
+
+
+@pytest.mark.asyncio(scope='session')
+async def test_pool_admission():
+    engine = create_engine(config.MYSQL_DSN, 1, 0, config.MYSQL_POOL_TIMEOUT)
+    try:
+        async with engine.connect():
+            deadline = asyncio.get_running_loop().time() + 0.05
+            token = request_admission.set(RequestAdmission(Priority.HIGH, deadline))
+            try:
+                with pytest.raises(HTTPError) as exc_info:  # waits for the connection in use until the deadline
+                    async with engine.connect():
+                        pass
+                assert exc_info.value.status_code == 503
+            finally:
+                request_admission.reset(token)
+        admission_stats = pool_stats(engine)['admission']
+        assert admission_stats['timeouts'] == 1
+        assert admission_stats['in_use'] == 0
+
+        async with engine.connect():
+            assert pool_stats(engine)['admission']['in_use'] == 1
+    finally:
+        await engine.dispose()
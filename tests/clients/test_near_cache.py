@@ -0,0 +1,55 @@
+import asyncio
+
+import pytest
+import redis.asyncio as redis
+
+from app.clients.near_cache import NearCache
+from app.clients.redis import redis_client
+from app.config import config
+
+
+async def wait_until(predicate, timeout: float = 1):
+    for _ in range(int(timeout / 0.01)):
+        if predicate():
+            return
+        await asyncio.sleep(0.01)
+    raise TimeoutError
+
+
+@pytest.mark.asyncio(scope='session')
+async def test_near_cache():
+    await redis_client.delete('near:a', 'near:b', 'far:a')
+    cache = NearCache(redis_client, ['near:'], 10, 1024, 60, health_check_interval=0.1)
+    other = redis.Redis.from_url(str(config.REDIS_DSN))
+    try:
+        assert await cache.mget(['near:a']) == [None]  # read from Redis while tracking is being enabled
+        await wait_until(lambda: cache.tracking)
+
+        await redis_client.set('near:a', 'a')
+        await redis_client.set('far:a', 'a')
+        assert await cache.mget(['near:a', 'near:b', 'far:a']) == [b'a', None, b'a']
+        assert await cache.mget(['near:a', 'near:b', 'far:a']) == [b'a', None, b'a']
+        stats = cache.stats()
+        assert stats['hits'] == 2
+        assert stats['size'] == 2
+
+        await redis_client.set('near:a', 'b')  # written by another connection
+        await wait_until(lambda: 'near:a' not in cache.cache.data)
+        assert await cache.get('near:a') == b'b'
+        assert cache.stats()['invalidations'] >= 1
+
+        assert await cache.get('near:a') == b'b'
+        await other.set('near:a', 'c')  # written by another client of the default DSN, RESP3 by default
+        await wait_until(lambda: 'near:a' not in cache.cache.data)
+        assert await cache.get('near:a') == b'c'
+    finally:
+        await cache.close()
+        await other.aclose()
+        await redis_client.delete('near:a', 'near:b', 'far:a')
+    assert not cache.tracking
+    assert len(cache.cache) == 0
+
+
+def test_near_cache_listener():
+    # Redis only publishes the invalidations on the channel to RESP2 connections
+    assert NearCache(redis_client, ['near:'], 10, 1024, 60).make_listener().protocol == 2
@@ -0,0 +1,55 @@
+import asyncio
+
+import pytest
+from redis.exceptions import ResponseError
+
+from app.clients.redis import AutoPipeline, redis_client
+
+
+@pytest.mark.asyncio(scope='session')
+async def test_auto_pipeline():
+    await redis_client.delete('test:pipeline', 'test:pipeline:string')
+    await redis_client.set('test:pipeline:string', 'a')
+    pipeline = AutoPipeline(redis_client, 3, 0)
+
+    results = await asyncio.gather(*(pipeline.incr('test:pipeline') for _ in range(7)))
+    assert sorted(results) == list(range(1, 8))
+    assert pipeline.batches == 3  # 3 + 3 + 1
+    assert pipeline.stats()['commands'] == 7
+
+    results = await asyncio.gather(
+        pipeline.get('test:pipeline'), pipeline.lpush('test:pipeline:string', 'b'), return_exceptions=True
+    )
+    assert results[0] == b'7'
+    assert isinstance(results[1], ResponseError)  # only the failed command raises
+
+    pipeline = AutoPipeline(redis_client, 100, 0.01)
+    assert await asyncio.gather(pipeline.incr('test:pipeline'), pipeline.incr('test:pipeline')) == [8, 9]
+    assert pipeline.batches == 1
+    await redis_client.delete('test:pipeline', 'test:pipeline:string')
+
+
+class SlowPipeline:
+    def execute_command(self, *args, **options):
+        pass
+
+    async def execute(self, raise_on_error: bool):
+        await asyncio.sleep(10)
+
+
+class SlowClient:
+    def pipeline(self, transaction: bool):
+        return SlowPipeline()
+
+
+@pytest.mark.asyncio(scope='session')
+async def test_auto_pipeline_cancelled():
+    pipeline = AutoPipeline(SlowClient(), 100, 0)  # type: ignore
+    caller = asyncio.create_task(pipeline.get('test:pipeline'))
+    while not pipeline.tasks:
+        await asyncio.sleep(0)
+    await asyncio.sleep(0)  # sending
+    for task in pipeline.tasks:
+        task.cancel()
+    with pytest.raises(asyncio.CancelledError):
+        await asyncio.wait_for(caller, 1)  # not left waiting
@@ -2,7 +2,9 @@ import pytest
 from sqlmodel import col, delete
 
 from app.clients.mysql import get_session
+from app.clients.redis import redis_client
 from app.models.user import User
+from app.utils.sql_stats import sql_stats
 
 from . import async_client, client
 
@@ -12,6 +14,7 @@ def test_hello():
     assert response.status_code == 200
     assert response.json()['code'] == 0
     assert response.json()['msg'] == 'Hello, abc!'
+    assert response.headers['server-timing'] == 'db;dur=0.0;desc="0 queries", db-wait;dur=0.0'
 
 
 @pytest.mark.asyncio(scope='session')
@@ -24,6 +27,11 @@ async def test_hello_to_self():
         response = await client.post('/api/v1/login', data={'username': 'admin', 'password': 'admin'})
         assert response.status_code == 200
         access_token = response.json()['access_token']
+        assert 'desc="1 queries"' in response.headers['server-timing']
+        route_stats = sql_stats.stats()['POST /api/v1/login']
+        assert route_stats['db_time']['count'] >= 1
+        assert route_stats['checkout_wait']['count'] >= 1
+        assert any('password' in statement for statement in route_stats['queries'])
 
         response = await client.get('/api/v1/hello')
         assert response.status_code == 401
@@ -34,3 +42,17 @@ async def test_hello_to_self():
         response = await client.get('/api/v1/hello', headers={'Authorization': f'Bearer {access_token}'})
         assert response.status_code == 200
         assert response.json()['msg'] == 'Hello, admin!'
+
+
+@pytest.mark.asyncio(scope='session')
+async def test_hello_cache():
+    await redis_client.delete('response:/api/v1/hello/cached?')
+    async with async_client() as client:
+        response = await client.get('/api/v1/hello/cached')
+        assert response.json()['msg'] == 'Hello, cached!'
+        assert await redis_client.exists('response:/api/v1/hello/cached?')
+
+        cached = await client.get('/api/v1/hello/cached')
+        assert cached.content == response.content
+        assert 'server-timing' in cached.headers
+    await redis_client.delete('response:/api/v1/hello/cached?')
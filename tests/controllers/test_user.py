@@ -1,16 +1,34 @@
+import json
+from datetime import datetime, timezone
+
 import pytest
 from sqlalchemy.exc import IntegrityError
 from sqlmodel import col, delete
 
 from app.clients.mysql import get_session
+from app.clients.redis import redis_client
+from app.models.cache import drain_background_tasks
+from app.models.count import get_row_counter
 from app.models.user import User
+from app.models.validator import parse_http_date, validator_store
 from app.schemas.token import TokenPayload
 from app.schemas.user import UserRequest
+from app.utils import response as response_utils
 from app.utils.token import decode_token
 
 from . import async_client
 
 
+async def delete_other_users():
+    """Deletes the users but the admin, and resets their maintained count, which doesn't count the deleted rows."""
+    async with get_session() as session:
+        if (await session.execute(delete(User).where(col(User.id) > 1))).rowcount > 0:
+            await session.commit()
+    row_counter = get_row_counter(User)
+    assert row_counter is not None
+    await redis_client.delete(row_counter.key)
+
+
 @pytest.mark.asyncio(scope='session')
 async def test_create_user():
     async with get_session() as session:
@@ -62,9 +80,7 @@ async def test_get_user():
 
 @pytest.mark.asyncio(scope='session')
 async def test_update_user():
-    async with get_session() as session:
-        if (await session.execute(delete(User).where(col(User.id) > 1))).rowcount > 0:
-            await session.commit()
+    await delete_other_users()
 
     async with async_client() as client:
         response = await client.post('/api/v1/user', json=UserRequest(name='test', password='test').model_dump())
@@ -107,9 +123,7 @@ async def test_update_user():
 
 @pytest.mark.asyncio(scope='session')
 async def test_get_user_name():
-    async with get_session() as session:
-        if (await session.execute(delete(User).where(col(User.id) > 1))).rowcount > 0:
-            await session.commit()
+    await delete_other_users()
 
     async with async_client() as client:
         response = await client.post('/api/v1/user', json=UserRequest(name='test', password='test').model_dump())
@@ -139,9 +153,7 @@ async def test_get_user_name():
 
 @pytest.mark.asyncio(scope='session')
 async def test_set_user_name():
-    async with get_session() as session:
-        if (await session.execute(delete(User).where(col(User.id) > 1))).rowcount > 0:
-            await session.commit()
+    await delete_other_users()
 
     async with async_client() as client:
         response = await client.post('/api/v1/user', json=UserRequest(name='test', password='test').model_dump())
@@ -176,9 +188,7 @@ async def test_set_user_name():
 
 @pytest.mark.asyncio(scope='session')
 async def test_get_user_time():
-    async with get_session() as session:
-        if (await session.execute(delete(User).where(col(User.id) > 1))).rowcount > 0:
-            await session.commit()
+    await delete_other_users()
 
     async with async_client() as client:
         response = await client.post('/api/v1/user', json=UserRequest(name='test', password='test').model_dump())
@@ -220,9 +230,7 @@ async def test_get_user_time():
 
 @pytest.mark.asyncio(scope='session')
 async def test_get_user_list():
-    async with get_session() as session:
-        if (await session.execute(delete(User).where(col(User.id) > 1))).rowcount > 0:
-            await session.commit()
+    await delete_other_users()
 
     async with async_client() as client:
         response = await client.post('/api/v1/login', data={'username': 'admin', 'password': 'admin'})
@@ -245,10 +253,45 @@ async def test_get_user_list():
 
         response = await client.get('/api/v1/users', headers={'Authorization': f'Bearer {access_token}'})
         assert response.status_code == 200
-        users = response.json()['data']['users']
+        data = response.json()['data']
+        users = data['users']
         assert len(users) == 2
         user = users[1]
         assert user['name'] == 'test'
+        assert 'password' not in user
+        assert data['total'] == 2
+        assert 'next_cursor' not in data
+
+        response = await client.get('/api/v1/users?limit=1', headers={'Authorization': f'Bearer {access_token}'})
+        assert response.status_code == 200
+        data = response.json()['data']
+        assert [user['id'] for user in data['users']] == [1]
+        assert data['total'] == 2
+        next_cursor = data['next_cursor']
+
+        response = await client.get(
+            f'/api/v1/users?limit=1&cursor={next_cursor}', headers={'Authorization': f'Bearer {access_token}'}
+        )
+        assert response.status_code == 200
+        data = response.json()['data']
+        assert [user['name'] for user in data['users']] == ['test']
+        assert data['total'] == 2
+        assert 'next_cursor' not in data
+
+        response = await client.get('/api/v1/users?cursor=-', headers={'Authorization': f'Bearer {access_token}'})
+        assert response.status_code == 400
+
+        response = await client.get('/api/v1/users?export=json', headers={'Authorization': f'Bearer {access_token}'})
+        assert response.status_code == 200
+        assert response.json()['code'] == 0
+        assert [user['name'] for user in response.json()['data']['users']] == ['admin', 'test']
+
+        response = await client.get('/api/v1/users?export=ndjson', headers={'Authorization': f'Bearer {access_token}'})
+        assert response.status_code == 200
+        assert response.headers['content-type'] == 'application/x-ndjson'
+        users = [json.loads(line) for line in response.text.splitlines()]
+        assert [user['name'] for user in users] == ['admin', 'test']
+        assert users[0]['created_at'] > 0
 
         response = await client.post('/api/v1/login', data={'username': 'test', 'password': 'test'})
         assert response.status_code == 200
@@ -256,3 +299,97 @@ async def test_get_user_list():
 
         response = await client.get('/api/v1/users', headers={'Authorization': f'Bearer {access_token}'})
         assert response.status_code == 403
+
+
+@pytest.mark.asyncio(scope='session')
+async def test_user_validator(monkeypatch: pytest.MonkeyPatch):
+    async with async_client() as client:
+        response = await client.post('/api/v1/login', data={'username': 'admin', 'password': 'admin'})
+        assert response.status_code == 200
+        headers = {'Authorization': f'Bearer {response.json()["access_token"]}'}
+
+        response = await client.get('/api/v1/user/1/name', headers=headers)
+        assert response.status_code == 200
+        etag = response.headers['etag']  # a validator gives an ETag to small bodies too
+        await drain_background_tasks(1)
+
+        load_by_id = User.load_by_id
+        loads = 0
+
+        async def counting_load_by_id(*args, **kwargs):
+            nonlocal loads
+            loads += 1
+            return await load_by_id(*args, **kwargs)
+
+        monkeypatch.setattr(User, 'load_by_id', counting_load_by_id)
+        response = await client.get('/api/v1/user/1/name', headers={**headers, 'If-None-Match': etag})
+        assert response.status_code == 304
+        assert response.headers['etag'] == etag
+        assert response.content == b''
+        assert loads == 0  # answered before the endpoint ran
+
+        validator_store.cache.clear()  # recorded by another process
+        response = await client.get('/api/v1/user/1/name', headers={**headers, 'If-None-Match': etag})
+        assert response.status_code == 304
+        assert loads == 0
+
+        response = await client.get('/api/v1/user/1', headers={**headers, 'If-None-Match': etag})
+        assert response.status_code == 200  # another route
+        assert loads == 2  # of updated_at for Last-Modified, and of the user
+
+        async with get_session() as session:
+            await User.update_by_id(session, 1, {'name': 'admin'})  # a new version, even if it's the same name
+            await session.commit()
+        await drain_background_tasks(1)
+        response = await client.get('/api/v1/user/1/name', headers={**headers, 'If-None-Match': etag})
+        assert response.status_code == 304  # answered by the endpoint, since the ETag is still the same
+        assert loads == 4
+
+
+@pytest.mark.asyncio(scope='session')
+async def test_user_last_modified(monkeypatch: pytest.MonkeyPatch):
+    async with async_client() as client:
+        response = await client.post('/api/v1/login', data={'username': 'admin', 'password': 'admin'})
+        assert response.status_code == 200
+        headers = {'Authorization': f'Bearer {response.json()["access_token"]}'}
+
+        response = await client.get('/api/v1/user/1/time', headers=headers)
+        assert response.status_code == 200
+        modified_at = response.headers['last-modified']
+        assert parse_http_date(modified_at) == int(response.json()['data']['updated_at'])
+
+        get_type_adapter = response_utils.get_type_adapter
+        serializations = 0
+
+        def counting_get_type_adapter(*args, **kwargs):
+            nonlocal serializations
+            serializations += 1
+            return get_type_adapter(*args, **kwargs)
+
+        monkeypatch.setattr(response_utils, 'get_type_adapter', counting_get_type_adapter)
+        response = await client.get('/api/v1/user/1/time', headers={**headers, 'If-Modified-Since': modified_at})
+        assert response.status_code == 304
+        assert response.headers['last-modified'] == modified_at
+        assert response.content == b''
+        assert serializations == 0  # answered before the endpoint ran
+
+        response = await client.get(
+            '/api/v1/user/1/time', headers={**headers, 'If-Modified-Since': 'Thu, 01 Jan 1970 00:00:00 GMT'}
+        )
+        assert response.status_code == 200
+        response = await client.get(
+            '/api/v1/user/1/time', headers={**headers, 'If-Modified-Since': modified_at, 'If-None-Match': '"other"'}
+        )
+        assert response.status_code == 200  # If-None-Match takes precedence
+        response = await client.get('/api/v1/user/1/time', headers={**headers, 'If-Modified-Since': 'invalid'})
+        assert response.status_code == 200
+        response = await client.get('/api/v1/user/0/time', headers={**headers, 'If-Modified-Since': modified_at})
+        assert response.status_code == 404
+
+        async with get_session() as session:
+            updated_at = datetime.fromtimestamp(parse_http_date(modified_at) + 1, timezone.utc)  # type: ignore
+            await User.update_by_id(session, 1, {'updated_at': updated_at})
+            await session.commit()
+        response = await client.get('/api/v1/user/1/time', headers={**headers, 'If-Modified-Since': modified_at})
+        assert response.status_code == 200
+        assert parse_http_date(response.headers['last-modified']) == parse_http_date(modified_at) + 1  # type: ignore
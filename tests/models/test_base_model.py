@@ -1,16 +1,31 @@
+import asyncio
+
 import pytest
 from sqlalchemy import Column, Row
 from sqlalchemy.sql import text
-from sqlmodel import col
+from sqlmodel import Field, col
 
-from app.clients.mysql import get_session
+from app.clients.mysql import async_engine, async_session, get_session
+from app.clients.redis import redis_client
 from app.models import BaseModel, all_is_instance
+from app.models.cache import background_tasks, get_row_cache
+from app.models.count import get_row_counter
+from app.models.loader import BatchLoader, get_loader
 
 
 class Model(BaseModel, table=True):
     name: str
 
 
+class CachedModel(BaseModel, table=True):
+    __tablename__ = 'cached_model'  # type: ignore
+    __cache_columns__ = ('id', 'name')
+    __count_ttl__ = 60
+    __version_ttl__ = 60
+
+    name: str = Field(unique=True)
+
+
 @pytest.mark.asyncio(scope='session')
 class TestBaseModel:
     async def test_get_by_id(self):
@@ -189,6 +204,64 @@ class TestBaseModel:
             assert row1.id == 2
             assert row1.name == 'test2'
 
+    async def test_select_by_ids(self):
+        query, scalar = Model.select_by_ids(col(Model.name))
+        assert scalar
+        assert Model.select_by_ids(col(Model.name)) == (query, scalar)
+        assert Model.select_by_ids([Model.id, Model.name]) is Model.select_by_ids([Model.id, Model.name])
+        assert Model.select_by_ids(col(Model.name), for_update=True)[0] is not query
+        assert Model.select_by_ids(col(Model.name), many=True)[0] is not query
+        assert Model.select_by_ids(text('name'))[0] is not Model.select_by_ids(text('name'))[0]  # not cached
+
+    async def test_load_by_id(self):
+        async with get_session() as session:
+            await session.execute(text(f'TRUNCATE TABLE {Model.__tablename__}'))
+            session.add(Model(name='test'))
+            session.add(Model(name='test2'))
+            await session.commit()
+
+        loader = get_loader(Model, Model.name)
+        batches = loader.batches
+        names = await asyncio.gather(
+            Model.load_by_id(1, Model.name),  # type: ignore
+            Model.load_by_id(2, Model.name),  # type: ignore
+            Model.load_by_id(3, Model.name),  # type: ignore
+            Model.load_by_id(1, Model.name),  # type: ignore
+        )
+        assert names == ['test', 'test2', None, 'test']
+        assert loader.batches == batches + 1
+
+        models = await asyncio.gather(Model.load_by_id(1), Model.load_by_id(2))
+        assert all_is_instance(models, Model)
+        assert [model.name for model in models] == ['test', 'test2']
+
+        rows = await asyncio.gather(Model.load_by_id(2, (Model.id, Model.name)), Model.load_by_id(3, [Model.name]))
+        row, missing = rows
+        assert isinstance(row, Row)
+        assert row.id == 2
+        assert row.name == 'test2'
+        assert missing is None
+
+        future = asyncio.get_running_loop().create_future()
+        task = asyncio.create_task(BatchLoader(Model, Model.name).fetch({1: future}))
+        await asyncio.sleep(0)
+        task.cancel()
+        with pytest.raises(asyncio.CancelledError):
+            await task
+        assert future.cancelled()  # not left pending
+
+        task = asyncio.create_task(Model.load_by_id(1, Model.name))  # type: ignore
+        other = asyncio.create_task(Model.load_by_id(1, Model.name))  # type: ignore
+        await asyncio.sleep(0)
+        task.cancel()
+        assert await other == 'test'  # not cancelled along with the other caller
+        assert task.cancelled()
+
+        readonly_loader = get_loader(Model, Model.name, readonly=True)
+        assert readonly_loader is not loader
+        assert readonly_loader.readonly and not loader.readonly
+        assert await Model.load_by_id(2, Model.name, readonly=True) == 'test2'
+
     async def test_exist(self):
         async with get_session() as session:
             await session.execute(text(f'TRUNCATE TABLE {Model.__tablename__}'))
@@ -294,6 +367,48 @@ class TestBaseModel:
             assert row1.id == 2
             assert row1.name == 'test2'
 
+    async def test_stream_all(self):
+        async with get_session() as session:
+            await session.execute(text(f'TRUNCATE TABLE {Model.__tablename__}'))
+
+            assert [rows async for rows in Model.stream_all(session)] == []
+
+            await Model.batch_insert(session, [{'name': 'test'}, {'name': 'test2'}, {'name': 'test3'}])
+            await session.commit()
+
+            chunks = [models async for models in Model.stream_all(session, chunk_size=2)]
+            assert [len(models) for models in chunks] == [2, 1]
+            assert all_is_instance(chunks[0], Model)
+            assert [model.name for models in chunks for model in models] == ['test', 'test2', 'test3']
+
+            chunks = [names async for names in Model.stream_all(session, Model.name)]  # type: ignore
+            assert chunks == [['test', 'test2', 'test3']]
+
+            chunks = [rows async for rows in Model.stream_all(session, (Model.id, Model.name), 2)]
+            assert [tuple(row) for rows in chunks for row in rows] == [(1, 'test'), (2, 'test2'), (3, 'test3')]
+
+    async def test_get_page(self):
+        async with get_session() as session:
+            await session.execute(text(f'TRUNCATE TABLE {Model.__tablename__}'))
+
+            assert await Model.get_page(session) == []
+
+            await Model.batch_insert(session, [{'name': 'test'}, {'name': 'test2'}, {'name': 'test3'}])
+            await session.commit()
+
+            models = await Model.get_page(session, limit=2)
+            assert all_is_instance(models, Model)
+            assert [model.id for model in models] == [1, 2]
+
+            names = await Model.get_page(session, 2, 2, Model.name)  # type: ignore
+            assert names == ['test3']
+
+            rows = await Model.get_page(session, 1, columns=(Model.id, Model.name))
+            assert all_is_instance(rows, Row)
+            assert [tuple(row) for row in rows] == [(2, 'test2'), (3, 'test3')]
+
+            assert await Model.get_page(session, 3) == []
+
     async def test_count_all(self):
         async with get_session() as session:
             await session.execute(text(f'TRUNCATE TABLE {Model.__tablename__}'))
@@ -308,6 +423,9 @@ class TestBaseModel:
             count = await Model.count_all(session)
             assert count == 2
 
+            assert await Model.count_all(session, max_count=1) == 1
+            assert await Model.count_all(session, max_count=3) == 2
+
     async def test_update_by_id(self):
         async with get_session() as session:
             await session.execute(text(f'TRUNCATE TABLE {Model.__tablename__}'))
@@ -323,10 +441,41 @@ class TestBaseModel:
             name = await Model.get_by_id(session, 1, col(Model.name))
             assert name == 'test2'
 
+            model = await Model.get_by_id(session, 1)
+            assert isinstance(model, Model)
+            count = await Model.update_by_id(session, 1, {'name': 'test3'})
+            assert count == 1
+            assert model.name == 'test3'  # the loaded instance is updated too
+
+            count = await Model.update_by_id(session, 1, {'name': col(Model.name) + '4'})
+            assert count == 1
+            name = await Model.get_by_id(session, 1, col(Model.name))
+            assert name == 'test34'
+            count = await Model.update_by_id(session, 1, {'name': 'test3'})
+            assert count == 1
+
             count = await Model.update_by_id(session, 1, {Model.id.name: 2})  # type: ignore
             assert count == 1
             name = await Model.get_by_id(session, 2, col(Model.name))
-            assert name == 'test2'
+            assert name == 'test3'
+
+    async def test_update_by_ids(self):
+        async with get_session() as session:
+            await session.execute(text(f'TRUNCATE TABLE {Model.__tablename__}'))
+            await Model.batch_insert(session, [{'name': 'test'}, {'name': 'test2'}, {'name': 'test3'}])
+
+            assert await Model.update_by_ids(session, {}) == 0
+            row_count = await Model.update_by_ids(
+                session, {3: {'name': 'test6'}, 1: {'name': 'test4'}, 4: {'name': 'test7'}}, batch_size=2
+            )
+            assert row_count == 2
+            assert await Model.get_by_ids(session, (1, 2, 3), Model.name) == ['test4', 'test2', 'test6']  # type: ignore
+
+            assert await Model.update_by_ids(session, {1: {}, 2: {'name': 'test5'}}) == 1
+            assert await Model.get_by_ids(session, (1, 2, 3), Model.name) == ['test4', 'test5', 'test6']  # type: ignore
+
+            with pytest.raises(ValueError):
+                await Model.update_by_ids(session, {1: {'id': 5}})
 
     async def test_delete_by_id(self):
         async with get_session() as session:
@@ -408,3 +557,255 @@ class TestBaseModel:
             assert model2.name == 'test3'
             assert model3.id == 4
             assert model3.name == 'test4'
+
+    async def test_bulk_insert(self):
+        async with get_session() as session:
+            await session.execute(text(f'TRUNCATE TABLE {Model.__tablename__}'))
+
+            result = await Model.bulk_insert(session, [{'name': f'test{i}'} for i in range(5)], max_batch_size=2)
+            assert result.row_count == 5
+            assert result.id_ranges == [(1, 2), (3, 4), (5, 5)]
+            assert list(result.ids) == [1, 2, 3, 4, 5]
+
+            result = await Model.bulk_insert(session, [(1, 'ignored'), (6, 'test5')], on_duplicate='ignore')
+            assert result.row_count == 1
+            assert result.id_ranges == []
+
+            result = await Model.bulk_insert(
+                session, [(2, 'updated'), (7, 'test6')], on_duplicate='update', update_columns=('name',)
+            )
+            assert result.row_count == 3  # MySQL counts an updated row as 2
+            names = await Model.get_by_ids(session, (1, 2, 7), Model.name)  # type: ignore
+            assert names == ['test0', 'updated', 'test6']
+            await session.commit()
+
+            result = await Model.bulk_insert(
+                session, [{'name': f'test{i}'} for i in range(8, 18)], max_batch_size=2, concurrency=3
+            )
+            assert result.row_count == 10
+            assert list(result.ids) == list(range(8, 18))
+            assert await Model.count_all(session) == 17
+
+
+@pytest.mark.asyncio(scope='session')
+class TestCachedModel:
+    async def truncate(self, session):
+        await session.execute(text(f'TRUNCATE TABLE {CachedModel.__tablename__}'))
+        await self.clear_cache()
+
+    async def clear_cache(self):
+        await asyncio.gather(*background_tasks)  # wait for the invalidations after commit
+        keys = await redis_client.keys('row:cached_model:*')
+        if keys:
+            await redis_client.delete(*keys)
+
+    async def test_get_by_id(self):
+        row_cache = get_row_cache(CachedModel)
+        assert row_cache is not None
+
+        async with get_session() as session:
+            await self.truncate(session)
+
+            assert await CachedModel.get_by_id(session, 1, CachedModel.name) is None  # type: ignore
+            assert await redis_client.get('row:cached_model:1') == b'null'
+
+            await CachedModel.insert(session, {'name': 'test'})
+            await session.commit()
+
+            hits = row_cache.hits
+            name = await CachedModel.get_by_id(session, 1, CachedModel.name)  # type: ignore
+            assert name == 'test'
+            assert row_cache.hits == hits
+
+            await redis_client.delete('row:cached_model:1')  # drop the tombstone written by insert
+            name = await CachedModel.get_by_id(session, 1, CachedModel.name)  # type: ignore
+            assert name == 'test'
+            name = await CachedModel.get_by_id(session, 1, col(CachedModel.name))
+            assert name == 'test'
+            assert row_cache.hits == hits + 1
+
+            row = await CachedModel.get_by_id(session, 1, (CachedModel.id, CachedModel.name))
+            assert isinstance(row, Row)
+            assert row.id == 1
+            assert row.name == 'test'
+            assert row_cache.hits == hits + 2
+
+            model = await CachedModel.get_by_id(session, 1)  # whole models are not cached
+            assert isinstance(model, CachedModel)
+            name = await CachedModel.get_by_id(session, 1, CachedModel.name, for_update=True)  # type: ignore
+            assert name == 'test'
+            assert row_cache.hits == hits + 2
+
+    async def test_get_by_id_from_replica(self):
+        async with get_session() as session:
+            await self.truncate(session)
+            await CachedModel.insert(session, {'name': 'test'})
+            await session.commit()
+        await self.clear_cache()
+
+        async with async_session(replica=async_engine.sync_engine) as session:  # the primary stands in for a replica
+            assert await CachedModel.get_by_id(session, 1, CachedModel.name) == 'test'  # type: ignore
+            assert await redis_client.get('row:cached_model:1') is None  # may be stale, so not cached
+
+            await CachedModel.update_by_id(session, 1, {'name': 'test2'})  # reads from the primary from now on
+            await session.commit()
+            await self.clear_cache()
+            assert await CachedModel.get_by_id(session, 1, CachedModel.name) == 'test2'  # type: ignore
+            assert await redis_client.get('row:cached_model:1') == b'[1,"test2"]'
+
+    async def test_get_by_id_uncommitted(self):
+        async with get_session() as session:
+            await self.truncate(session)
+            await CachedModel.insert(session, {'name': 'test'})
+            await session.commit()
+            await self.clear_cache()
+
+            await CachedModel.update_by_id(session, 1, {'name': 'test2'})
+            await redis_client.delete('row:cached_model:1')  # the tombstone expired before the commit
+            assert await CachedModel.get_by_id(session, 1, CachedModel.name) == 'test2'  # type: ignore
+            assert await redis_client.get('row:cached_model:1') is None  # not committed, so not cached
+            await session.rollback()
+
+            assert await CachedModel.get_by_id(session, 1, CachedModel.name) == 'test'  # type: ignore
+            assert await redis_client.get('row:cached_model:1') == b'[1,"test"]'
+
+    async def test_get_many_cancelled(self):
+        row_cache = get_row_cache(CachedModel)
+        assert row_cache is not None
+        await self.clear_cache()
+        started = asyncio.Event()
+
+        async def slow_load(ids: list[int]) -> dict[int, tuple]:
+            started.set()
+            await asyncio.sleep(0.1)
+            return {id: (id, 'slow') for id in ids}
+
+        async def load(ids: list[int]) -> dict[int, tuple]:
+            return {id: (id, 'test') for id in ids}
+
+        loading = asyncio.create_task(row_cache.get_many([1], slow_load))
+        await started.wait()
+        waiting = asyncio.create_task(row_cache.get_many([1], load))
+        await asyncio.sleep(0.01)  # waiting for the load of the first caller
+        loading.cancel()
+        assert await waiting == {1: (1, 'test')}  # loaded again rather than cancelled
+        with pytest.raises(asyncio.CancelledError):
+            await loading
+
+        await self.clear_cache()
+        started.clear()
+        loading = asyncio.create_task(row_cache.get_many([2], slow_load))
+        await started.wait()
+        waiting = asyncio.create_task(row_cache.get_many([2], load))
+        await asyncio.sleep(0.01)
+        waiting.cancel()
+        assert await loading == {2: (2, 'slow')}  # not cancelled by the waiting caller
+        with pytest.raises(asyncio.CancelledError):
+            await waiting
+        await self.clear_cache()
+
+    async def test_get_by_ids(self):
+        async with get_session() as session:
+            await self.truncate(session)
+            await CachedModel.batch_insert(session, [{'name': 'test'}, {'name': 'test2'}])
+            await session.commit()
+            await self.clear_cache()  # the inserted ids are invalidated
+
+            names = await CachedModel.get_by_ids(session, (3, 2, 1), CachedModel.name)  # type: ignore
+            assert names == ['test', 'test2']
+            cached = await redis_client.mget(['row:cached_model:1', 'row:cached_model:2', 'row:cached_model:3'])
+            assert cached == [b'[1,"test"]', b'[2,"test2"]', b'null']
+
+            rows = await CachedModel.get_by_ids(session, (2, 1), (CachedModel.id, CachedModel.name))
+            assert all_is_instance(rows, Row)
+            assert [tuple(row) for row in rows] == [(1, 'test'), (2, 'test2')]
+
+    async def test_count_all(self):
+        row_counter = get_row_counter(CachedModel)
+        assert row_counter is not None
+
+        async with get_session() as session:
+            await self.truncate(session)
+            await redis_client.delete(row_counter.key)
+            await CachedModel.batch_insert(session, [{'name': 'test'}, {'name': 'test2'}])
+            await session.commit()
+            await asyncio.gather(*background_tasks)
+
+            assert await CachedModel.count_all(session, mode='maintained') == 2
+            assert await redis_client.get(row_counter.key) == b'2'
+            assert await CachedModel.count_all(session, mode='approximate') >= 0
+
+            await CachedModel.insert(session, {'name': 'test3'})
+            session.add(CachedModel(name='test4'))
+            await session.flush()
+            assert await CachedModel.count_all(session, mode='maintained') == 2  # not committed yet
+            await session.commit()
+            await asyncio.gather(*background_tasks)
+            assert await CachedModel.count_all(session, mode='maintained') == 4
+            assert await CachedModel.count_all(session, max_count=3, mode='maintained') == 3
+
+            await CachedModel.delete_by_ids(session, (1, 2))
+            await session.rollback()
+            await CachedModel.delete_by_id(session, 1)
+            await session.commit()
+            await asyncio.gather(*background_tasks)
+            assert await CachedModel.count_all(session, mode='maintained') == 3
+
+            await CachedModel.bulk_insert(session, [(1, 'test5')], on_duplicate='update', update_columns=('name',))
+            await session.commit()
+            await asyncio.gather(*background_tasks)
+            assert await redis_client.get(row_counter.key) is None  # reconciled by the next count
+            assert await CachedModel.count_all(session, mode='maintained') == 4
+            assert row_counter.stats() == {'hits': 4, 'misses': 2}
+
+    async def test_invalidation(self):
+        async with get_session() as session:
+            await self.truncate(session)
+            await CachedModel.batch_insert(session, [{'name': 'test'}, {'name': 'test2'}, {'name': 'test3'}])
+            await session.commit()
+            names = await CachedModel.get_by_ids(session, (1, 2, 3), CachedModel.name)  # type: ignore
+            assert names == ['test', 'test2', 'test3']
+
+            assert await CachedModel.update_by_id(session, 1, {'name': 'test4'}) == 1
+            assert await CachedModel.get_by_id(session, 1, CachedModel.name) == 'test4'  # type: ignore
+            await session.commit()
+            assert await CachedModel.get_by_id(session, 1, CachedModel.name) == 'test4'  # type: ignore
+
+            assert await CachedModel.update_by_ids(session, {1: {'name': 'test5'}, 3: {'name': 'test6'}}) == 2
+            assert await CachedModel.get_by_ids(session, (1, 3), CachedModel.name) == ['test5', 'test6']  # type: ignore
+            await session.commit()
+            assert await CachedModel.get_by_ids(session, (1, 3), CachedModel.name) == ['test5', 'test6']  # type: ignore
+
+            assert await CachedModel.delete_by_id(session, 2) == 1
+            assert await CachedModel.get_by_id(session, 2, CachedModel.name) is None  # type: ignore
+
+            assert await CachedModel.delete_by_ids(session, (1, 3)) == 2
+            assert await CachedModel.get_by_ids(session, (1, 2, 3), CachedModel.name) == []  # type: ignore
+            await session.commit()
+
+    async def test_bulk_insert_invalidation(self):
+        async with get_session() as session:
+            await self.truncate(session)
+            await redis_client.delete('version:cached_model:1', 'version:cached_model:2')
+            await CachedModel.bulk_insert(session, [(1, 'test')])
+            await session.commit()
+            await asyncio.gather(*background_tasks)
+            assert await redis_client.get('version:cached_model:1') == b'1'
+            assert await CachedModel.get_by_id(session, 1, CachedModel.name) == 'test'  # type: ignore
+
+            await CachedModel.bulk_insert(session, [(1, 'test2')], on_duplicate='update', update_columns=('name',))
+            await session.commit()
+            await asyncio.gather(*background_tasks)
+            assert await redis_client.get('version:cached_model:1') == b'2'
+            assert await CachedModel.get_by_id(session, 1, CachedModel.name) == 'test2'  # type: ignore
+
+            await CachedModel.bulk_insert(session, [(2, 'test3')], concurrency=2)
+            await asyncio.gather(*background_tasks)
+            assert await redis_client.get('version:cached_model:2') == b'1'
+
+            await CachedModel.bulk_insert(
+                session, [{'name': 'test3'}, {'name': 'test4'}], on_duplicate='update', update_columns=('name',)
+            )
+            await session.commit()
+            await asyncio.gather(*background_tasks)
+            assert await redis_client.get('version:cached_model:2') == b'2'  # found by name
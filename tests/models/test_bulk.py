@@ -0,0 +1,73 @@
+from datetime import datetime
+
+from sqlalchemy import Column, Integer, MetaData, String, Table, UniqueConstraint, insert
+from sqlalchemy.dialects import mysql
+
+from app.models.bulk import (
+    BulkInsertResult,
+    chunk_rows,
+    estimate_row_size,
+    estimate_size,
+    has_explicit_ids,
+    match_unique_keys,
+    unique_keys,
+)
+
+
+def test_estimate_size():
+    assert estimate_size(None) == 4
+    assert estimate_size('abc') == 9
+    assert estimate_size('测试') == 11
+    assert estimate_size(b'ab') == 7
+    assert estimate_size(123) == 4
+    assert estimate_size(datetime.now()) == 29
+    assert estimate_row_size({'id': None, 'name': 'abc'}) == estimate_row_size((None, 'abc')) == 16
+
+
+def test_chunk_rows():
+    rows = [{'name': 'a' * 49}] * 10  # 104 bytes per row
+    assert [len(chunk) for chunk in chunk_rows(rows, 1024 + 300, 1000)] == [2, 2, 2, 2, 2]
+    assert [len(chunk) for chunk in chunk_rows(rows, 1024 + 300, 3)] == [2, 2, 2, 2, 2]
+    assert [len(chunk) for chunk in chunk_rows(rows, 1024 * 1024, 3)] == [3, 3, 3, 1]
+    assert [len(chunk) for chunk in chunk_rows(rows, 0, 1000)] == [1] * 10  # oversized rows are sent alone
+    assert list(chunk_rows([], 1024 * 1024, 1000)) == []
+
+    table = Table('quoted', MetaData(), Column('name', String(1000)))
+    rows = [{'name': "'" * 500}, {'name': '\\' * 500}] * 5  # doubled when they're escaped
+    max_packet_size = 1024 + 2100
+    chunks = list(chunk_rows(rows, max_packet_size, 1000))
+    assert [len(chunk) for chunk in chunks] == [2, 2, 2, 2, 2]
+    for chunk in chunks:
+        statement = insert(table).values(chunk).compile(dialect=mysql.dialect(), compile_kwargs={'literal_binds': True})
+        assert 2000 < len(str(statement)) <= max_packet_size  # near the limit, but within it
+
+
+def test_has_explicit_ids():
+    assert not has_explicit_ids([{'name': 'a'}, {'id': None, 'name': 'b'}, (None, 'c')])
+    assert has_explicit_ids([{'name': 'a'}, {'id': 1, 'name': 'b'}])
+    assert has_explicit_ids([(None, 'a'), (2, 'b')])
+
+
+def test_bulk_insert_result():
+    assert list(BulkInsertResult(5, [(1, 2), (5, 7)]).ids) == [1, 2, 5, 6, 7]
+
+
+def test_match_unique_keys():
+    table = Table(
+        'test_unique',
+        MetaData(),
+        Column('id', Integer, primary_key=True),
+        Column('name', String(32), unique=True),
+        Column('a', Integer),
+        Column('b', Integer),
+        UniqueConstraint('a', 'b'),
+    )
+    keys = unique_keys(table)
+    assert sorted(keys) == [('a', 'b'), ('name',)]
+    condition = match_unique_keys(table, keys, [{'name': 'x', 'a': 1}, {'name': 'y', 'a': 2, 'b': 3}])
+    assert condition is not None
+    assert sorted(condition.compile().params.values(), key=str) == [['x', 'y'], [(2, 3)]]
+    condition = match_unique_keys(table, [('name',)], [(None, 'x'), (None, 'y')])
+    assert condition is not None
+    assert list(condition.compile().params.values()) == [['x', 'y']]
+    assert match_unique_keys(table, keys, [{'id': 1}]) is None
@@ -0,0 +1,67 @@
+import asyncio
+
+import pytest
+
+from app.clients.redis import AutoPipeline, redis_client
+from app.models.counter import HotCounter
+
+
+@pytest.mark.asyncio(scope='session')
+class TestHotCounter:
+    async def test_single(self):
+        counter = HotCounter(AutoPipeline(redis_client, 100, 0), 'test:counter', 1)
+        await redis_client.delete(*counter.keys)
+        try:
+            assert [await counter.incr() for _ in range(3)] == [1, 2, 3]
+            values = await asyncio.gather(*(counter.incr() for _ in range(10)))
+            assert sorted(values) == list(range(4, 14))  # exact, like INCR
+            assert counter.task is None  # nothing to refresh
+            assert await counter.get() == 13
+        finally:
+            await counter.close()
+        await redis_client.delete(*counter.keys)
+
+    async def test_sharded(self):
+        counter = HotCounter(AutoPipeline(redis_client, 100, 0), 'test:counter', 4, refresh_interval=10)
+        await redis_client.delete(*counter.keys)
+        try:
+            assert [await counter.incr() for _ in range(10)] == list(range(1, 11))
+            values = await asyncio.gather(*(counter.incr() for _ in range(10)))  # sent in one pipeline
+            assert min(values) > 10
+            assert max(values) == 20
+            assert await counter.get() == 20
+            assert sum(int(value or 0) for value in await redis_client.mget(counter.keys)) == 20
+
+            other_counter = HotCounter(redis_client, 'test:counter', 4, refresh_interval=10)
+            assert await other_counter.incr() == 21  # the keys are read on the first increment
+            await other_counter.close()
+            assert await counter.incr() in (21, 22)  # the increment of the other process may not be seen yet
+            await counter.refresh()
+            assert await counter.incr() == 23
+        finally:
+            await counter.close()
+        await redis_client.delete(*counter.keys)
+
+    async def test_local(self):
+        counter = HotCounter(redis_client, 'test:counter', 4, local=True, flush_interval=10, flush_size=3, lease_size=5)
+        await redis_client.delete(*counter.keys, 'test:counter:lease')
+        await redis_client.set('test:counter', 10)
+        try:
+            assert [await counter.incr() for _ in range(2)] == [11, 12]  # leased from the count
+            assert counter.pending == 2
+            assert await counter.get() == 12
+
+            await counter.incr()  # flushed by the size
+            await asyncio.sleep(0.01)
+            assert counter.pending == 0
+            assert counter.flushes == 1
+
+            other_counter = HotCounter(redis_client, 'test:counter', 4, local=True, lease_size=5)
+            assert await other_counter.incr() == 16  # from the next range
+            await other_counter.close()
+            assert [await counter.incr() for _ in range(3)] == [14, 15, 21]
+        finally:
+            await counter.close()
+        assert counter.pending == 0
+        assert await counter.get() == 10 + 7
+        await redis_client.delete(*counter.keys, 'test:counter:lease')
@@ -0,0 +1,96 @@
+import pytest
+from sqlalchemy.sql import text
+
+from app.clients.mysql import ShardedSession, async_session, get_session, shard_of_key
+from app.clients.redis import redis_client
+from app.models.shard import IdAllocator, allocate_id, get_id_allocator
+
+from .test_base_model import Model
+
+
+@pytest.mark.asyncio(scope='session')
+class TestShard:
+    async def test_id_allocator(self):
+        await redis_client.delete('id:test')
+        allocator = IdAllocator(redis_client, 'id:test', 3)
+        assert [await allocator.allocate() for _ in range(4)] == [1, 2, 3, 4]
+        assert await redis_client.get('id:test') == b'6'
+
+        other_allocator = IdAllocator(redis_client, 'id:test', 3)
+        assert await other_allocator.allocate() == 7
+        assert await allocator.allocate() == 5
+
+    async def test_allocate_id(self, monkeypatch):
+        session = ShardedSession([async_session, async_session])
+        allocator = get_id_allocator(Model)
+        try:
+            monkeypatch.setattr(Model, '__shard_key__', 'name')
+            await redis_client.set('id:model', 10)
+            allocator.end_id = 0  # drop the reserved ids
+            for name in ('a', 'b', 'c', 'd'):
+                id = await allocate_id(Model, {'name': name}, session)
+                assert id % 2 == shard_of_key(name, 2)
+            monkeypatch.undo()
+
+            await redis_client.set('id:model', 10)
+            allocator.end_id = 0
+            assert await allocate_id(Model, {'name': 'test'}, session) == 11
+
+            async with get_session() as plain_session:
+                await plain_session.execute(text(f'TRUNCATE TABLE {Model.__tablename__}'))
+                await Model.insert(plain_session, {'id': 5, 'name': 'test'})
+                await plain_session.commit()
+            await redis_client.delete('id:model')
+            allocator.end_id = 0
+            allocator.initialized = False
+            assert await allocate_id(Model, {'name': 'test'}, session) == 6  # initialized from the last id
+            assert allocator.initialized
+        finally:
+            await session.close()
+
+    async def test_sharded_session(self):
+        async with get_session() as session:
+            await session.execute(text(f'TRUNCATE TABLE {Model.__tablename__}'))
+            await session.commit()
+        await redis_client.set('id:model', 0)
+        get_id_allocator(Model).end_id = 0
+
+        # both shards are the same database here, so only the queries by id see the right rows
+        session = ShardedSession([async_session, async_session])
+        try:
+            assert await Model.insert(session, {'name': 'test'}) == 1
+            assert await Model.insert(session, {'name': 'test2'}) == 2
+            assert await Model.insert(session, {'id': 3, 'name': 'test3'}) == 3
+            assert len(session.sessions) == 2
+            await session.commit()
+
+            assert await Model.get_by_id(session, 2, Model.name) == 'test2'  # type: ignore
+            assert await Model.exist(session, 3)
+            assert await Model.get_by_ids(session, (3, 1, 2), Model.name) == ['test', 'test3', 'test2']  # type: ignore
+            assert await Model.get_by_ids(session, (3, 1, 2), Model.id) == [1, 2, 3]  # type: ignore
+            models = await Model.get_by_ids(session, (3, 1, 2))
+            assert [model.id for model in models] == [1, 2, 3]
+            assert [row.id for row in await Model.get_all(session, (Model.id, Model.name))] == [1, 1, 2, 2, 3, 3]
+            assert await Model.count_all(session) == 6
+            assert await Model.count_all(session, max_count=4) == 4
+            rows = await Model.get_page(session, 1, 3, (Model.id, Model.name))
+            assert [row.id for row in rows] == [2, 2, 3]
+            with pytest.raises(ValueError):
+                await Model.get_page(session, 0, 2, Model.name)
+            assert [id async for ids in Model.stream_all(session, Model.id) for id in ids] == [1, 2, 3, 1, 2, 3]
+            assert await Model.update_by_ids(session, {1: {'name': 'test5'}, 2: {'name': 'test6'}}) == 2
+
+            assert await Model.update_by_id(session, 1, {'name': 'test4'}) == 1
+            with pytest.raises(ValueError):
+                await Model.update_by_id(session, 1, {'id': 4})
+            assert await Model.delete_by_ids(session, (1, 2)) == 2
+            assert await Model.delete_by_id(session, 3) == 1
+            await session.commit()
+            assert await Model.get_by_ids(session, (1, 2, 3)) == []
+
+            result = await Model.bulk_insert(session, [{'name': 'test7'}, {'name': 'test8'}])
+            assert result.row_count == 2
+            await session.commit()
+            assert await Model.get_by_ids(session, (3, 4), Model.id) == [3, 4]  # type: ignore
+        finally:
+            await session.close()
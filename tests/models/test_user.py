@@ -1,9 +1,12 @@
 import pytest
 from argon2.exceptions import VerifyMismatchError
+from sqlalchemy.exc import IntegrityError
 from sqlmodel import col, delete
 
-from app.clients.mysql import get_session
-from app.models.user import User, get_current_user_id
+from app.clients.mysql import ShardedSession, async_session, get_session
+from app.clients.redis import redis_client
+from app.models.shard import get_id_allocator
+from app.models.user import User, UserName, get_current_user_id, token_cache
 from app.utils.exception import HTTPError
 
 
@@ -31,6 +34,17 @@ class TestUser:
         with pytest.raises(VerifyMismatchError):
             User.verify_password(hashed_password1, password3)
 
+    @pytest.mark.asyncio(scope='session')
+    async def test_async_hash_and_verify_password(self):
+        password = '123'
+        hashed_password = await User.async_hash_password(password)
+        assert len(hashed_password) == 66
+        assert await User.async_verify_password(hashed_password, password)
+        assert User.verify_password(hashed_password, password)
+
+        with pytest.raises(VerifyMismatchError):
+            await User.async_verify_password(hashed_password, '')
+
     @pytest.mark.asyncio(scope='session')
     async def test_get_verified_user_id(self):
         async with get_session() as session:
@@ -62,15 +76,76 @@ class TestUser:
             assert await User.delete_by_name(session, 'test') == 1
             assert await User.delete_by_name(session, 'test') == 0
 
+    @pytest.mark.asyncio(scope='session')
+    async def test_sharded_user(self):
+        async with get_session() as session:
+            await session.execute(delete(User).where(col(User.id) > 1))
+            await session.execute(delete(UserName))
+            await session.commit()
+        await redis_client.delete('id:user')
+        allocator = get_id_allocator(User)
+        allocator.end_id = 0
+        allocator.initialized = False
+        password = User.hash_password('123')
+
+        session = ShardedSession([async_session, async_session])
+        try:
+            id = await User.insert(session, {'name': 'test', 'password': password})
+            assert id == 2
+            await session.commit()
+            assert await User.get_id_by_name(session, 'test') == id
+            assert await User.get_verified_user_id(session, 'test', '123') == id
+            assert await User.get_verified_user_id(session, 'test', '456') == 0
+            assert await User.get_verified_user_id(session, 'test2', '123') == 0
+
+            other_session = ShardedSession([async_session, async_session])
+            try:
+                with pytest.raises(IntegrityError):
+                    await User.insert(other_session, {'name': 'test', 'password': password})
+                assert not other_session.sessions  # rejected by the index before any shard is written
+                await other_session.rollback()
+            finally:
+                await other_session.close()
+
+            assert await User.update_by_id(session, id, {'name': 'test2'}) == 1
+            await session.commit()
+            assert await User.get_verified_user_id(session, 'test', '123') == 0
+            assert await User.get_verified_user_id(session, 'test2', '123') == id
+
+            rows = [{'name': 'test3', 'password': password}, {'name': 'test4', 'password': password}]
+            result = await User.bulk_insert(session, rows)
+            assert result.row_count == 2
+            await session.commit()
+            id3 = await User.get_id_by_name(session, 'test3')
+            id4 = await User.get_id_by_name(session, 'test4')
+            assert id3 and id4 and id3 != id4
+            with pytest.raises(ValueError):
+                await User.bulk_insert(session, [{'name': 'test3', 'password': password}], on_duplicate='ignore')
+
+            assert await User.update_by_ids(session, {id3: {'name': 'test5'}}) == 1
+            assert await User.delete_by_name(session, 'test2') == 1
+            assert await User.delete_by_ids(session, [id4]) == 1
+            await session.commit()
+            assert await User.get_id_by_name(session, 'test2') is None
+            assert await User.get_id_by_name(session, 'test4') is None
+            assert await User.get_id_by_name(session, 'test5') == id3
+        finally:
+            await session.close()
+
 
-def test_get_current_user_id():
+@pytest.mark.asyncio(scope='session')
+async def test_get_current_user_id():
     with pytest.raises(HTTPError):
-        get_current_user_id('')
+        await get_current_user_id('')
     with pytest.raises(HTTPError):
-        get_current_user_id('1')
+        await get_current_user_id('1')
 
     token = User.generate_token(1)
-    assert get_current_user_id(token) == 1
+    assert await get_current_user_id(token) == 1
 
     token = User.generate_token(2)
-    assert get_current_user_id(token) == 2
+    hits = token_cache.hits
+    assert await get_current_user_id(token) == 2
+    assert token_cache.hits == hits
+    assert await get_current_user_id(token) == 2
+    assert token_cache.hits == hits + 1
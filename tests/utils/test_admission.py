@@ -0,0 +1,83 @@
+import asyncio
+
+import pytest
+
+from app.utils.admission import (
+    Admission,
+    Priority,
+    RequestAdmission,
+    current_admission,
+    priority,
+    request_admission,
+)
+from app.utils.exception import HTTPError
+
+
+@pytest.mark.asyncio(scope='session')
+async def test_admission():
+    admission = Admission(1, 2)
+    loop = asyncio.get_running_loop()
+    deadline = loop.time() + 10
+    await admission.acquire(Priority.NORMAL, deadline)
+    assert admission.in_use == 1
+
+    admitted = []
+
+    async def acquire(name: str, level: int) -> None:
+        await admission.acquire(level, deadline)
+        admitted.append(name)
+
+    low = asyncio.create_task(acquire('low', Priority.LOW))
+    normal = asyncio.create_task(acquire('normal', Priority.NORMAL))
+    await asyncio.sleep(0)
+    assert admission.waiting == 2
+
+    high = asyncio.create_task(acquire('high', Priority.HIGH))  # the queue is full, so the low one is rejected
+    await asyncio.sleep(0)
+    with pytest.raises(HTTPError) as exc_info:
+        await low
+    assert exc_info.value.status_code == 503
+    with pytest.raises(HTTPError):
+        await admission.acquire(Priority.LOW, deadline)  # rejected itself
+    assert admission.rejected == 2
+
+    admission.release()
+    await high
+    assert admitted == ['high']
+    admission.release()
+    await normal
+    assert admitted == ['high', 'normal']
+    assert admission.in_use == 1
+    admission.release()
+    assert admission.in_use == 0
+    assert admission.waiting == 0
+
+
+@pytest.mark.asyncio(scope='session')
+async def test_admission_deadline():
+    admission = Admission(1, 10)
+    loop = asyncio.get_running_loop()
+    await admission.acquire(Priority.NORMAL, loop.time() + 10)
+    with pytest.raises(HTTPError) as exc_info:
+        await admission.acquire(Priority.HIGH, loop.time() + 0.01)
+    assert exc_info.value.headers == {'Retry-After': '1'}
+    with pytest.raises(HTTPError):
+        await admission.acquire(Priority.HIGH, loop.time() - 1)  # already passed
+    assert admission.timeouts == 2
+    assert admission.waiting == 0
+
+    admission.release()
+    assert admission.in_use == 0  # not handed to the waiter which timed out
+    stats = admission.stats()
+    assert stats['wait_time']['count'] == 1
+
+
+@pytest.mark.asyncio(scope='session')
+async def test_priority():
+    assert current_admission()[0] == Priority.NORMAL
+    token = request_admission.set(RequestAdmission(Priority.NORMAL, 1.0))
+    try:
+        await priority(Priority.LOW)()
+        assert current_admission() == (Priority.LOW, 1.0)
+    finally:
+        request_admission.reset(token)
@@ -0,0 +1,64 @@
+from app.utils.cache import LRUCache
+
+
+def test_lru_cache():
+    cache: LRUCache[str, int] = LRUCache(2)
+    assert cache.get('a') is None
+    assert cache.misses == 1
+
+    cache.set('a', 1)
+    cache.set('b', 2)
+    assert cache.get('a') == 1
+    assert cache.hits == 1
+
+    cache.set('c', 3)  # 'b' is the least recently used one
+    assert cache.evictions == 1
+    assert 'b' not in cache
+    assert cache.get('a') == 1
+    assert cache.get('c') == 3
+    assert len(cache) == 2
+
+    assert cache.pop('a') == 1
+    assert cache.pop('a') is None
+    cache.clear()
+    assert len(cache) == 0
+
+
+def test_lru_cache_expiration():
+    now = 100.0
+    cache: LRUCache[str, int] = LRUCache(10, ttl=10, timer=lambda: now)
+
+    cache.set('a', 1)
+    cache.set('b', 2, expire_at=105)
+    cache.set('c', 3, expire_at=200)  # capped by ttl
+    assert cache.get('a') == 1
+    assert cache.get('b') == 2
+
+    now = 105
+    assert cache.get('a') == 1
+    assert cache.get('b') is None
+    assert cache.expirations == 1
+
+    now = 110
+    assert cache.get('a') is None
+    assert cache.get('c') is None
+    assert cache.stats() == {'size': 0, 'bytes': 0, 'hits': 3, 'misses': 3, 'evictions': 0, 'expirations': 3}
+
+
+def test_lru_cache_maxbytes():
+    cache: LRUCache[str, bytes] = LRUCache(10, maxbytes=10)
+    cache.set('a', b'aaaa', size=4)
+    cache.set('b', b'bbbb', size=4)
+    assert cache.bytes == 8
+
+    cache.set('a', b'aaaaaa', size=6)  # replacing an entry updates its size
+    assert cache.bytes == 10
+    assert cache.evictions == 0
+
+    cache.set('c', b'c', size=1)  # 'b' is the least recently used one
+    assert cache.evictions == 1
+    assert 'b' not in cache
+    assert cache.bytes == 7
+
+    cache.pop('a')
+    assert cache.bytes == 1
@@ -0,0 +1,142 @@
+import gzip
+from types import SimpleNamespace
+from typing import AsyncIterator
+
+import brotli
+import zstandard
+from starlette.applications import Starlette
+from starlette.requests import Request
+from starlette.responses import Response, StreamingResponse
+from starlette.routing import Route
+from starlette.testclient import TestClient
+
+from app.utils.compression import CompressionMiddleware, negotiate_encoding
+from app.utils.etag import ETagMiddleware
+
+BODY = b'{"data":"' + b'0123456789' * 100 + b'"}'
+
+DECOMPRESS = {
+    'gzip': gzip.decompress,
+    'br': brotli.decompress,
+    'zstd': lambda data: zstandard.ZstdDecompressor().decompressobj().decompress(data),
+}
+
+
+async def chunks() -> AsyncIterator[bytes]:
+    for i in range(0, len(BODY), 100):
+        yield BODY[i : i + 100]
+
+
+async def whole(request: Request) -> Response:
+    return Response(BODY, media_type='application/json')
+
+
+async def small(request: Request) -> Response:
+    return Response(b'{}', media_type='application/json')
+
+
+async def binary(request: Request) -> Response:
+    return Response(BODY, media_type='application/octet-stream')
+
+
+async def stream(request: Request) -> Response:
+    return StreamingResponse(chunks(), media_type='application/x-ndjson')
+
+
+async def fixed_etag(request: Request) -> Response:
+    # an ETag set by the app, which doesn't tell the bodies apart
+    body = BODY.replace(b'0', request.headers.get('x-digit', '0').encode())
+    return Response(body, media_type='application/json', headers={'etag': '"fixed"'})
+
+
+def make_middleware(**kwargs) -> CompressionMiddleware:
+    app = Starlette(
+        routes=[
+            Route('/whole', whole),
+            Route('/small', small),
+            Route('/binary', binary),
+            Route('/stream', stream),
+            Route('/fixed-etag', fixed_etag),
+        ],
+    )
+    return CompressionMiddleware(ETagMiddleware(app, max_buffer_size=0), **kwargs)
+
+
+def get(client: TestClient, path: str, encoding: str, **headers: str) -> SimpleNamespace:
+    # the raw body, decoded by the tests since httpx may not support every encoding
+    with client.stream('GET', path, headers={'accept-encoding': encoding, **headers}) as response:
+        return SimpleNamespace(
+            status_code=response.status_code, headers=response.headers, body=b''.join(response.iter_raw())
+        )
+
+
+def test_negotiate_encoding():
+    encodings = ['zstd', 'br', 'gzip']
+    assert negotiate_encoding('gzip, deflate, br', encodings) == 'br'
+    assert negotiate_encoding('gzip;q=1, br;q=0.5', encodings) == 'gzip'
+    assert negotiate_encoding('*', encodings) == 'zstd'
+    assert negotiate_encoding('*, zstd;q=0', encodings) == 'br'
+    assert negotiate_encoding('identity', encodings) is None
+    assert negotiate_encoding('', encodings) is None
+
+
+def test_compression():
+    middleware = make_middleware()
+    client = TestClient(middleware)
+    etag = get(client, '/whole', 'identity').headers['etag']
+    for encoding, decompress in DECOMPRESS.items():
+        response = get(client, '/whole', encoding)
+        assert response.headers['content-encoding'] == encoding
+        assert response.headers['vary'] == 'Accept-Encoding'
+        assert decompress(response.body) == BODY
+        assert int(response.headers['content-length']) == len(response.body) < len(BODY)
+        encoded_etag = response.headers['etag']
+        assert encoded_etag == f'{etag[:-1]}-{encoding}"'
+
+        response = get(client, '/whole', encoding, **{'if-none-match': encoded_etag})
+        assert response.status_code == 304
+        assert response.headers['etag'] == encoded_etag
+
+        # not the representation negotiated this time
+        assert get(client, '/whole', 'identity', **{'if-none-match': encoded_etag}).status_code == 200
+
+        response = get(client, '/stream', encoding)
+        assert response.headers['content-encoding'] == encoding
+        assert 'content-length' not in response.headers
+        assert decompress(response.body) == BODY
+
+    assert middleware.stats()['size'] == 3
+    response = get(client, '/whole', 'gzip')  # from the cache
+    assert gzip.decompress(response.body) == BODY
+    assert middleware.stats()['hits'] == 1
+
+    for path in ('/small', '/binary'):
+        response = get(client, path, 'gzip')
+        assert 'content-encoding' not in response.headers
+
+    response = get(client, '/whole', 'identity', **{'if-none-match': etag})
+    assert response.status_code == 304
+    assert response.headers['etag'] == etag
+
+
+def test_compression_weak_etag():
+    client = TestClient(make_middleware(weak_etag=True))
+    etag = get(client, '/whole', 'identity').headers['etag']
+    response = get(client, '/whole', 'br')
+    assert response.headers['etag'] == f'W/{etag}'
+
+    response = get(client, '/whole', 'br', **{'if-none-match': f'W/{etag}'})
+    assert response.status_code == 304
+    assert response.headers['etag'] == f'W/{etag}'
+
+
+def test_compression_cache():
+    middleware = make_middleware()
+    client = TestClient(middleware)
+    for digit in '0123':
+        response = get(client, '/fixed-etag', 'gzip', **{'x-digit': digit})
+        assert response.headers['etag'] == '"fixed-gzip"'
+        assert gzip.decompress(response.body) == BODY.replace(b'0', digit.encode())  # not the body cached before
+    response = get(client, '/fixed-etag?a=1', 'gzip', **{'x-digit': '3'})
+    assert gzip.decompress(response.body) == BODY.replace(b'0', b'3')
+    assert middleware.stats()['size'] == 2  # by path and query
@@ -0,0 +1,15 @@
+import pytest
+
+from app.utils.cursor import decode_cursor, encode_cursor
+from app.utils.exception import HTTPError
+
+
+def test_encode_and_decode_cursor():
+    for last_id in (0, 1, 123, 2**32 - 1):
+        cursor = encode_cursor(last_id)
+        assert '=' not in cursor
+        assert decode_cursor(cursor) == last_id
+
+    for cursor in ('', '-', 'abc', encode_cursor(-1), '测试'):
+        with pytest.raises(HTTPError):
+            decode_cursor(cursor)
@@ -0,0 +1,144 @@
+from typing import AsyncIterator
+
+import pytest
+from starlette.applications import Starlette
+from starlette.requests import Request
+from starlette.responses import Response, StreamingResponse
+from starlette.routing import Route
+from starlette.testclient import TestClient
+
+from app.utils.etag import ETagMiddleware
+
+BODY = b'0123456789' * 100
+
+
+async def chunks() -> AsyncIterator[bytes]:
+    for i in range(0, len(BODY), 100):
+        yield BODY[i : i + 100]
+
+
+async def whole(request: Request) -> Response:
+    return Response(BODY)
+
+
+async def stream(request: Request) -> Response:
+    return StreamingResponse(chunks())
+
+
+async def sized_stream(request: Request) -> Response:
+    return StreamingResponse(chunks(), headers={'content-length': str(len(BODY))})
+
+
+async def not_modified(request: Request) -> Response:
+    return Response(status_code=304, headers={'etag': '"recorded"'})
+
+
+class Recorder:
+    def __init__(self) -> None:
+        self.etags: list[str] = []
+
+    def record(self, etag: str) -> None:
+        self.etags.append(etag)
+
+
+recorder = Recorder()
+
+
+async def validated(request: Request) -> Response:
+    request.scope['validator'] = recorder
+    return Response(b'short')
+
+
+def make_client(**kwargs) -> TestClient:
+    app = Starlette(
+        routes=[
+            Route('/whole', whole),
+            Route('/stream', stream),
+            Route('/sized_stream', sized_stream),
+            Route('/not_modified', not_modified),
+            Route('/validated', validated),
+        ],
+    )
+    return TestClient(ETagMiddleware(app, **kwargs))
+
+
+def test_etag():
+    client = make_client(max_buffer_size=len(BODY), hold_streams=True)
+    response = client.get('/whole')
+    etag = response.headers['etag']
+    for path in ('/stream', '/sized_stream'):  # hashed across the chunks
+        response = client.get(path)
+        assert response.content == BODY
+        assert response.headers['etag'] == etag
+
+        response = client.get(path, headers={'if-none-match': etag})
+        assert response.status_code == 304
+        assert response.content == b''
+        assert 'content-length' not in response.headers
+
+    response = client.get('/stream', headers={'if-none-match': '"other"'})
+    assert response.status_code == 200
+    assert response.content == BODY
+
+
+def test_etag_buffer_size():
+    client = make_client(max_buffer_size=len(BODY) - 1, hold_streams=True)
+    for path in ('/stream', '/sized_stream'):  # too large to hold back
+        response = client.get(path)
+        assert response.content == BODY
+        assert 'etag' not in response.headers
+
+    client = make_client(max_buffer_size=0)
+    assert 'etag' not in client.get('/stream').headers
+    assert 'etag' in client.get('/whole').headers
+
+
+def test_etag_hash():
+    response = make_client(hash='crc32', hold_streams=True).get('/stream')
+    assert response.headers['etag'].startswith(f'"{len(BODY):x}-')
+    blake2b_etag = make_client(hash='blake2b').get('/whole').headers['etag']
+    assert blake2b_etag != make_client(hash='md5').get('/whole').headers['etag']
+
+
+def test_etag_stream():
+    client = make_client(max_buffer_size=len(BODY))
+    etag = client.get('/whole').headers['etag']
+    for path in ('/stream', '/sized_stream'):
+        response = client.get(path)  # nothing to validate, so it's not held back
+        assert response.content == BODY
+        assert 'etag' not in response.headers
+
+        assert client.get(path, headers={'if-none-match': etag}).status_code == 304
+        response = client.get(path, headers={'if-none-match': '"other"'})
+        assert response.content == BODY
+        assert response.headers['etag'] == etag
+
+
+@pytest.mark.asyncio(scope='session')
+async def test_etag_stream_first_chunk():
+    sent: list[dict] = []
+
+    async def app(scope, receive, send):
+        await send({'type': 'http.response.start', 'status': 200, 'headers': []})
+        await send({'type': 'http.response.body', 'body': BODY, 'more_body': True})
+        assert len(sent) == 2  # sent before the stream ends
+        await send({'type': 'http.response.body', 'body': b''})
+
+    async def send(message):
+        sent.append(message)
+
+    scope = {'type': 'http', 'method': 'GET', 'headers': []}
+    await ETagMiddleware(app, max_buffer_size=len(BODY) * 2)(scope, None, send)  # type: ignore
+    assert len(sent) == 3
+
+
+def test_etag_validator():
+    client = make_client()
+    response = client.get('/not_modified')  # answered by the app before the body was built
+    assert response.status_code == 304
+    assert response.headers['etag'] == '"recorded"'
+
+    response = client.get('/validated')  # hashed even if it's small, to be recorded
+    etag = response.headers['etag']
+    assert recorder.etags == [etag]
+    assert client.get('/validated', headers={'if-none-match': etag}).status_code == 304
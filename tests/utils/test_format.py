@@ -0,0 +1,38 @@
+import json
+from datetime import datetime
+
+from app.models.cache import make_rows
+from app.models.user import User
+from app.utils.format import datetime_columns, models_dump, rows_dump, rows_json, rows_ndjson
+
+NOW = datetime(2024, 1, 2, 3, 4, 5, 600000)
+
+
+def test_datetime_columns():
+    assert datetime_columns([(None, 1, None), (NOW, 2, None)], range(3)) == [0]
+    assert datetime_columns([{'a': 1}, {'a': 2, 'b': NOW}], ('a', 'b')) == ['b']
+    assert datetime_columns([], range(3)) == []
+
+
+def test_rows_dump():
+    rows = make_rows(('id', 'name', 'created_at'), [(1, 'a', None), (2, '测试', NOW)])
+    expected = [
+        {'id': 1, 'name': 'a', 'created_at': None},
+        {'id': 2, 'name': '测试', 'created_at': NOW.timestamp()},
+    ]
+    assert rows_dump(rows) == expected
+    assert rows_dump(rows, convert_datetime=False)[1]['created_at'] == NOW
+    assert rows_dump([]) == []
+
+    assert json.loads(rows_json(rows)) == expected
+    assert [json.loads(line) for line in rows_ndjson(rows).splitlines()] == expected
+    assert rows_ndjson(rows).endswith(b'\n')
+
+
+def test_models_dump():
+    users = [User('a', 'x', hashed=True), User('b', 'y', hashed=True)]
+    users[1].created_at = NOW
+    dumped = models_dump(users, include={'name', 'created_at'})
+    assert dumped == [{'name': 'a'}, {'name': 'b', 'created_at': NOW.timestamp()}]  # created_at of a is not set
+    users[0].created_at = None
+    assert models_dump(users, include={'created_at'}, exclude_none=True) == [{}, {'created_at': NOW.timestamp()}]
@@ -0,0 +1,40 @@
+import asyncio
+
+import pytest
+
+from app.utils.exception import HTTPError
+from app.utils.hasher import HashExecutor
+
+
+@pytest.mark.asyncio(scope='session')
+async def test_hash_executor():
+    executor = HashExecutor(1, 0)
+    try:
+        hashed_password = await executor.hash_password('123')
+        assert await executor.verify_password(hashed_password, '123')
+
+        results = await asyncio.gather(
+            executor.hash_password('123'), executor.hash_password('123'), return_exceptions=True
+        )
+        assert isinstance(results[0], str)
+        assert isinstance(results[1], HTTPError)
+        assert results[1].status_code == 503
+
+        stats = executor.stats()
+        assert stats['pending'] == 0
+        assert stats['rejected'] == 1
+        assert stats['completed'] == 3
+        assert stats['max_time'] > 0
+
+        task = asyncio.create_task(executor.hash_password('123'))
+        await asyncio.sleep(0.01)
+        task.cancel()
+        await asyncio.sleep(0)
+        assert executor.pending == 1  # the job is still running
+        with pytest.raises(HTTPError):
+            await executor.hash_password('123')
+        while executor.pending:
+            await asyncio.sleep(0.01)
+        assert executor.stats()['completed'] == 4
+    finally:
+        executor.shutdown()
@@ -0,0 +1,65 @@
+import json
+
+from fastapi import FastAPI, Response
+from fastapi.testclient import TestClient
+
+from app.models.user import User, UserBase
+from app.router import Route
+from app.schemas.resp import Resp
+from app.utils.exception import HTTPError, http_error_handler, not_found_error
+from app.utils.response import fast_response, serialize
+
+
+def test_serialize():
+    assert serialize(Resp(data={'a': 1}), Resp, exclude_none=True) == b'{"code":0,"data":{"a":1}}'
+    assert json.loads(serialize({'msg': 'ok'}, Resp)) == {'code': 0, 'msg': 'ok', 'data': None}
+    user = User('a', 'x', hashed=True)
+    user.id = 1
+    assert json.loads(serialize(user, UserBase)) == {'id': 1, 'name': 'a'}  # no password
+    assert serialize({'token': b'abc'}) == b'{"token":"abc"}'
+
+
+def test_fast_response():
+    app = FastAPI()
+    app.router.route_class = Route
+    app.exception_handler(HTTPError)(http_error_handler)
+
+    @app.post('/resp', response_model=Resp, response_model_exclude_none=True, status_code=201)
+    @fast_response
+    async def create():
+        return Resp(msg='created')
+
+    @app.get('/user', response_model=UserBase)
+    @fast_response
+    async def get_user(id: int):
+        if id != 1:
+            raise not_found_error
+        user = User('a', 'x', hashed=True)
+        user.id = id
+        return user
+
+    @app.get('/text', response_model=Resp)
+    @fast_response
+    async def get_text():
+        return Response('text')
+
+    client = TestClient(app)
+    response = client.post('/resp')
+    assert response.status_code == 201
+    assert response.content == b'{"code":0,"msg":"created"}'
+    assert response.headers['content-type'] == 'application/json'
+
+    assert client.get('/user?id=1').json() == {'id': 1, 'name': 'a'}
+    response = client.get('/user?id=2')
+    assert response.status_code == 404
+    assert response.content == not_found_error.body
+    assert client.get('/user?id=a').status_code == 422  # the parameters are still validated
+    assert client.get('/text').text == 'text'
+
+    schema = app.openapi()['paths']['/user']['get']['responses']['200']['content']['application/json']['schema']
+    assert schema == {'$ref': '#/components/schemas/UserBase'}
+
+
+def test_error_body():
+    assert json.loads(not_found_error.body) == {'code': not_found_error.code, 'msg': 'Not Found'}
+    assert not_found_error.body is not_found_error.body
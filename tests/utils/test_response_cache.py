@@ -0,0 +1,149 @@
+import asyncio
+
+import pytest
+from httpx import ASGITransport, AsyncClient
+from starlette.applications import Starlette
+from starlette.middleware import Middleware
+from starlette.requests import Request
+from starlette.responses import Response, StreamingResponse
+from starlette.routing import Route
+
+from app.clients.redis import redis_client
+from app.utils.etag import ETagMiddleware
+from app.utils.exception import invalid_token_error
+from app.utils.response_cache import ResponseCacheMiddleware, cache_response
+
+calls = 0
+
+
+@cache_response(ttl=60)
+async def shared(request: Request) -> Response:
+    global calls
+    calls += 1
+    await asyncio.sleep(0.01)
+    return Response(f'{{"calls":{calls},"padding":"{"0" * 100}"}}', media_type='application/json')
+
+
+@cache_response(ttl=60)
+async def constant(request: Request) -> Response:
+    global calls
+    calls += 1
+    return Response(b'{"padding":"' + b'0' * 100 + b'"}', media_type='application/json')
+
+
+@cache_response(ttl=60, vary_user=True, vary_headers=('Accept-Language',))
+async def private(request: Request) -> Response:
+    global calls
+    calls += 1
+    return Response(f'{{"calls":{calls}}}', media_type='application/json')
+
+
+@cache_response(ttl=60)
+async def streamed(request: Request) -> Response:
+    global calls
+    calls += 1
+
+    async def chunks():
+        await asyncio.sleep(0.01)
+        yield b'{}'
+
+    return StreamingResponse(chunks(), media_type='application/json')
+
+
+async def authenticate(token: str) -> int:
+    if not token.isdigit():
+        raise invalid_token_error
+    return int(token)
+
+
+def make_client() -> tuple[AsyncClient, ResponseCacheMiddleware]:
+    app = Starlette(
+        routes=[
+            Route('/shared', shared),
+            Route('/constant', constant),
+            Route('/private', private),
+            Route('/streamed', streamed),
+        ],
+        middleware=[Middleware(ResponseCacheMiddleware, authenticate=authenticate), Middleware(ETagMiddleware)],
+    )
+    app.middleware_stack = app.build_middleware_stack()
+    middleware = app.middleware_stack
+    while not isinstance(middleware, ResponseCacheMiddleware):
+        middleware = middleware.app  # type: ignore
+    return AsyncClient(transport=ASGITransport(app=app), base_url='http://test'), middleware
+
+
+@pytest.mark.asyncio(scope='session')
+async def test_response_cache():
+    global calls
+    calls = 0
+    await redis_client.delete('response:/shared?', 'response:/shared?a=1', 'response:/constant?')
+    client, middleware = make_client()
+    async with client:
+        responses = await asyncio.gather(*(client.get('/shared') for _ in range(10)))
+        assert calls == 1  # the concurrent misses share one run
+        assert middleware.stats()['coalesced'] == 9
+        assert {response.json()['calls'] for response in responses} == {1}
+        etag = responses[0].headers['etag']
+        assert all(response.headers['etag'] == etag for response in responses)
+
+        response = await client.get('/shared', headers={'if-none-match': etag})
+        assert response.status_code == 304
+        assert response.headers['etag'] == etag
+        assert calls == 1
+
+        response = await client.get('/shared?a=1', headers={'if-none-match': etag})
+        assert response.status_code == 200
+        assert calls == 2
+        etag = response.headers['etag']
+        assert (await client.get('/shared?a=1', headers={'if-none-match': etag})).status_code == 304
+
+        await redis_client.delete('response:/shared?a=1')
+        middleware.cache.clear()
+        response = await client.get('/shared?a=1', headers={'if-none-match': etag})
+        assert response.status_code == 200  # run again, the calls changed
+        etag = response.headers['etag']
+        response = await client.get('/shared?a=1', headers={'if-none-match': '"other"'})
+        assert response.json()['calls'] == 3  # cached by the run with If-None-Match
+
+        etag = (await client.get('/constant', headers={'if-none-match': '"other"'})).headers['etag']
+        await redis_client.delete('response:/constant?')
+        middleware.cache.clear()
+        response = await client.get('/constant', headers={'if-none-match': etag})
+        assert response.status_code == 304  # run without If-None-Match to be cached, but answered with 304
+        assert response.content == b''
+        assert calls == 5
+        response = await client.get('/constant')
+        assert response.status_code == 200
+        assert response.headers['etag'] == etag
+        assert calls == 5
+
+        middleware.cache.clear()  # cached by another process
+        assert (await client.get('/shared')).json()['calls'] == 1
+        assert calls == 5
+
+        response = await client.get('/shared', headers={'if-modified-since': 'Thu, 01 Jan 1970 00:00:00 GMT'})
+        assert response.json()['calls'] == 6  # passed through
+    await redis_client.delete('response:/shared?', 'response:/shared?a=1', 'response:/constant?')
+
+
+@pytest.mark.asyncio(scope='session')
+async def test_response_cache_vary():
+    global calls
+    calls = 0
+    keys = ['response:/private?:1:', 'response:/private?:1:en', 'response:/private?:2:']
+    await redis_client.delete(*keys)
+    client, _ = make_client()
+    async with client:
+        assert (await client.get('/private', headers={'authorization': 'Bearer 1'})).json()['calls'] == 1
+        assert (await client.get('/private', headers={'authorization': 'Bearer 1'})).json()['calls'] == 1
+        assert (await client.get('/private', headers={'authorization': 'Bearer 2'})).json()['calls'] == 2
+        headers = {'authorization': 'Bearer 1', 'accept-language': 'en'}
+        assert (await client.get('/private', headers=headers)).json()['calls'] == 3
+        assert (await client.get('/private', headers={'authorization': 'Bearer x'})).json()['calls'] == 4
+        assert (await client.get('/private')).json()['calls'] == 5  # not authenticated
+
+        responses = await asyncio.gather(*(client.get('/streamed') for _ in range(3)))
+        assert all(response.json() == {} for response in responses)
+        assert calls == 8  # not cacheable
+    await redis_client.delete(*keys)
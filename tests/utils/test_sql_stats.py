@@ -0,0 +1,52 @@
+import logging
+
+from app.utils.sql_stats import Histogram, RequestTiming, SQLStats, fingerprint, params_shape, request_timing
+
+
+def test_fingerprint():
+    assert fingerprint('SELECT 1 FROM user WHERE id IN (%s, %s, %s)') == 'SELECT 1 FROM user WHERE id IN (...)'
+    assert fingerprint('SELECT 1 FROM user WHERE id IN (?, ?)') == 'SELECT 1 FROM user WHERE id IN (...)'
+    assert fingerprint('SELECT 1 FROM user WHERE id = %s') == 'SELECT 1 FROM user WHERE id = %s'
+
+
+def test_params_shape():
+    assert params_shape((1, 'a', None)) == '(int, str, NoneType)'
+    assert params_shape({'id': 1}) == '{id: int}'
+    assert params_shape([(1, 'a'), (2, 'b')]) == '2 x (int, str)'
+
+
+def test_histogram():
+    histogram = Histogram((0.1, 1))
+    for value in (0.05, 0.1, 0.5, 2):
+        histogram.observe(value)
+    assert histogram.stats() == {'count': 4, 'sum': 2.65, 'max': 2, 'buckets': {0.1: 2, 1: 1, float('inf'): 1}}
+
+
+def test_sql_stats(caplog):
+    stats = SQLStats(0.5, 10)
+    stats.record_query('SELECT 1', (), 0.01, 1)
+    timing = RequestTiming()
+    timing.route = 'GET /'
+    token = request_timing.set(timing)
+    try:
+        stats.record_checkout(0.002)
+        stats.record_query('SELECT * FROM user WHERE id IN (%s, %s)', (1, 2), 0.02, 2)
+        with caplog.at_level(logging.WARNING):
+            stats.record_query('SELECT * FROM user WHERE id IN (%s, %s, %s)', (1, 2, 3), 0.6, 3)
+    finally:
+        request_timing.reset(token)
+    stats.record_request(timing)
+
+    assert timing.queries == 2
+    assert timing.db_time == 0.62
+    assert timing.checkout_wait == 0.002
+    assert 'SELECT * FROM user WHERE id IN (...); parameters: (int, int, int)' in caplog.text
+
+    result = stats.stats()
+    assert result['-']['queries']['SELECT 1']['count'] == 1
+    route_stats = result['GET /']
+    assert route_stats['db_time']['count'] == 1
+    assert route_stats['checkout_wait']['count'] == 1
+    query_stats = route_stats['queries']['SELECT * FROM user WHERE id IN (...)']
+    assert query_stats['count'] == 2
+    assert query_stats['rows'] == 5